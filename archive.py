@@ -0,0 +1,240 @@
+# Archive of the trajectories of every simulation
+# Each model is a directory of the archive, indexed by model_id, in a Zarr-like layout :
+# meta.json with the variable names, and a (variables, time steps) array cut in chunks,
+# each chunk compressed with zlib in its own file, so that a few variables on a time window
+# are read without decompressing the whole run
+# Results archived can be opened like a result file (see ArchivedResult), to compute new KPIs
+# on old sweeps without simulating again
+
+import os
+import json
+import zlib
+import shutil
+import fnmatch
+import numpy as np
+
+# temperatures, mass flows and pipe heat losses
+default_vars = ['*.T', '*m_flow', '*m1_flow', '*m2_flow', 'pipe_*.heatPort.Q_flow']
+
+
+def shuffle(data, itemsize) :
+    '''
+    Groups the bytes of same rank of each value, so that floats compress better (like blosc)
+    '''
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, itemsize).T.tobytes()
+
+
+def unshuffle(data, itemsize) :
+    return np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1).T.tobytes()
+
+
+def chunk_range(start, stop, size) :
+    '''
+    Returns the indexes of the chunks of length size holding steps start to stop
+    '''
+    return range(start // size, -(-stop // size))
+
+
+class TrajectoryArchive :
+    '''
+    Directory of compressed, chunked trajectories, one entry per model_id
+    '''
+
+    def __init__(self, root, chunks=(16, 1024), dtype='float32', level=6) :
+        '''
+        root : directory of the archive, created if it does not exist
+        chunks : (variables, time steps) in each chunk
+        dtype : type of the values stored, Dymola results are float32
+        level : zlib compression level
+        '''
+        self.root = root
+        self.chunks = chunks
+        self.dtype = np.dtype(dtype)
+        self.level = level
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, model_id) :
+        return os.path.join(self.root, model_id)
+
+    def meta(self, model_id) :
+        '''
+        Returns the description of the entry of model_id, links are followed
+        '''
+        with open(os.path.join(self.path(model_id), 'meta.json'), 'r') as f :
+            meta = json.load(f)
+        if 'link' in meta :
+            return self.meta(meta['link'])
+        return meta
+
+    def __contains__(self, model_id) :
+        return os.path.isfile(os.path.join(self.path(model_id), 'meta.json'))
+
+    def model_ids(self) :
+        return sorted([name for name in os.listdir(self.root) if not name.startswith('.') and name in self])
+
+    def names(self, model_id) :
+        return self.meta(model_id)['names']
+
+    def write(self, model_id, time, trajectories) :
+        '''
+        Archives trajectories, dict name -> array of same length as time
+        '''
+        names = list(trajectories)
+        self.write_rows(model_id, time, names, lambda group : np.array([trajectories[name] for name in group]))
+
+    def write_result(self, model_id, res, patterns=default_vars, extra=()) :
+        '''
+        Archives the variables of result res (DsresFile) whose names match one of patterns
+        extra : names of other variables to archive, e.g the variables of the KPIs
+        the variables are read by groups of chunks[0] variables over the whole simulation (res.get on the
+        memory-mapped result file), then cut in chunks of time steps : memory grows with the number of time steps,
+        not with the number of variables of the model
+        '''
+        extra = set(extra)
+        names = [name for name in res.names() if name != 'Time' and
+            (name in extra or any([fnmatch.fnmatchcase(name, p) for p in patterns]))]
+        self.write_rows(model_id, res.get('Time'), names, lambda group : np.array([res.get(name) for name in group]))
+
+    def write_rows(self, model_id, time, names, rows) :
+        '''
+        rows : function returning the (len(group), time steps) array of a group of names
+        the entry is written aside and renamed, so that readers never see a partial entry
+        '''
+        time = np.asarray(time, dtype=np.float64)
+        n_vars, n_steps = self.chunks
+        tmp = os.path.join(self.root, '.' + model_id + '.' + str(os.getpid()))
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        for j in range (0, len(time), n_steps) :
+            self.write_chunk(os.path.join(tmp, 'time.' + str(j // n_steps)), time[j:j+n_steps])
+        for i in range (0, len(names), n_vars) :
+            Y = np.asarray(rows(names[i:i+n_vars]), dtype=self.dtype).reshape(-1, len(time))
+            for j in range (0, len(time), n_steps) :
+                self.write_chunk(os.path.join(tmp, str(i // n_vars) + '.' + str(j // n_steps)), Y[:, j:j+n_steps])
+
+        meta = {'names' : names, 'n_steps' : len(time), 'chunks' : [n_vars, n_steps], 'dtype' : self.dtype.str}
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f :
+            json.dump(meta, f)
+        self.replace(tmp, model_id)
+
+    def write_chunk(self, path, array) :
+        array = np.ascontiguousarray(array)
+        with open(path, 'wb') as f :
+            f.write(zlib.compress(shuffle(array.tobytes(), array.itemsize), self.level))
+
+    def read_chunk(self, path, dtype, shape) :
+        with open(path, 'rb') as f :
+            data = unshuffle(zlib.decompress(f.read()), dtype.itemsize)
+        return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+    def replace(self, tmp, model_id) :
+        old = None
+        if os.path.exists(self.path(model_id)) :
+            old = tmp + '.old'
+            os.replace(self.path(model_id), old)
+        os.replace(tmp, self.path(model_id))
+        if old is not None :
+            shutil.rmtree(old, ignore_errors=True)
+
+    def link(self, model_id, target) :
+        '''
+        Records that model_id has the same trajectories as target, which are not copied
+        '''
+        if model_id == target :
+            return
+        tmp = os.path.join(self.root, '.' + model_id + '.' + str(os.getpid()))
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f :
+            json.dump({'link' : target}, f)
+        self.replace(tmp, model_id)
+
+    def target(self, model_id) :
+        '''
+        Returns the model_id whose chunks hold the trajectories of model_id
+        '''
+        with open(os.path.join(self.path(model_id), 'meta.json'), 'r') as f :
+            meta = json.load(f)
+        return self.target(meta['link']) if 'link' in meta else model_id
+
+    def time(self, model_id) :
+        '''
+        Returns the time steps of model_id
+        '''
+        meta = self.meta(model_id)
+        path = self.path(self.target(model_id))
+        n_chunks = len(chunk_range(0, meta['n_steps'], meta['chunks'][1]))
+        parts = [self.read_chunk(os.path.join(path, 'time.' + str(j)), np.dtype(np.float64), -1) for j in range (n_chunks)]
+        return np.concatenate(parts) if parts else np.empty(0)
+
+    def read(self, model_id, names=None, t_start=None, t_stop=None) :
+        '''
+        Returns time and a dict name -> values of model_id on the time window
+        only the chunks holding these variables on this window are decompressed
+        '''
+        meta = self.meta(model_id)
+        path = self.path(self.target(model_id))
+        if names is None :
+            names = meta['names']
+        index = {name : i for i, name in enumerate(meta['names'])}
+        n_vars, n_steps = meta['chunks']
+        dtype = np.dtype(meta['dtype'])
+
+        t = self.time(model_id)
+        start = 0 if t_start is None else int(np.searchsorted(t, t_start, 'left'))
+        stop = len(t) if t_stop is None else int(np.searchsorted(t, t_stop, 'right'))
+
+        values = {}
+        chunks = {} # chunk file -> array, each chunk is decompressed once
+        for name in names :
+            if name not in index :
+                raise KeyError(name + ' is not archived for ' + model_id)
+            i, k = divmod(index[name], n_vars)
+            rows = min(n_vars, len(meta['names']) - i*n_vars)
+            parts = []
+            for j in chunk_range(start, stop, n_steps) :
+                chunk = str(i) + '.' + str(j)
+                if chunk not in chunks :
+                    chunks[chunk] = self.read_chunk(os.path.join(path, chunk), dtype, (rows, -1))
+                parts.append(chunks[chunk][k, max(start - j*n_steps, 0) : stop - j*n_steps])
+            values[name] = np.concatenate(parts).astype(np.float64) if parts else np.empty(0)
+        return t[start:stop], values
+
+    def result(self, model_id) :
+        return ArchivedResult(self, model_id)
+
+
+class ArchivedResult :
+    '''
+    Archived trajectories of a model, with the reading methods of DsresFile,
+    so that kpi.result_stats and kpi.Extractor can be used on them
+    '''
+
+    def __init__(self, archive, model_id) :
+        self.archive = archive
+        self.model_id = model_id
+        self.index = set(archive.names(model_id))
+
+    def names(self) :
+        return ['Time'] + self.archive.names(self.model_id)
+
+    def __contains__(self, name) :
+        return name == 'Time' or name in self.index
+
+    def get(self, name, t_start=None, t_stop=None) :
+        if name == 'Time' :
+            return self.archive.read(self.model_id, [], t_start, t_stop)[0]
+        return self.archive.read(self.model_id, [name], t_start, t_stop)[1][name]
+
+    def read(self, names, t_start=None, t_stop=None) :
+        return self.archive.read(self.model_id, list(names), t_start, t_stop)
+
+    def close(self) :
+        pass
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *exc) :
+        self.close()
@@ -0,0 +1,340 @@
+# Simulator backends
+# A backend opens modelica files, simulates a model, gives the last error log and closes
+# 'dymola' drives Dymola through its python interface
+# 'mock' needs no licence : it writes synthetic result files with the same variables
+# as Dymola, to profile and test the whole pipeline on any machine
+
+import os
+import re
+import sys
+import time
+import zlib
+import subprocess
+import numpy as np
+from dsres import write_dsres
+from translation import DsinFile, write_dsin
+
+working_dir = os.getcwd()
+
+# update these paths according to the installation folder of Dymola
+DYMOLA_PATH = os.path.join(r'C:\Program Files\Dymola 2021x', 'bin64', 'Dymola.exe')
+EGG_PATH = os.path.join(working_dir, 'Dymola', 'interface', 'dymola.egg')
+
+
+class Backend :
+    '''
+    Interface of a simulator
+    Arguments of simulate follow the names of Dymola simulateExtendedModel
+    '''
+
+    def open(self) :
+        '''
+        Starts the simulator
+        '''
+        raise NotImplementedError
+
+    def close(self) :
+        raise NotImplementedError
+
+    def ping(self) :
+        '''
+        Raises an exception if the simulator does not answer
+        '''
+        raise NotImplementedError
+
+    def open_model(self, path) :
+        '''
+        Loads a modelica file, returns True if it succeeded
+        '''
+        raise NotImplementedError
+
+    def cd(self, path) :
+        '''
+        Changes the directory in which result files are written
+        '''
+        raise NotImplementedError
+
+    def simulate(self, problem, resultFile='res', startTime=0.0, stopTime=1.0, numberOfIntervals=500,
+            initialNames=(), initialValues=()) :
+        '''
+        Returns ok, values
+        '''
+        raise NotImplementedError
+
+    def simulate_multi(self, problem, resultFile='res', startTime=0.0, stopTime=1.0, numberOfIntervals=500,
+            initialNames=(), initialValues=()) :
+        '''
+        Simulates problem once for each row of initialValues, the model is translated once
+        the result of row k is written in resultFile + str(k+1), as Dymola simulateMultiExtendedModel does
+        Returns ok (True if every run succeeded) and the list of the ok of each run
+        by default the runs are simulated one after the other, the translation is reused
+        as long as the model has not been modified
+        '''
+        oks = [self.simulate(problem, resultFile + str(k+1), startTime, stopTime, numberOfIntervals,
+            initialNames, values)[0] for k, values in enumerate(initialValues)]
+        return all(oks), oks
+
+    def translate(self, problem) :
+        '''
+        Translates and compiles problem in the current directory (see cd)
+        Returns ok and the names of the files needed to run it : the executable and dsin.txt
+        '''
+        raise NotImplementedError
+
+    def run_translated(self, directory, dsin, resultFile='res') :
+        '''
+        Runs the executable translated in directory with the input file dsin,
+        the result is written in resultFile + '.mat' of the current directory
+        Returns ok
+        '''
+        raise NotImplementedError
+
+    def error_log(self) :
+        raise NotImplementedError
+
+
+class DymolaBackend(Backend) :
+
+    def __init__(self, dymola_path=DYMOLA_PATH, egg_path=EGG_PATH) :
+        self.dymola_path = dymola_path
+        self.egg_path = egg_path
+        self.dymola = None
+        self.workdir = working_dir
+        self.log = ''
+
+    def open(self) :
+        if self.egg_path not in sys.path :
+            sys.path.insert(0, self.egg_path)
+        from dymola.dymola_interface import DymolaInterface
+        self.dymola = DymolaInterface(self.dymola_path)
+
+    def close(self) :
+        if self.dymola is not None :
+            self.dymola.close()
+        self.dymola = None
+
+    def ping(self) :
+        self.dymola.ExecuteCommand('1')
+
+    def open_model(self, path) :
+        return self.dymola.openModel(path=path, changeDirectory=False)
+
+    def cd(self, path) :
+        self.dymola.cd(path)
+        self.workdir = path
+
+    def simulate(self, problem, resultFile='res', startTime=0.0, stopTime=1.0, numberOfIntervals=500,
+            initialNames=(), initialValues=()) :
+        self.log = ''
+        return self.dymola.simulateExtendedModel(problem=problem, resultFile=resultFile,
+            startTime=startTime, stopTime=stopTime, numberOfIntervals=numberOfIntervals,
+            initialNames=list(initialNames), initialValues=list(initialValues))
+
+    def simulate_multi(self, problem, resultFile='res', startTime=0.0, stopTime=1.0, numberOfIntervals=500,
+            initialNames=(), initialValues=()) :
+        # the model is translated once, then the executable is run for each row of initialValues
+        self.log = ''
+        ok, values = self.dymola.simulateMultiExtendedModel(problem=problem, resultFile=resultFile,
+            startTime=startTime, stopTime=stopTime, numberOfIntervals=numberOfIntervals,
+            initialNames=list(initialNames), initialValues=[list(v) for v in initialValues], finalNames=[])
+        # Dymola only tells if all runs succeeded, the result files tell which ones did
+        return ok, [os.path.isfile(os.path.join(self.workdir, resultFile + str(k+1) + '.mat')) for k in range (len(initialValues))]
+
+    def translate(self, problem) :
+        self.log = ''
+        ok = self.dymola.translateModel(problem)
+        # dymosim.exe needs the dlls written next to it on Windows
+        files = [name for name in os.listdir(self.workdir) if name.startswith('dymosim') or name.endswith('.dll')]
+        return ok and bool(files), files + ['dsin.txt']
+
+    def run_translated(self, directory, dsin, resultFile='res') :
+        executable = [os.path.join(directory, name) for name in ['dymosim.exe', 'dymosim'] if os.path.isfile(os.path.join(directory, name))]
+        result = os.path.join(self.workdir, resultFile + '.mat')
+        try :
+            p = subprocess.run(executable[:1] + ['-s', dsin, result], cwd=self.workdir, capture_output=True, text=True)
+        except OSError as e :
+            self.log = str(e)
+            return False
+        self.log = p.stdout + p.stderr
+        if os.path.isfile(os.path.join(self.workdir, 'dslog.txt')) :
+            with open(os.path.join(self.workdir, 'dslog.txt'), 'r', errors='replace') as f :
+                self.log = f.read()
+        return p.returncode == 0 and os.path.isfile(result)
+
+    def error_log(self) :
+        # log of the last executable run, or of the last call to Dymola
+        if self.log :
+            return self.log
+        return self.dymola.getLastErrorLog()
+
+
+# variables written by the mock backend for each type of component
+# with the order of magnitude of their steady state value
+mock_variables = {
+    'Buildings.Fluid.HeatPumps.Carnot_TCon' : {'P' : 1e5, 'QCon_flow' : 4e5, 'QEva_flow' : -3e5, 'm1_flow' : 5, 'm2_flow' : 5},
+    'Buildings.Fluid.Boilers.BoilerPolynomial' : {'QFue_flow' : 5e5, 'Q_flow' : 4.5e5, 'y' : 0.5, 'T' : 338., 'm_flow' : 5},
+    'Buildings.Fluid.HeatExchangers.PlateHeatExchangerEffectivenessNTU' : {'m1_flow' : 1, 'm2_flow' : 1, 'Q1_flow' : -1e5, 'Q2_flow' : 1e5,
+        'sta_b1.T' : 320., 'sta_b2.T' : 330.},
+    'Buildings.Fluid.FixedResistances.Pipe' : {'m_flow' : 1, 'dp' : 1e3, 'heatPort.Q_flow' : -1e3},
+    'Buildings.Fluid.Actuators.Valves.TwoWayLinear' : {'y_actual' : 0.5, 'm_flow' : 1, 'dp' : 1e4},
+    'Buildings.Fluid.Sensors.Temperature' : {'T' : 320.},
+    'Modelica.Blocks.Continuous.LimPID' : {'y' : 0.5, 'u_s' : 330., 'u_m' : 330.},
+    'Modelica.Blocks.Sources.RealExpression' : {'y' : 330.},
+    }
+
+# parameters with a default value in the library, not always given as modifiers by PyToMod
+mock_parameters = {'Modelica.Blocks.Sources.Constant' : {'k' : 1.}}
+
+# declarations written by PyToMod : "type name (" at the beginning of a line
+declaration = re.compile(r'^([A-Za-z_][\w]*(?:\.[\w]+)+)\s+(\w+)\s*\(', re.M)
+
+# steady state monitor written by PyToMod.set_steady_monitor
+monitor_parameter = re.compile(r'^parameter Real steady_(window|rtol|atol)(?:\([^)]*\))?\s*=\s*([-+0-9.eE]+)', re.M)
+monitor_variables = re.compile(r'^Real steady_u\[\d+\] = (.*?) "key variables";$', re.M)
+
+
+class MockBackend(Backend) :
+    '''
+    Offline simulator for benchmarks and tests
+    Trajectories are first order responses towards a steady state value
+    which only depends on the variable name, so results are reproducible
+    '''
+
+    def __init__(self, duration=0., tau=600.) :
+        '''
+        duration : wall time spent in each simulation, to emulate a simulator
+        tau : time constant of the synthetic trajectories (s)
+        '''
+        self.duration = duration
+        self.tau = tau
+        self.models = {}
+        self.workdir = working_dir
+        self.log = ''
+        self.is_open = False
+
+    def open(self) :
+        self.is_open = True
+
+    def close(self) :
+        self.is_open = False
+        self.models = {}
+
+    def ping(self) :
+        if not self.is_open :
+            raise RuntimeError('mock backend is closed')
+
+    def open_model(self, path) :
+        if not os.path.isfile(path) :
+            self.log = 'file not found : ' + path
+            return False
+        with open(path, 'r') as f :
+            txt = f.read()
+        for match in re.finditer(r'^model (\w+)\s*$', txt, re.M) :
+            name = match.group(1)
+            end = re.compile(r'^\s*end ' + name + r'\s*;', re.M).search(txt, match.end())
+            if end is not None :
+                self.models[name] = txt[match.start():end.end()]
+        return True
+
+    def cd(self, path) :
+        self.workdir = path
+
+    def trajectory(self, name, scale, t) :
+        '''
+        First order response of variable name, deterministic
+        '''
+        h = zlib.crc32(name.encode())
+        ss = scale * (0.5 + (h % 1000) / 1000)
+        y0 = ss * (0.8 + ((h >> 10) % 400) / 1000)
+        return ss + (y0 - ss) * np.exp(-t / self.tau)
+
+    def steady_stop(self, txt, scales, stopTime) :
+        '''
+        Time at which the steady state monitor of the model terminates the simulation, stopTime if it does not
+        only the scalar variables of the monitor are checked, as the arrays of components are not emulated
+        '''
+        variables = monitor_variables.search(txt)
+        if variables is None :
+            return stopTime
+        p = {name : float(value) for name, value in monitor_parameter.findall(txt)}
+        names = [name for name in re.findall(r'[\w.]+', variables.group(1)) if name in scales]
+        samples = np.arange(1, int(stopTime // p['window']) + 1) * p['window']
+        last, count = np.zeros(len(names)), 0
+        for s in samples :
+            u = np.array([self.trajectory(name, scales[name], s) for name in names])
+            count = count + 1 if np.all(np.abs(u - last) <= p['atol'] + p['rtol']*np.abs(u)) else 0
+            last = u
+            if count >= 2 :
+                return s
+        return stopTime
+
+    def write_result(self, txt, resultFile, t, parameters) :
+        scales = {}
+        for type, name in declaration.findall(txt) :
+            for var, scale in mock_variables.get(type, {}).items() :
+                scales[name + '.' + var] = scale
+        # as Dymola, the output grid stops at the time of terminate
+        stop = self.steady_stop(txt, scales, t[-1])
+        if stop < t[-1] :
+            t = np.append(t[t < stop], stop)
+        trajectories = {name : self.trajectory(name, scale, t) for name, scale in scales.items()}
+        if self.duration :
+            time.sleep(self.duration)
+        write_dsres(os.path.join(self.workdir, resultFile + '.mat'), t, trajectories, parameters)
+        self.log = ''
+
+    def simulate(self, problem, resultFile='res', startTime=0.0, stopTime=1.0, numberOfIntervals=500,
+            initialNames=(), initialValues=()) :
+        model_name = problem.split('.')[-1]
+        if model_name not in self.models :
+            self.log = 'Model ' + problem + ' not found'
+            return False, []
+        t = np.linspace(startTime, stopTime, numberOfIntervals+1)
+        self.write_result(self.models[model_name], resultFile, t, dict(zip(initialNames, initialValues)))
+        return True, []
+
+    def translate(self, problem) :
+        '''
+        The executable of the mock is the model script, dsin.txt has the numerical modifiers of the declarations
+        '''
+        model_name = problem.split('.')[-1]
+        if model_name not in self.models :
+            self.log = 'Model ' + problem + ' not found'
+            return False, []
+        txt = self.models[model_name]
+        parameters = {}
+        for block in re.finditer(r'^([A-Za-z_][\w]*(?:\.[\w]+)+)\s+(\w+)\s*\(([^;]*?)\)\s*;?\s*$', txt, re.M) :
+            type, name = block.group(1), block.group(2)
+            for param, value in mock_parameters.get(type, {}).items() :
+                parameters[name + '.' + param] = value
+            for param, expr in re.findall(r'^\s*(\w+)\s*=\s*([-+0-9.eE ]+?)\s*,?\s*$', block.group(3), re.M) :
+                parameters[name + '.' + param] = sum([float(x) for x in re.findall(r'[-+]?[0-9.]+(?:[eE][-+]?[0-9]+)?', expr)])
+        with open(os.path.join(self.workdir, 'dymosim.mo'), 'w') as f :
+            f.write(txt)
+        write_dsin(os.path.join(self.workdir, 'dsin.txt'), list(parameters), list(parameters.values()))
+        self.log = ''
+        return True, ['dymosim.mo', 'dsin.txt']
+
+    def run_translated(self, directory, dsin, resultFile='res') :
+        with open(os.path.join(directory, 'dymosim.mo'), 'r') as f :
+            txt = f.read()
+        d = DsinFile(dsin)
+        start, stop, increment, n = d.experiment[:4]
+        t = np.linspace(start, stop, int(n)+1)
+        self.write_result(txt, resultFile, t, {name : row[1] for name, row in zip(d.names, d.values)})
+        return True
+
+    def error_log(self) :
+        return self.log
+
+
+backends = {'dymola' : DymolaBackend, 'mock' : MockBackend}
+
+
+def get_backend(name, **kwargs) :
+    '''
+    Returns a new backend
+    name : 'dymola' or 'mock'
+    kwargs : passed to the backend
+    '''
+    return backends[name](**kwargs)
@@ -0,0 +1,80 @@
+# Benchmark of model generation for districts of increasing size
+# measures Tree / district construction, PyToMod.write_model with and without annotations,
+# with arrays of components, pipe_length
+# and writing the model in a single-file package and in a package directory
+# python bench.py [sizes...]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from district import create_district, connect_district
+from pyToMod import PyToMod
+from package import PackageFile, PackageDirectory
+
+sizes = [10, 100, 1000, 10000]
+n_pipes = 3
+source = 'gas_boiler'
+
+
+def timed(f, repeat=3) :
+    '''
+    Returns the result of f and its best wall time over repeat runs (s)
+    '''
+    best = float('inf')
+    for i in range (repeat) :
+        start = time.perf_counter()
+        res = f()
+        best = min(best, time.perf_counter() - start)
+    return res, best
+
+
+def bench(n, tmp) :
+    '''
+    Returns a dict of timings for a district of n nodes
+    '''
+    repeat = 3 if n <= 1000 else 1
+    G, t_graph = timed(lambda : connect_district(create_district(n-1, source, layout='random', seed=0)), repeat)
+
+    model = PyToMod(G, 'model_bench_'+str(n))
+    model.set_source(source)
+    model.set_n_pipes(n_pipes)
+    txt, t_model = timed(model.model_text, repeat)
+    model.set_annotations(False)
+    txt_fast, t_fast = timed(model.model_text, repeat)
+    model.set_annotations(True)
+    model.set_arrays(True)
+    txt_arrays, t_arrays = timed(model.model_text, repeat)
+    model.set_arrays(False)
+    L, t_length = timed(model.pipe_length, repeat)
+
+    file_name = os.path.join(tmp, 'Bench.mo')
+    with open(file_name, 'w') as f :
+        f.write('within ;\npackage Bench\n\nend Bench;')
+    package = PackageFile(file_name)
+    package.write(model.model_name, txt) # first write appends, the next ones rewrite in place
+    t, t_file = timed(lambda : package.write(model.model_name, txt), repeat)
+    directory = PackageDirectory(os.path.join(tmp, 'BenchDir'))
+    t, t_dir = timed(lambda : directory.write(model.model_name, txt), repeat)
+
+    return {'nodes' : n, 'graph (s)' : t_graph, 'write_model (s)' : t_model, 'pipe_length (s)' : t_length,
+        'file write (s)' : t_file, 'dir write (s)' : t_dir, 'lines' : txt.count('\n'), 'MB' : len(txt)/1e6,
+        'write_model no annotations (s)' : t_fast, 'MB no annotations' : len(txt_fast)/1e6,
+        'write_model arrays (s)' : t_arrays, 'MB arrays' : len(txt_arrays)/1e6}
+
+
+if __name__ == '__main__' :
+    if len(sys.argv) > 1 :
+        sizes = [int(a) for a in sys.argv[1:]]
+    tmp = tempfile.mkdtemp()
+    rows = []
+    try :
+        for n in sizes :
+            rows.append(bench(n, tmp))
+            print(rows[-1])
+    finally :
+        shutil.rmtree(tmp)
+
+    import pandas as pd
+    print(pd.DataFrame(rows).to_string(index=False, float_format=lambda x : '%.4g' % x))
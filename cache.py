@@ -0,0 +1,188 @@
+# Content-addressed cache of simulation results
+# A result is stored under a hash of the generated model (without its name),
+# of init_names / init_val and of the simulation settings
+# A configuration (graph, source, n_pipes, parameters) is also hashed before the model
+# is generated : it points to the result key, so that a hit skips generation and simulation
+# Least recently used entries are evicted above max_entries or max_bytes,
+# with the configurations pointing to them
+
+import os
+import json
+import hashlib
+
+# generated models depend on these files : a modification invalidates configuration keys
+generator_files = ['pyToMod.py', 'arg.py']
+
+
+def _hash(obj) :
+    txt = json.dumps(obj, sort_keys=True, default=str)
+    return hashlib.sha256(txt.encode()).hexdigest()
+
+
+def _generator_hash() :
+    h = hashlib.sha256()
+    for name in generator_files :
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), 'rb') as f :
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def model_body(txt) :
+    '''
+    Returns the script of a model without the lines 'model name' and 'end name;'
+    '''
+    return txt.strip().split('\n', 1)[1].rsplit('\n', 1)[0]
+
+
+class ResultCache :
+    '''
+    Result rows stored on disk, one json file per entry
+    '''
+
+    def __init__(self, root='cache', max_entries=100000, max_bytes=None) :
+        '''
+        root : directory of the cache
+        max_entries : maximum number of results kept
+        max_bytes : maximum size of the results on disk, None for no limit
+        '''
+        self.root = root
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.generator = _generator_hash()
+        os.makedirs(os.path.join(root, 'results'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'configs'), exist_ok=True)
+
+        # key -> (last use, size), read once
+        self.entries = {}
+        for entry in os.scandir(os.path.join(root, 'results')) :
+            if entry.name.endswith('.json') :
+                st = entry.stat()
+                self.entries[entry.name[:-5]] = (st.st_mtime, st.st_size)
+        self.size = sum([size for t, size in self.entries.values()])
+
+        # configuration key -> result key, configurations of evicted or missing results are removed
+        self.configs = {}
+        for entry in os.scandir(os.path.join(root, 'configs')) :
+            try :
+                with open(entry.path, 'r') as f :
+                    key = f.read()
+            except OSError :
+                continue
+            if key in self.entries :
+                self.configs[entry.name] = key
+                self.size += entry.stat().st_size
+            else :
+                self.remove_config(entry.name)
+        self.linked = {} # result key -> configuration keys
+        for config_key, key in self.configs.items() :
+            self.linked.setdefault(key, set()).add(config_key)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, txt, init_names, init_val, settings={}) :
+        '''
+        Key of a result : hash of the model script, parameters and simulation settings
+        '''
+        return _hash([model_body(txt), list(init_names), [float(v) for v in init_val], settings])
+
+    def config_key(self, graph, source, n_pipes, init_names, init_val, settings={}) :
+        '''
+        Key of a configuration, computed without generating the model
+        nodes and edges are kept in order, since the order changes the generated model
+        '''
+        nodes = [[str(node), graph.nodes[node]] for node in graph.nodes]
+        edges = [[str(u), str(v)] for u, v in graph.edges]
+        return _hash([self.generator, nodes, edges, source, n_pipes,
+            list(init_names), [float(v) for v in init_val], settings])
+
+    def path(self, key) :
+        return os.path.join(self.root, 'results', key + '.json')
+
+    def get(self, key) :
+        '''
+        Returns the cached row or None
+        '''
+        if key not in self.entries :
+            self.misses += 1
+            return None
+        try :
+            with open(self.path(key), 'r') as f :
+                row = json.load(f)
+        except OSError :
+            del self.entries[key]
+            self.misses += 1
+            return None
+        os.utime(self.path(key))
+        self.entries[key] = (os.path.getmtime(self.path(key)), self.entries[key][1])
+        self.hits += 1
+        return row
+
+    def put(self, key, row) :
+        row = [x.item() if hasattr(x, 'item') else x for x in row] # numpy scalars
+        tmp = self.path(key) + '.tmp'
+        with open(tmp, 'w') as f :
+            json.dump(row, f)
+        os.replace(tmp, self.path(key))
+        if key in self.entries :
+            self.size -= self.entries[key][1]
+        st = os.stat(self.path(key))
+        self.entries[key] = (st.st_mtime, st.st_size)
+        self.size += st.st_size
+        self.evict()
+
+    def evict(self) :
+        '''
+        Removes least recently used results when the cache is above its limits
+        The cache is brought down to 90% of its limits, so that eviction does not run at each put
+        '''
+        too_many = len(self.entries) > self.max_entries
+        too_big = self.max_bytes is not None and self.size > self.max_bytes
+        if not (too_many or too_big) :
+            return
+        max_entries = int(0.9*self.max_entries)
+        max_bytes = None if self.max_bytes is None else int(0.9*self.max_bytes)
+        for key in sorted(self.entries, key=lambda k : self.entries[k][0]) :
+            if len(self.entries) <= max_entries and (max_bytes is None or self.size <= max_bytes) :
+                break
+            self.size -= self.entries.pop(key)[1]
+            try :
+                os.remove(self.path(key))
+            except OSError :
+                pass
+            for config_key in self.linked.pop(key, ()) :
+                del self.configs[config_key]
+                self.size -= len(key)
+                self.remove_config(config_key)
+
+    def remove_config(self, config_key) :
+        try :
+            os.remove(os.path.join(self.root, 'configs', config_key))
+        except OSError :
+            pass
+
+    def link(self, config_key, key) :
+        '''
+        Records that configuration config_key produces the result key
+        the file is counted in the size of the cache, and removed when the result is evicted
+        '''
+        with open(os.path.join(self.root, 'configs', config_key), 'w') as f :
+            f.write(key)
+        old = self.configs.get(config_key)
+        if old is not None :
+            self.linked[old].discard(config_key)
+            self.size -= len(old)
+        self.configs[config_key] = key
+        self.linked.setdefault(key, set()).add(config_key)
+        self.size += len(key)
+
+    def lookup(self, config_key) :
+        '''
+        Returns the cached row of a configuration, without generating its model, or None
+        '''
+        try :
+            with open(os.path.join(self.root, 'configs', config_key), 'r') as f :
+                key = f.read()
+        except OSError :
+            self.misses += 1
+            return None
+        return self.get(key)
@@ -0,0 +1,89 @@
+# Generation of districts of any size
+# Graphs have the same attributes as create_G in simul.py :
+# pos, T_heating, T_DHW and is_supply_heating on nodes, direction on edges
+# The supply node is the first node, buildings are named Building_1 ... Building_n
+
+import numpy as np
+import networkx as nx
+from tree import Tree
+
+layouts = ['grid', 'random', 'clusters']
+
+
+def building_positions(n, layout='grid', spacing=100., n_clusters=None, rng=None) :
+    '''
+    Returns an (n, 2) array of building positions
+    layout : 'grid' (square grid), 'random' (uniform in a square) or 'clusters' (groups of buildings)
+    spacing : average distance between neighbouring buildings (m)
+    '''
+    rng = np.random.default_rng(rng)
+    side = int(np.ceil(np.sqrt(n)))
+    if layout == 'grid' :
+        i = np.arange(n)
+        return spacing * np.stack([i % side + 1, i // side + 1], axis=1).astype(float)
+    elif layout == 'random' :
+        return rng.uniform(0, spacing*side, (n, 2))
+    elif layout == 'clusters' :
+        if n_clusters is None :
+            n_clusters = max(1, int(np.sqrt(n) / 2))
+        centers = rng.uniform(0, spacing*side, (n_clusters, 2))
+        which = rng.integers(0, n_clusters, n)
+        return np.abs(centers[which] + rng.normal(0, spacing*np.sqrt(n/n_clusters)/2, (n, 2)))
+    raise ValueError('unknown layout ' + str(layout))
+
+
+def create_district(n_buildings, supply_name='gas_boiler', layout='grid', spacing=100., mix=(0.4, 0.3, 0.3),
+        T_heating=45, T_DHW=60, seed=None) :
+    '''
+    Returns a networkx graph with a supply node at (0,0) and n_buildings buildings
+    no edges between nodes yet
+    mix : fractions of buildings needing heating only, DHW only, both
+    '''
+    rng = np.random.default_rng(seed)
+    pos = building_positions(n_buildings, layout, spacing, rng=rng)
+    demand = rng.choice(3, size=n_buildings, p=np.asarray(mix)/np.sum(mix))
+
+    G = nx.Graph()
+    G.add_node(supply_name, pos=(0., 0.), is_supply_heating=True)
+    for i in range (n_buildings) :
+        G.add_node('Building_'+str(i+1), pos=(float(pos[i,0]), float(pos[i,1])),
+            T_heating=T_heating if demand[i] != 1 else 0,
+            T_DHW=T_DHW if demand[i] != 0 else 0,
+            is_supply_heating=False)
+    return G
+
+
+def connect_district(G, method='mst', seed=None) :
+    '''
+    Adds the edges of a tree network to G, in place
+    method : 'mst' shortest total pipe length (Prim, O(n²) with numpy)
+             'prufer' random tree, decoded from a random Prüfer sequence
+    '''
+    nodes = list(G.nodes)
+    n = len(nodes)
+    if method == 'prufer' :
+        rng = np.random.default_rng(seed)
+        Tree(G).construct_tree(list(rng.integers(0, n, n-2)))
+        return G
+    if method != 'mst' :
+        raise ValueError('unknown method ' + str(method))
+
+    pos = np.array([G.nodes[node]['pos'] for node in nodes], dtype=float)
+    # Prim algorithm from the supply : best[i] is the distance from i to the tree
+    best = np.sqrt(np.sum((pos - pos[0])**2, axis=1))
+    parent = np.zeros(n, dtype=int)
+    in_tree = np.zeros(n, dtype=bool)
+    in_tree[0] = True
+    best[0] = np.inf
+    for k in range (n-1) :
+        i = int(np.argmin(best))
+        G.add_edge(nodes[parent[i]], nodes[i])
+        in_tree[i] = True
+        best[i] = np.inf
+        d = np.sqrt(np.sum((pos - pos[i])**2, axis=1))
+        closer = (d < best) & ~in_tree
+        best[closer] = d[closer]
+        parent[closer] = i
+
+    nx.set_edge_attributes(G, 'a', 'direction')
+    return G
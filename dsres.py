@@ -0,0 +1,195 @@
+# Dymola result files (dsres format)
+# They are MAT v4 files containing the matrices
+# Aclass, name, description, dataInfo, data_1 (parameters) and data_2 (trajectories)
+# names and descriptions are stored transposed (binTrans) : one column per variable
+# data_2 is stored with one column per time step, the first row is Time
+
+import numpy as np
+
+# MAT v4 type codes : 1000*M + 100*O + 10*P + T
+# M=0 little endian, P=0 double, P=1 float, P=2 int32, P=5 uint8, T=1 text
+mat4_types = {0 : np.float64, 10 : np.float32, 20 : np.int32, 51 : np.uint8}
+
+
+def write_matrix(f, name, matrix, type) :
+    '''
+    Writes one MAT v4 matrix
+    matrix : 2D array, written in column-major order
+    '''
+    matrix = np.asarray(matrix, dtype=mat4_types[type])
+    mrows, ncols = matrix.shape
+    header = np.array([type, mrows, ncols, 0, len(name)+1], dtype=np.int32)
+    f.write(header.tobytes())
+    f.write(name.encode('ascii') + b'\0')
+    f.write(matrix.tobytes(order='F'))
+
+
+def char_matrix(strings, transpose=False) :
+    '''
+    Returns strings padded with blanks as a uint8 matrix, one string per row
+    or one string per column if transpose
+    '''
+    width = max([len(s) for s in strings] + [1])
+    m = np.full((len(strings), width), ord(' '), dtype=np.uint8)
+    for i, s in enumerate(strings) :
+        m[i, :len(s)] = np.frombuffer(s.encode('ascii'), dtype=np.uint8)
+    if transpose :
+        return m.T
+    return m
+
+
+def write_dsres(path, time, trajectories, parameters={}) :
+    '''
+    Writes a result file readable by sdf.load or DyMat
+    time : array of time steps
+    trajectories : dict name -> array of same length as time
+    parameters : dict name -> value, constant over the simulation
+    '''
+    time = np.asarray(time, dtype=np.float64)
+    names = ['Time'] + list(parameters) + list(trajectories)
+
+    # dataInfo columns : [matrix (0 abscissa, 1 data_1, 2 data_2), index, interpolation, extrapolation]
+    info = np.zeros((4, len(names)), dtype=np.int32)
+    info[:, 0] = [0, 1, 0, -1]
+    n_par = len(parameters)
+    for i in range (n_par) :
+        info[:, 1+i] = [1, 2+i, 0, 0]
+    for i in range (len(trajectories)) :
+        info[:, 1+n_par+i] = [2, 2+i, 0, -1]
+
+    # data_1 : first row is start time and stop time, then one row per parameter
+    data_1 = np.zeros((1+n_par, 2))
+    data_1[0] = [time[0], time[-1]]
+    data_1[1:] = np.array([[v, v] for v in parameters.values()]).reshape(n_par, 2)
+
+    data_2 = np.empty((1+len(trajectories), len(time)))
+    data_2[0] = time
+    for i, y in enumerate(trajectories.values()) :
+        data_2[1+i] = y
+
+    with open(path, 'wb') as f :
+        write_matrix(f, 'Aclass', char_matrix(['Atrajectory', '1.1', '', 'binTrans']), 51)
+        write_matrix(f, 'name', char_matrix(names, transpose=True), 51)
+        write_matrix(f, 'description', char_matrix(['' for n in names], transpose=True), 51)
+        write_matrix(f, 'dataInfo', info, 20)
+        write_matrix(f, 'data_1', data_1, 10)
+        write_matrix(f, 'data_2', data_2, 10)
+
+
+def mat4_dtype(type) :
+    '''
+    Returns the numpy dtype of MAT v4 type code type (any byte order)
+    '''
+    order = '<' if type // 1000 == 0 else '>'
+    return np.dtype(np.dtype(mat4_types[type % 1000]).newbyteorder(order))
+
+
+class DsresFile :
+    '''
+    Dymola result file opened without loading it
+    Only the headers, names and dataInfo are read, data_1 and data_2 are memory-mapped,
+    so that reading a few variables on a time window only touches the corresponding pages
+    '''
+
+    def __init__(self, path) :
+        '''
+        path : result file, e.g 'res.mat'
+        '''
+        self.path = path
+        self.matrices = {} # name -> (dtype, mrows, ncols, offset of the data)
+        with open(path, 'rb') as f :
+            f.seek(0, 2)
+            size = f.tell()
+            offset = 0
+            while offset < size :
+                f.seek(offset)
+                header = f.read(20)
+                # the type is written in the byte order of the file : M = 0 (little endian) gives 0 <= type < 1000,
+                # a big endian header read as little endian is out of this range
+                byteorder = '<' if 0 <= np.frombuffer(header[:4], dtype='<i4')[0] < 1000 else '>'
+                type, mrows, ncols, imagf, namlen = np.frombuffer(header, dtype=byteorder + 'i4')
+                name = f.read(namlen).rstrip(b'\0').decode('ascii')
+                dtype = mat4_dtype(type)
+                offset += 20 + namlen
+                self.matrices[name] = (dtype, int(mrows), int(ncols), offset)
+                offset += int(mrows) * int(ncols) * dtype.itemsize * (2 if imagf else 1)
+
+        aclass = self.strings('Aclass')
+        self.transposed = len(aclass) > 3 and aclass[3] == 'binTrans'
+        self.index = {name : i for i, name in enumerate(self.strings('name', self.transposed))}
+        info = self.matrix('dataInfo')
+        self.info = np.array(info.T if self.transposed else info)
+        self.data = {}
+
+    def matrix(self, name) :
+        '''
+        Returns matrix name as a read-only memory map, shape (mrows, ncols)
+        '''
+        dtype, mrows, ncols, offset = self.matrices[name]
+        if mrows * ncols == 0 :
+            return np.empty((mrows, ncols), dtype=dtype)
+        return np.memmap(self.path, dtype=dtype, mode='r', offset=offset, shape=(mrows, ncols), order='F')
+
+    def strings(self, name, transpose=False) :
+        '''
+        Returns the strings of a char matrix, one per row, or one per column if transpose
+        '''
+        m = np.array(self.matrix(name))
+        if transpose :
+            m = m.T
+        return [bytes(row).decode('latin-1').rstrip(' \0') for row in m]
+
+    def trajectories(self, k) :
+        '''
+        Returns data_k with one row per variable and one column per time step
+        '''
+        if k not in self.data :
+            m = self.matrix('data_' + str(k))
+            self.data[k] = m if self.transposed else m.T
+        return self.data[k]
+
+    def names(self) :
+        return list(self.index)
+
+    def __contains__(self, name) :
+        return name in self.index
+
+    def window(self, t_start=None, t_stop=None) :
+        '''
+        Returns the slice of time steps with t_start <= Time <= t_stop
+        '''
+        t = self.trajectories(2)[0]
+        start = 0 if t_start is None else int(np.searchsorted(t, t_start, 'left'))
+        stop = len(t) if t_stop is None else int(np.searchsorted(t, t_stop, 'right'))
+        return slice(start, stop)
+
+    def get(self, name, t_start=None, t_stop=None) :
+        '''
+        Returns the values of variable name on the time window, as a float64 array
+        parameters (data_1) are returned as a constant array of the length of the window
+        '''
+        if name not in self.index :
+            raise KeyError(name + ' is not in ' + self.path)
+        matrix, i = self.info[self.index[name], :2]
+        sign = -1 if i < 0 else 1
+        window = self.window(t_start, t_stop)
+        if matrix == 1 :
+            n = len(range(*window.indices(self.trajectories(2).shape[1])))
+            return np.full(n, sign * float(self.trajectories(1)[abs(i)-1, 0]))
+        # matrix 0 is the abscissa, the first row of data_2
+        return sign * np.array(self.trajectories(2)[abs(i)-1, window], dtype=np.float64) # copy, the file can be removed
+
+    def read(self, names, t_start=None, t_stop=None) :
+        '''
+        Returns the time and a dict name -> values on the time window, for the requested variables only
+        '''
+        return self.get('Time', t_start, t_stop), {name : self.get(name, t_start, t_stop) for name in names}
+
+    def close(self) :
+        self.data = {}
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *exc) :
+        self.close()
@@ -0,0 +1,215 @@
+# Analytic steady state of tree networks
+# Flows, pressure drops, temperatures and heat losses of the pipes are computed from
+# the building demands and the pipe parameters of arg.py, without simulation
+# Every function works on a batch of trees with the same number of nodes :
+# parent[k, v] is the parent of node v in tree k, node 0 is the supply and its own parent,
+# the pipe of node v goes from parent[k, v] to v
+# Used to reject clearly dominated designs before simulation and to sanity-check results
+
+import re
+import math
+import numpy as np
+from arg import arg
+from tree import decode_batch
+
+# water around 50°C
+rho = 990.
+cp = 4180.
+mu = 5.5e-4
+roughness = 2.5e-5 # m, default of Buildings pipes
+
+
+def pipe_parameters() :
+    '''
+    Returns diameter, thicknessIns and lambdaIns of the pipes written by PyToMod (arg.py)
+    '''
+    txt = arg['Buildings.Fluid.FixedResistances.Pipe']
+    return {name : float(re.search(name + r'\s*=\s*([0-9.eE+-]+)', txt).group(1))
+        for name in ['diameter', 'thicknessIns', 'lambdaIns']}
+
+
+def orient(edges, n, root=0) :
+    '''
+    Returns the (m, n) parent arrays of trees given as (m, n-1, 2) edge arrays (e.g from tree.decode_batch)
+    the tree is walked from root one level per iteration, for all trees at once
+    '''
+    edges = np.asarray(edges).reshape(-1, n-1, 2)
+    m = len(edges)
+    rows = np.arange(m)[:, None]
+    parent = np.full((m, n), -1)
+    parent[:, root] = root
+    u, v = edges[:, :, 0], edges[:, :, 1]
+    for level in range (n) :
+        # an edge with one end in the tree and the other out of it adds the other end
+        reached_u = parent[rows, u] >= 0
+        reached_v = parent[rows, v] >= 0
+        down = reached_u & ~reached_v
+        up = reached_v & ~reached_u
+        if not (down.any() or up.any()) :
+            break
+        k, e = np.nonzero(down)
+        parent[k, v[k, e]] = u[k, e]
+        k, e = np.nonzero(up)
+        parent[k, u[k, e]] = v[k, e]
+    return parent
+
+
+def ancestors(parent) :
+    '''
+    Yields the ancestor of each node at distance 1, 2, ... until every node has reached the root
+    '''
+    rows = np.arange(len(parent))[:, None]
+    current = parent
+    while True :
+        yield current
+        if (current == 0).all() :
+            break
+        current = parent[rows, current]
+
+
+def graph_arrays(G, root, order=None) :
+    '''
+    Returns parent, length and the heating and DHW flags of the buildings of graph G, as batches of one tree
+    order : list of the nodes, root first, by default the nodes of G with root first
+    lengths are truncated to an integer, as in PyToMod
+    '''
+    if order is None :
+        order = [root] + [node for node in G.nodes if node != root]
+    index = {node : i for i, node in enumerate(order)}
+    edges = np.array([[index[u], index[v]] for u, v in G.edges]).reshape(-1, 2)
+    parent = orient(edges, len(order), 0)
+    pos = np.array([G.nodes[node]['pos'] for node in order], dtype=float)
+    heating = np.array([[G.nodes[node].get('T_heating', 0) > 0 for node in order]])
+    dhw = np.array([[G.nodes[node].get('T_DHW', 0) > 0 for node in order]])
+    return parent, pipe_lengths(parent, pos), heating, dhw
+
+
+def pipe_lengths(parent, pos) :
+    '''
+    Returns the (m, n) lengths of the pipes of each node, truncated as in PyToMod, 0 for the supply
+    pos : (n, 2) positions of the nodes, the same for every tree
+    '''
+    d = pos[parent] - pos[None, :, :]
+    return np.sqrt(np.sum(d**2, axis=2)).astype(int).astype(float)
+
+
+def pressure_drop(m_flow, length, diameter) :
+    '''
+    Darcy-Weisbach pressure drop (Pa) of pipes, laminar or Swamee-Jain friction factor
+    '''
+    area = math.pi * diameter**2 / 4
+    m = np.abs(m_flow)
+    Re = np.maximum(m * diameter / (area * mu), 1e-9)
+    with np.errstate(divide='ignore', invalid='ignore') :
+        turbulent = 0.25 / np.log10(roughness / (3.7*diameter) + 5.74 / Re**0.9)**2
+    f = np.where(Re < 2300, 64 / Re, turbulent)
+    v = m / (rho * area)
+    return f * length / diameter * rho * v**2 / 2
+
+
+def solve(parent, length, heating, dhw, n_pipes=2, m_heating=1., m_DHW=1., T_supply=273.15+65, T_low=273.15+50,
+        T_return=273.15+40, T_ground=273.15+10, eta=0.7) :
+    '''
+    Steady state of a batch of trees
+    parent, length : (m, n) arrays, see the top of the file
+    heating, dhw : (m, n) or (n,) booleans, buildings needing heat for heating, for DHW
+    m_heating, m_DHW : primary mass flow of each demand (kg/s)
+    n_pipes : 2, one supply at T_supply for every demand and one return
+              3, DHW supplied at T_supply, heating supplied at T_low, and one return
+    eta : efficiency of the pumps
+    Returns a dict of arrays :
+        m_flow (m, circuits, n) mass flow in each pipe, circuits are the supplies then the return
+        dp (m, circuits, n) pressure drop of each pipe
+        T (m, circuits, n) temperature at the end of each pipe
+        Q_loss (m, circuits, n) heat loss of each pipe
+        heat_loss (m,) total heat loss, pump_dp (m, supplies) head of each supply pump, pump_P (m,) total pump power
+    '''
+    parent = np.asarray(parent).reshape(-1, np.shape(parent)[-1])
+    m, n = parent.shape
+    length = np.broadcast_to(length, (m, n)).astype(float)
+    heating = np.broadcast_to(heating, (m, n)).astype(float)
+    dhw = np.broadcast_to(dhw, (m, n)).astype(float)
+    par = pipe_parameters()
+    r = par['diameter'] / 2
+    UA = 2 * math.pi * par['lambdaIns'] / math.log((r + par['thicknessIns']) / r) * length # W/K of each pipe
+
+    if n_pipes == 3 :
+        supplies = [(dhw*m_DHW, T_supply), (heating*m_heating, T_low)]
+    else :
+        supplies = [(dhw*m_DHW + heating*m_heating, T_supply)]
+    demand = np.stack([d for d, T in supplies] + [sum([d for d, T in supplies])], axis=1) # (m, circuits, n)
+    T_in = np.array([T for d, T in supplies] + [T_return])
+
+    # the flow of a pipe is the demand of the subtree of its node : each demand is added to all its ancestors
+    # depth is the number of pipes between the supply and each node
+    m_flow = demand.copy()
+    depth = (np.arange(n) != 0)[None, :].repeat(m, axis=0).astype(int)
+    for up in ancestors(parent) :
+        k, v = np.nonzero(up != 0)
+        depth[k, v] += 1
+        for c in range (demand.shape[1]) :
+            np.add.at(m_flow[:, c], (k, up[k, v]), demand[k, c, v])
+    m_flow[:, :, 0] = 0
+
+    dp = pressure_drop(m_flow, length[:, None, :], par['diameter'])
+
+    # pressure drop from the supply to each node, along its path
+    path_dp = dp.copy()
+    for up in ancestors(parent) :
+        path_dp += np.where((up != 0)[:, None, :], np.take_along_axis(dp, np.broadcast_to(up[:, None, :], dp.shape), axis=2), 0)
+
+    # temperatures from the supply down to the leaves, one level per iteration
+    # the return is approximated as flowing at T_return from each building to the supply
+    T = np.broadcast_to(T_in[None, :, None], dp.shape).copy()
+    with np.errstate(divide='ignore', over='ignore') :
+        decay = np.exp(-UA[:, None, :] / (np.maximum(m_flow, 1e-12) * cp))
+    for level in range (1, int(depth.max()) + 1) :
+        k, v = np.nonzero(depth == level)
+        T_up = T[k, :-1, parent[k, v]]
+        T[k, :-1, v] = T_ground + (T_up - T_ground) * decay[k, :-1, v]
+    T[:, -1, :] = T_ground + (T_return - T_ground) * decay[:, -1, :]
+    T_start = np.concatenate([np.take_along_axis(T[:, :-1, :], np.broadcast_to(parent[:, None, :], T[:, :-1, :].shape), axis=2),
+        np.full((m, 1, n), T_return)], axis=1)
+    Q_loss = m_flow * cp * (T_start - T)
+    Q_loss[:, :, 0] = 0
+
+    # each supply pump overcomes the supply and return path of its farthest building
+    served = demand[:, :-1, :] > 0
+    head = np.max(np.where(served, path_dp[:, :-1, :] + path_dp[:, -1:, :], 0), axis=2)
+    pump_P = np.sum(np.sum(demand[:, :-1, :], axis=2) * head, axis=1) / (rho * eta)
+
+    return {'m_flow' : m_flow, 'dp' : dp, 'T' : T, 'Q_loss' : Q_loss,
+        'heat_loss' : Q_loss.sum(axis=(1, 2)), 'pump_dp' : head, 'pump_P' : pump_P}
+
+
+def solve_graph(G, root, n_pipes=2, **kwargs) :
+    '''
+    Steady state of networkx tree G with supply root, see solve
+    '''
+    parent, length, heating, dhw = graph_arrays(G, root)
+    return solve(parent, length, heating, dhw, n_pipes, **kwargs)
+
+
+def solve_prufer(seqs, pos, heating, dhw, n_pipes=2, **kwargs) :
+    '''
+    Steady state of the trees of Prüfer sequences seqs (m, n-2), nodes as in tree.Tree : node 0 is the supply
+    pos : (n, 2) positions, heating, dhw : (n,) demands of the nodes
+    '''
+    pos = np.asarray(pos, dtype=float)
+    n = len(pos)
+    parent = orient(decode_batch(seqs, n), n)
+    return solve(parent, pipe_lengths(parent, pos), heating, dhw, n_pipes, **kwargs)
+
+
+def pareto_front(costs) :
+    '''
+    Returns a boolean mask of the rows of costs (m, k) that no other row dominates
+    (lower or equal on every cost and lower on one), lower costs are better
+    '''
+    costs = np.asarray(costs, dtype=float)
+    keep = np.ones(len(costs), dtype=bool)
+    for i in range (len(costs)) :
+        if keep[i] :
+            dominated = np.all(costs[i] <= costs, axis=1) & np.any(costs[i] < costs, axis=1)
+            keep[dominated] = False
+    return keep
@@ -0,0 +1,149 @@
+# Post-processing of simulation results
+# The steady state window is found once per result, then the statistics of all
+# requested variables are computed together on a (variables, time steps) array
+
+import numpy as np
+
+stat_names = ['mean', 'integral', 'min', 'max', 'drift']
+
+
+def window_start(t, t_steady) :
+    '''
+    Returns the index of the first time step with t >= t_steady
+    '''
+    return int(np.searchsorted(t, t_steady, 'left'))
+
+
+def final_window(t, window) :
+    '''
+    Returns the index of the first time step of the last window seconds of the result
+    '''
+    return window_start(t, t[-1] - window)
+
+
+def detect_steady(t, Y, rtol=1e-3, atol=1e-6, min_duration=300.) :
+    '''
+    Returns the index from which every row of Y stays close to its final value, and whether steady state is reached
+    t : time steps, Y : (variables, time steps) array
+    a value is close if |y - y_final| <= atol + rtol*|y_final|
+    if less than min_duration seconds are left after this index, steady state is not reached
+    and the index of the last min_duration seconds is returned
+    '''
+    Y = np.atleast_2d(Y)
+    far = np.abs(Y - Y[:, -1:]) > atol + rtol*np.abs(Y[:, -1:])
+    # last time step far from the final value, for each variable
+    last = np.where(far.any(axis=1), Y.shape[1] - 1 - np.argmax(far[:, ::-1], axis=1), -1)
+    start = int(np.max(last)) + 1 if len(last) else 0
+    if start >= len(t) or t[-1] - t[start] < min_duration :
+        return window_start(t, t[-1] - min_duration), False
+    return start, True
+
+
+def window_stats(t, Y, start) :
+    '''
+    Returns a dict stat name -> array of one value per row of Y, on the window t[start:]
+    mean : average of the values, like np.average
+    integral : trapezoidal integral over time
+    drift : slope of the least squares line (unit/s), close to 0 in steady state
+    the statistics of an empty window are nan
+    '''
+    Y = np.atleast_2d(Y)[:, start:]
+    t = np.asarray(t[start:], dtype=np.float64)
+    if not len(t) : # the result ends before the window, e.g a short run read with t_steady
+        return {s : np.full(len(Y), np.nan) for s in stat_names}
+    stats = {'mean' : Y.mean(axis=1), 'min' : Y.min(axis=1), 'max' : Y.max(axis=1)}
+    dt = np.diff(t)
+    stats['integral'] = np.sum(dt * (Y[:, 1:] + Y[:, :-1]) / 2, axis=1)
+    tc = t - t.mean()
+    norm = np.sum(tc**2)
+    stats['drift'] = (Y - stats['mean'][:, None]) @ tc / norm if norm > 0 else np.zeros(len(Y))
+    return stats
+
+
+def result_stats(res, names, t_steady=None, window=None, **kwargs) :
+    '''
+    Returns the statistics of variables names of a result, and the steady state window
+    res : result file opened with DsresFile
+    t_steady : start of the steady state window (s), None to detect it on these variables
+    window : length of the steady state window (s) at the end of the result, used instead of t_steady
+             for simulations terminated by a steady state monitor (see PyToMod.set_steady_monitor)
+    kwargs : passed to detect_steady
+    Returns dict name -> dict stat name -> value, and (start time, steady state reached)
+    '''
+    t, values = res.read(names)
+    Y = np.array([values[name] for name in names]).reshape(len(names), len(t))
+    if window is not None :
+        start, steady = final_window(t, window), True
+    elif t_steady is None :
+        start, steady = detect_steady(t, Y, **kwargs)
+    else :
+        start, steady = window_start(t, t_steady), True
+    stats = window_stats(t, Y, start)
+    found = (float(t[start]), steady) if start < len(t) else (float('nan'), False) # empty window
+    return {name : {s : float(stats[s][i]) for s in stat_names} for i, name in enumerate(names)}, found
+
+
+reducers = {'sum' : np.sum, 'mean' : np.mean, 'min' : np.min, 'max' : np.max}
+
+
+class Extractor :
+    '''
+    Row of KPIs of a result, compiled once from a declarative spec
+    '''
+
+    def __init__(self, spec, columns=None) :
+        '''
+        spec : dict column -> dict with keys
+            'vars' : variables of the result file
+            'stat' : statistic of each variable on the steady state window, 'mean' by default (see window_stats)
+            'reduce' : how the values of several variables are combined, 'sum' by default (see reducers)
+            'scale' : factor applied to the value, 1 by default
+            or 'value' : constant value of the column
+        columns : order of the values returned, the columns missing from spec are nan
+        '''
+        if columns is None :
+            columns = list(spec)
+        self.columns = list(columns)
+        # every variable is read once, even if it is used by several columns
+        self.names = []
+        for column in self.columns :
+            for name in spec.get(column, {}).get('vars', []) :
+                if name not in self.names :
+                    self.names.append(name)
+
+        # column -> (constant, stat, indexes of the variables in self.names, reducer, scale)
+        self.compiled = []
+        for column in self.columns :
+            s = spec.get(column, {'value' : np.nan})
+            if 'vars' not in s :
+                self.compiled.append((s['value'], None, None, None, None))
+                continue
+            if s.get('stat', 'mean') not in stat_names :
+                raise ValueError('unknown statistic ' + str(s['stat']) + ' for ' + column)
+            index = np.array([self.names.index(name) for name in s['vars']], dtype=int)
+            self.compiled.append((None, s.get('stat', 'mean'), index, reducers[s.get('reduce', 'sum')], s.get('scale', 1.)))
+
+    def __call__(self, res, t_steady=None, window=None, **kwargs) :
+        '''
+        Returns the list of values of the columns for result res, opened with DsresFile
+        all variables are read and reduced in a single pass
+        t_steady : start of the steady state window (s), None to detect it (see detect_steady)
+        window : length of the steady state window (s) at the end of the result, used instead of t_steady
+        '''
+        if self.names :
+            t, values = res.read(self.names)
+            Y = np.array([values[name] for name in self.names]).reshape(len(self.names), len(t))
+            if window is not None :
+                start = final_window(t, window)
+            elif t_steady is None :
+                start = detect_steady(t, Y, **kwargs)[0]
+            else :
+                start = window_start(t, t_steady)
+            stats = window_stats(t, Y, start)
+        row = []
+        for value, stat, index, reduce, scale in self.compiled :
+            if stat is None :
+                row.append(value)
+            else :
+                row.append(float(reduce(stats[stat][index])) * scale)
+        return row
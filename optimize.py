@@ -0,0 +1,101 @@
+# Search of the best configuration instead of the exhaustive enumeration of the trees
+# A candidate is an option (e.g a source and a number of pipes) and the Prüfer sequence of its tree :
+# every sequence is a valid tree, so crossover and mutation of sequences always give valid networks
+# Each generation is evaluated in a single call, so that the simulations run in parallel,
+# and a candidate is never evaluated twice
+
+import numpy as np
+
+
+class GeneticSearch :
+    '''
+    Genetic algorithm over Prüfer sequences, the lowest cost is the best
+    '''
+
+    def __init__(self, n, options, evaluate, population=20, elite=2, tournament=3, crossover=0.9, mutation=None, seed=None) :
+        '''
+        n : number of nodes of the trees, sequences have n-2 values in range(n)
+        options : list of the other choices of a configuration, e.g (source, n_pipes)
+        evaluate : function of a list of candidates (option, sequence) returning their costs,
+                   None or nan for a failed evaluation
+        population : number of candidates of each generation
+        elite : number of best candidates kept unchanged in the next generation
+        tournament : number of candidates drawn to choose each parent
+        crossover : probability of mixing two parents, otherwise the child is a copy of the first one
+        mutation : probability of changing each value of the sequence and the option, 1/(n-2) by default
+        '''
+        self.n = n
+        self.options = list(options)
+        self.evaluate = evaluate
+        self.population = population
+        self.elite = elite
+        self.tournament = tournament
+        self.crossover = crossover
+        self.mutation = mutation if mutation is not None else 1. / max(n-2, 1)
+        self.rng = np.random.default_rng(seed)
+        self.costs = {} # candidate -> cost, every candidate evaluated so far
+        self.history = [] # best cost after each generation
+
+    def random_candidate(self) :
+        return (self.options[self.rng.integers(len(self.options))], tuple(int(p) for p in self.rng.integers(0, self.n, self.n-2)))
+
+    def evaluate_all(self, candidates) :
+        '''
+        Returns the costs of candidates, only the new ones are evaluated, in a single call
+        '''
+        new = list(dict.fromkeys([c for c in candidates if c not in self.costs]))
+        if new :
+            for c, cost in zip(new, self.evaluate(new)) :
+                self.costs[c] = np.inf if cost is None or np.isnan(cost) else float(cost)
+        return np.array([self.costs[c] for c in candidates])
+
+    def select(self, population, costs) :
+        '''
+        Tournament selection : the best of a few candidates drawn at random
+        '''
+        drawn = self.rng.integers(len(population), size=self.tournament)
+        return population[drawn[np.argmin(costs[drawn])]]
+
+    def child(self, a, b) :
+        '''
+        Uniform crossover of the sequences of a and b, then mutation
+        '''
+        option, seq = a
+        seq = np.array(seq, dtype=int)
+        if self.rng.random() < self.crossover :
+            mask = self.rng.random(len(seq)) < 0.5
+            seq[mask] = np.array(b[1], dtype=int)[mask]
+            if self.rng.random() < 0.5 :
+                option = b[0]
+        mutated = self.rng.random(len(seq)) < self.mutation
+        seq[mutated] = self.rng.integers(0, self.n, int(mutated.sum()))
+        if self.rng.random() < self.mutation :
+            option = self.options[self.rng.integers(len(self.options))]
+        return (option, tuple(int(p) for p in seq))
+
+    def run(self, generations=10, patience=None, initial=()) :
+        '''
+        Evolves the population and returns the best candidate and its cost
+        patience : stops when the best cost has not improved for this number of generations
+        initial : candidates of the first generation, completed with random ones
+        '''
+        population = list(initial)[:self.population]
+        while len(population) < self.population :
+            population.append(self.random_candidate())
+        costs = self.evaluate_all(population)
+
+        for generation in range (generations) :
+            order = np.argsort(costs, kind='stable')
+            best = costs[order[0]]
+            self.history.append(best)
+            print('generation ', generation, ' : best cost ', best, ', ', len(self.costs), ' candidates evaluated')
+            if patience is not None and len(self.history) > patience and self.history[-patience-1] <= best :
+                break
+            children = [population[k] for k in order[:self.elite]]
+            while len(children) < self.population :
+                children.append(self.child(self.select(population, costs), self.select(population, costs)))
+            population = children
+            costs = self.evaluate_all(population)
+
+        best = min(self.costs, key=self.costs.get)
+        return best, self.costs[best]
@@ -0,0 +1,288 @@
+# Modelica packages in which generated models are written
+# PackageFile keeps the byte offsets of each 'model ... end ...;' block of a single-file
+# package (e.g Method.mo), so that a model is replaced or appended without copying
+# the rest of the file
+# PackageDirectory stores the package as a directory (e.g Method/) with package.mo,
+# package.order and one file per model, so that the simulator only parses the model it needs
+
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+
+model_start = re.compile(rb'^model[ \t]+(\w+)[ \t]*\r?$', re.M)
+
+
+class PackageFile :
+    '''
+    Single-file modelica package, indexed by model name
+    '''
+
+    def __init__(self, file_name) :
+        '''
+        file_name : modelica package that must already exist
+        '''
+        self.path = file_name
+        self.package_name = os.path.basename(file_name)[:-3]
+        self.scan()
+
+    def stat(self) :
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def scan(self) :
+        '''
+        Reads the file once and records where each model starts and ends
+        '''
+        with open(self.path, 'rb') as f :
+            data = f.read()
+
+        self.index = {} # name -> (start, end), end is after the newline of 'end name;'
+        self.holes = [] # (start, end) of blank regions left by rewrites
+        pos = 0
+        while True :
+            match = model_start.search(data, pos)
+            if match is None :
+                break
+            name = match.group(1)
+            end = re.compile(rb'^[ \t]*end[ \t]+' + name + rb'[ \t]*;[^\n]*\n?', re.M).search(data, match.end())
+            if end is None :
+                break
+            self.index[name.decode()] = (match.start(), end.end())
+            pos = end.end()
+
+        package_end = list(re.finditer(rb'^[ \t]*end[ \t]+' + self.package_name.encode() + rb'[ \t]*;', data, re.M))
+        if not package_end :
+            raise ValueError(self.path + ' is not a modelica package')
+        self.end = package_end[-1].start()
+        self.version = self.stat()
+
+    def refresh(self) :
+        '''
+        Scans again if the file was modified by someone else
+        '''
+        if self.stat() != self.version :
+            self.scan()
+
+    def __contains__(self, name) :
+        return name in self.index
+
+    def files(self, name) :
+        '''
+        Returns the files to open in the simulator to simulate model name
+        '''
+        return [self.path]
+
+    def names(self) :
+        return list(self.index)
+
+    def read(self, name) :
+        '''
+        Returns the text of model name
+        '''
+        self.refresh()
+        start, end = self.index[name]
+        with open(self.path, 'rb') as f :
+            f.seek(start)
+            return f.read(end-start).decode().rstrip()
+
+    def write(self, name, txt) :
+        self.write_many({name : txt})
+
+    def write_many(self, models) :
+        '''
+        Writes several models in a single pass
+        models : dict model name -> modelica script of the model
+        A model which already exists is rewritten in place if the new script is not longer,
+        otherwise the old block is blanked and the model is appended at the end of the package
+        '''
+        self.refresh()
+        appended = []
+        with open(self.path, 'r+b') as f :
+            for name, txt in models.items() :
+                data = (txt + '\n').encode()
+                if name in self.index :
+                    start, end = self.index[name]
+                    f.seek(start)
+                    if len(data) <= end-start :
+                        # padding with blanks keeps the offsets of the following models
+                        f.write(data[:-1] + b' '*(end-start-len(data)) + b'\n')
+                        if end-start > len(data) :
+                            self.holes.append((start+len(data)-1, end-1))
+                        continue
+                    f.write(b' '*(end-start-1) + b'\n')
+                    self.holes.append((start, end))
+                    del self.index[name]
+                appended.append((name, data))
+
+            offset = self.end
+            f.seek(offset)
+            for name, data in appended :
+                f.write(data)
+                self.index[name] = (offset, offset+len(data))
+                offset += len(data)
+            if appended :
+                f.write(('end ' + self.package_name + ';').encode())
+                f.truncate()
+                self.end = offset
+
+        self.version = self.stat()
+        if sum([end-start for start, end in self.holes]) > self.version[1] // 2 :
+            self.compact()
+
+    def compact(self) :
+        '''
+        Rewrites the whole file without the blank regions left by write_many
+        '''
+        with open(self.path, 'rb') as f :
+            data = f.read()
+        parts = []
+        pos = 0
+        for start, end in sorted(self.holes) :
+            parts.append(data[pos:start])
+            pos = end
+        parts.append(data[pos:])
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f :
+            f.write(b''.join(parts))
+        os.replace(tmp, self.path)
+        self.scan()
+
+
+class PackageDirectory :
+    '''
+    Modelica package stored as a directory, one file per model
+    '''
+
+    def __init__(self, dir_name) :
+        '''
+        dir_name : directory of the package, created if it does not exist
+        '''
+        self.path = dir_name
+        self.package_name = os.path.basename(os.path.normpath(dir_name))
+        if not os.path.isfile(os.path.join(dir_name, 'package.mo')) :
+            os.makedirs(dir_name, exist_ok=True)
+            with open(os.path.join(dir_name, 'package.mo'), 'w') as f :
+                f.write('within ;\npackage ' + self.package_name + '\n\nend ' + self.package_name + ';\n')
+            open(os.path.join(dir_name, 'package.order'), 'w').close()
+
+    def model_path(self, name) :
+        return os.path.join(self.path, name + '.mo')
+
+    def __contains__(self, name) :
+        return os.path.isfile(self.model_path(name))
+
+    def names(self) :
+        return [name for name in self.order() if name in self]
+
+    def order(self) :
+        '''
+        Returns the names of package.order, each one once
+        '''
+        with open(os.path.join(self.path, 'package.order'), 'r') as f :
+            return list(dict.fromkeys([line.strip() for line in f if line.strip()]))
+
+    @contextmanager
+    def lock(self, timeout=60.) :
+        '''
+        Lock of package.order shared by all processes : a lock file created exclusively,
+        holding a token of its owner
+        a lock older than timeout is left by a dead process and is taken over
+        the lock file is only removed by its owner, so that a process whose lock was taken over
+        does not release the lock of the next one
+        '''
+        path = os.path.join(self.path, 'package.order.lock')
+        token = str(os.getpid()) + ':' + uuid.uuid4().hex
+        while True :
+            try :
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                with os.fdopen(fd, 'w') as f :
+                    f.write(token)
+                break
+            except FileExistsError :
+                try :
+                    if time.time() - os.path.getmtime(path) > timeout :
+                        os.remove(path)
+                except OSError :
+                    pass # released meanwhile
+                time.sleep(0.01)
+        try :
+            yield
+        finally :
+            try :
+                with open(path, 'r') as f :
+                    owner = f.read()
+            except OSError :
+                owner = None # taken over and already released
+            if owner == token :
+                os.remove(path)
+
+    def files(self, name) :
+        '''
+        Returns the files to open in the simulator to simulate model name
+        The package itself is light, only the file of the model is parsed
+        '''
+        return [os.path.join(self.path, 'package.mo'), self.model_path(name)]
+
+    def read(self, name) :
+        with open(self.model_path(name), 'r') as f :
+            txt = f.read()
+        return txt[txt.index('\n')+1:].rstrip() # without the 'within' clause
+
+    def write(self, name, txt) :
+        self.write_many({name : txt})
+
+    def write_many(self, models) :
+        '''
+        models : dict model name -> modelica script of the model
+        Each file is written aside and then renamed, so that several processes
+        can write models of the same package at the same time
+        package.order is read, merged and replaced under a lock, so that a model written
+        by several processes is listed once
+        '''
+        for name, txt in models.items() :
+            tmp = self.model_path(name) + '.' + str(os.getpid()) + '.tmp'
+            with open(tmp, 'w') as f :
+                f.write('within ' + self.package_name + ';\n' + txt + '\n')
+            os.replace(tmp, self.model_path(name))
+        if not models :
+            return
+        with self.lock() :
+            order = self.order()
+            listed = set(order)
+            new = [name for name in models if name not in listed]
+            if new :
+                path = os.path.join(self.path, 'package.order')
+                tmp = path + '.' + str(os.getpid()) + '.tmp'
+                with open(tmp, 'w') as f :
+                    f.write(''.join([name + '\n' for name in order + new]))
+                os.replace(tmp, path)
+
+
+def split_package(file_name, dir_name=None) :
+    '''
+    Copies every model of single-file package file_name in a package directory
+    dir_name : by default, file_name without '.mo'
+    '''
+    package = PackageFile(file_name)
+    directory = PackageDirectory(dir_name or file_name[:-3])
+    directory.write_many({name : package.read(name) for name in package.names()})
+    return directory
+
+
+# packages already indexed in this process
+_packages = {}
+
+
+def open_package(name) :
+    '''
+    Returns the package stored in name, a directory or a single '.mo' file
+    A single-file package is indexed only once per process
+    '''
+    path = os.path.abspath(name)
+    if not path.endswith('.mo') :
+        return PackageDirectory(path)
+    if path not in _packages :
+        _packages[path] = PackageFile(path)
+    return _packages[path]
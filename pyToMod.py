@@ -4,18 +4,31 @@
 
 # Annotations are just for display in Dymola, they do not influence model behaviour
 # If not present, it is impossible to display components or connections once in Dymola
+# They can be left out with set_annotations(False) for batch simulations : files are smaller,
+# and faster to write and to parse
 
-# Some lists are np.narrays, some are python lists, with no particular reason
+# Component scripts are returned as tuples (name, script) or lists [declarations, connections]
 
+# With set_arrays(True), tree networks are written with arrays of components : substations and pipes
+# are declared once as arrays and connected by for loops over index vectors (see write_model_arrays),
+# so that the size of the script hardly grows with the number of buildings
+
+# With set_steady_monitor, a steady state monitor is added to the model : the simulation is terminated
+# as soon as the key temperatures and flows have settled, instead of running until stopTime
+
+import math
 import numpy as np
 import networkx as nx
-import os
 from arg import arg
+from package import open_package
 
 class PyToMod :
     graph = nx.DiGraph()
     n_pipes = 2
     dir_list = ['a', 'b', 'aL']
+    annotations = True
+    arrays = False
+    steady_monitor = None # (window, rtol, atol, variables), see set_steady_monitor
 
     def __init__(self, graph, model_name='model_python', inplace=False) :
         '''
@@ -30,36 +43,50 @@ class PyToMod :
             self.graph = graph.copy() 
 
         self.model_name = model_name 
-        
-        # we set all attributes to False at initialization
+        self.reset()
+
+    def reset(self) :
+        '''
+        Sets all attributes used during the construction of the model to False
+        '''
         names = ['is_built', 'i_port_a', 'i_port_b', 'i_port_aL', 'i_port_bL', 'port_a', 'port_aL', 'port_b']
         val = [False for i in range(len(names))]
         for i in range (len(val)) :
             nx.set_node_attributes(self.graph, val[i], names[i])
         nx.set_edge_attributes(self.graph, False, 'is_built')
+        # key variables of the model, as (expression, size of the array or None for a scalar)
+        self.monitored = []
 
 
 
     # Script command --------------------------------------
 
+    def annotation(self, txt, before='', after='') :
+        '''
+        Returns the graphical annotation txt with the text around it, or nothing if annotations are left out
+        '''
+        if not self.annotations :
+            return ''
+        return before + 'annotation (' + txt + ')' + after
+
     def script_element(self, name, type, x=0.,y=0., nports=False, length=0, input=False, param='') :
         '''
         Returns a string corresponding to the declaration to a component
         '''
-        an = 'annotation (Placement(transformation(extent={{-10,-10},{10,10}}, origin={'+ str(x) + ',' + str(y) + '})))'
+        an = self.annotation('Placement(transformation(extent={{-10,-10},{10,10}}, origin={'+ str(x) + ',' + str(y) + '}))', '\n')
         arg = self.arg[type]
         arg += param
         if nports : # in the case of a multiport (e.g mass flow source)
             arg += 'nPorts='+str(nports)+'\n'
-            return str(type) + ' ' + str(name) + ' (\n  ' + arg + ') \n' + an +';\n'
+            return str(type) + ' ' + str(name) + ' (\n  ' + arg + ') ' + an +';\n'
         elif length : # in the case of a pipe
             arg += 'length='+str(length)+'\n'
-            return str(type) + ' ' + str(name) + ' (\n  ' + arg + ') \n' + an +';\n'
+            return str(type) + ' ' + str(name) + ' (\n  ' + arg + ') ' + an +';\n'
         elif input : # in the case of an input component
             arg += 'y='+input
-            return str(type) + ' ' + str(name) + ' (\n  ' + arg + ') \n' + an +';\n'
+            return str(type) + ' ' + str(name) + ' (\n  ' + arg + ') ' + an +';\n'
         else :
-            return str(type) + ' ' + str(name) + ' (\n  ' + arg + ') \n' + an +';\n'
+            return str(type) + ' ' + str(name) + ' (\n  ' + arg + ') ' + an +';\n'
         
 
     def script_substation(self, name, x=0.,y=0., T=0, heat_pump=False) :
@@ -69,27 +96,28 @@ class PyToMod :
         '''
 
         # two elements list [name, script]
-        source = np.array(['source_'+name, self.script_element('source_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', x+10,y-10, nports=1)]) 
-        sink = np.array(['sink_'+name, self.script_element('sink_'+name, 'Buildings.Fluid.Sources.Boundary_pT', x-10,y-10, nports=1)]) 
+        source = ('source_'+name, self.script_element('source_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', x+10,y-10, nports=1))
+        sink = ('sink_'+name, self.script_element('sink_'+name, 'Buildings.Fluid.Sources.Boundary_pT', x-10,y-10, nports=1))
         
         # random annotation to allow visualization in Dymola
-        an = 'annotation (Line(points={{' + str(x) + ',' + str(y) + '}},color={0,127,255}))'
+        an = self.annotation('Line(points={{' + str(x) + ',' + str(y) + '}},color={0,127,255})', '\n    ')
         connections = ''
 
         if heat_pump : # in the case of circular grid, each substation has a heat pump
-            HP = np.array(['HP_'+name, self.script_element('HP_'+name, 'Buildings.Fluid.HeatPumps.Carnot_TCon')])
-            const = np.array(['constant_'+name, self.script_element('constant_'+name, 'Modelica.Blocks.Sources.Constant')])
+            HP = ('HP_'+name, self.script_element('HP_'+name, 'Buildings.Fluid.HeatPumps.Carnot_TCon'))
+            const = ('constant_'+name, self.script_element('constant_'+name, 'Modelica.Blocks.Sources.Constant'))
             connections += 'connect('+source[0]+'.ports[1], '+HP[0]+'.port_a2);\n' 
             connections += 'connect('+HP[0]+'.port_b2, '+sink[0]+'.ports[1]);\n' 
             connections += 'connect('+const[0]+'.y, '+HP[0]+'.TSet);\n'
             declar = source[1] + sink[1] + HP[1] + const[1]
 
         else : # for n_pipes=2 or 3, each substation has a valve and a heat exchanger
-            hex = np.array(['hex_'+name, self.script_element('hex_'+name, 'Buildings.Fluid.HeatExchangers.PlateHeatExchangerEffectivenessNTU', x,y+10)])
+            hex = ('hex_'+name, self.script_element('hex_'+name, 'Buildings.Fluid.HeatExchangers.PlateHeatExchangerEffectivenessNTU', x,y+10))
+            self.monitored.append((hex[0]+'.sta_b2.T', None)) # controlled temperature
             valv = self.script_element('valve_'+name, 'Buildings.Fluid.Actuators.Valves.TwoWayLinear')
             cont = self.script_controller(name, input=hex[0]+'.sta_b2.T', T=T)
-            connections += 'connect('+source[0]+'.ports[1], '+hex[0]+'.port_a2)\n    ' + an + ';\n'
-            connections += 'connect('+hex[0]+'.port_b2, '+sink[0]+'.ports[1])\n    ' + an + ';\n'    
+            connections += 'connect('+source[0]+'.ports[1], '+hex[0]+'.port_a2)' + an + ';\n'
+            connections += 'connect('+hex[0]+'.port_b2, '+sink[0]+'.ports[1])' + an + ';\n'    
             connections += cont[2]
             connections += 'connect('+cont[0]+'.y, valve_'+name+'.y);\n'
             connections += 'connect(valve_'+name+'.port_b, '+hex[0]+'.port_a1);\n' 
@@ -104,10 +132,10 @@ class PyToMod :
         """
 
         # fluid circulation
-        prod = np.array(['prod_'+name, self.script_element('prod_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=nports)])
-        prodL = np.array(['prodL_'+name, self.script_element('prodL_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=nports)])
-        sink = np.array(['sink_'+name, self.script_element('sink_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=nports)])
-        term = np.array(['temp_return_'+name, self.script_element('temp_return_'+name, 'Buildings.Fluid.Sensors.Temperature')])
+        prod = ('prod_'+name, self.script_element('prod_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=nports))
+        prodL = ('prodL_'+name, self.script_element('prodL_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=nports))
+        sink = ('sink_'+name, self.script_element('sink_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=nports))
+        term = ('temp_return_'+name, self.script_element('temp_return_'+name, 'Buildings.Fluid.Sensors.Temperature'))
 
         connections = ''
         connections += 'connect('+sink[0]+'.ports[1], '+term[0]+'.port);\n'
@@ -122,12 +150,12 @@ class PyToMod :
         '''
 
         # fluid circulation
-        prod = np.array(['prod_'+name, self.script_element('prod_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=max(1,self.n_pipes-1))])
-        sink = np.array(['sink_'+name, self.script_element('sink_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=nports)])
-        term = np.array(['temp_return_'+name, self.script_element('temp_return_'+name, 'Buildings.Fluid.Sensors.Temperature')])
+        prod = ('prod_'+name, self.script_element('prod_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=max(1,self.n_pipes-1)))
+        sink = ('sink_'+name, self.script_element('sink_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=nports))
+        term = ('temp_return_'+name, self.script_element('temp_return_'+name, 'Buildings.Fluid.Sensors.Temperature'))
         
         # gas boiler
-        boil = np.array(['boiler_'+name, self.script_element('boiler_'+name, 'Buildings.Fluid.Boilers.BoilerPolynomial')])
+        boil = ('boiler_'+name, self.script_element('boiler_'+name, 'Buildings.Fluid.Boilers.BoilerPolynomial'))
         cont = self.script_controller(name, input=boil[0]+'.sta_b.T')
 
 
@@ -141,7 +169,7 @@ class PyToMod :
         if self.n_pipes == 3 :
             # we add a gas boiler
             # we add 'L' next to all names
-            boilL = np.array(['boilerL_'+name, self.script_element('boilerL_'+name, 'Buildings.Fluid.Boilers.BoilerPolynomial')])
+            boilL = ('boilerL_'+name, self.script_element('boilerL_'+name, 'Buildings.Fluid.Boilers.BoilerPolynomial'))
             contL = self.script_controller('L'+name, input=boilL[0]+'.sta_b.T')
             connections += 'connect('+prod[0]+'.ports[2], '+boilL[0]+'.port_a);\n'
             connections += contL[2]
@@ -157,18 +185,18 @@ class PyToMod :
         '''
 
         # fluid circulation
-        prod = np.array(['prod_'+name, self.script_element('prod_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=max(1,self.n_pipes-1))])
-        sink = np.array(['sink_'+name, self.script_element('sink_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=nports)])
-        term = np.array(['temp_return_'+name, self.script_element('temp_return_'+name, 'Buildings.Fluid.Sensors.Temperature')])
+        prod = ('prod_'+name, self.script_element('prod_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=max(1,self.n_pipes-1)))
+        sink = ('sink_'+name, self.script_element('sink_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=nports))
+        term = ('temp_return_'+name, self.script_element('temp_return_'+name, 'Buildings.Fluid.Sensors.Temperature'))
         
         # gas boiler
-        boil = np.array(['boiler_'+name, self.script_element('boiler_'+name, 'Buildings.Fluid.Boilers.BoilerPolynomial')])
+        boil = ('boiler_'+name, self.script_element('boiler_'+name, 'Buildings.Fluid.Boilers.BoilerPolynomial'))
         cont = self.script_controller(name, input=boil[0]+'.sta_b.T')
         
         # geothermal
-        hex = np.array(['hex_'+name, self.script_element('hex_'+name, 'Buildings.Fluid.HeatExchangers.PlateHeatExchangerEffectivenessNTU')])
-        source_geo = np.array(['source_geo_'+name, self.script_element('source_geo_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1)])
-        sink_geo = np.array(['sink_geo_'+name, self.script_element('sink_geo_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1)])
+        hex = ('hex_'+name, self.script_element('hex_'+name, 'Buildings.Fluid.HeatExchangers.PlateHeatExchangerEffectivenessNTU'))
+        source_geo = ('source_geo_'+name, self.script_element('source_geo_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1))
+        sink_geo = ('sink_geo_'+name, self.script_element('sink_geo_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1))
 
         W = boil[1] + prod[1] + sink[1] + term[1] + cont[1] + hex[1] + source_geo[1] + sink_geo[1]
 
@@ -184,13 +212,13 @@ class PyToMod :
 
         if self.n_pipes == 3 :
             # gas boiler
-            boilL = np.array(['boilerL_'+name, self.script_element('boilerL_'+name, 'Buildings.Fluid.Boilers.BoilerPolynomial')])
+            boilL = ('boilerL_'+name, self.script_element('boilerL_'+name, 'Buildings.Fluid.Boilers.BoilerPolynomial'))
             contL = self.script_controller('L'+name, input=boil[0]+'.sta_b.T')
             
             # geothermal
-            hexL = np.array(['hexL_'+name, self.script_element('hexL_'+name, 'Buildings.Fluid.HeatExchangers.PlateHeatExchangerEffectivenessNTU')])
-            source_geoL = np.array(['source_geoL_'+name, self.script_element('source_geoL_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1)])
-            sink_geoL = np.array(['sink_geoL_'+name, self.script_element('sink_geoL_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1)])
+            hexL = ('hexL_'+name, self.script_element('hexL_'+name, 'Buildings.Fluid.HeatExchangers.PlateHeatExchangerEffectivenessNTU'))
+            source_geoL = ('source_geoL_'+name, self.script_element('source_geoL_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1))
+            sink_geoL = ('sink_geoL_'+name, self.script_element('sink_geoL_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1))
 
             connections += 'connect('+source_geoL[0]+'.ports[1], '+hexL[0]+'.port_a2);\n'
             connections += 'connect('+hexL[0]+'.port_b2, '+sink_geoL[0]+'.ports[1]);\n'
@@ -210,15 +238,15 @@ class PyToMod :
         '''
         
         # Fluid circulation
-        prod = np.array(['prod_'+name, self.script_element('prod_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=max(1,self.n_pipes-1))])
-        sink = np.array(['sink_'+name, self.script_element('sink_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=nports)])
-        term = np.array(['temp_return_'+name, self.script_element('temp_return_'+name, 'Buildings.Fluid.Sensors.Temperature')])
+        prod = ('prod_'+name, self.script_element('prod_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=max(1,self.n_pipes-1)))
+        sink = ('sink_'+name, self.script_element('sink_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=nports))
+        term = ('temp_return_'+name, self.script_element('temp_return_'+name, 'Buildings.Fluid.Sensors.Temperature'))
 
         # heat pump
-        HP = np.array(['HP_'+name, self.script_element('HP_'+name, 'Buildings.Fluid.HeatPumps.Carnot_TCon')])
-        source_sea = np.array(['source_sea_'+name, self.script_element('source_sea_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1)])
-        sink_sea = np.array(['sink_sea_'+name, self.script_element('sink_sea_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1)])
-        const = np.array(['constant_'+name, self.script_element('constant_'+name, 'Modelica.Blocks.Sources.Constant')])
+        HP = ('HP_'+name, self.script_element('HP_'+name, 'Buildings.Fluid.HeatPumps.Carnot_TCon'))
+        source_sea = ('source_sea_'+name, self.script_element('source_sea_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1))
+        sink_sea = ('sink_sea_'+name, self.script_element('sink_sea_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1))
+        const = ('constant_'+name, self.script_element('constant_'+name, 'Modelica.Blocks.Sources.Constant'))
 
         W = HP[1] + const[1] + prod[1] + sink[1] + term[1] + source_sea[1] + sink_sea[1]
 
@@ -232,10 +260,10 @@ class PyToMod :
 
         if self.n_pipes == 3 :
             # heat pump
-            HPL = np.array(['HPL_'+name, self.script_element('HPL_'+name, 'Buildings.Fluid.HeatPumps.Carnot_TCon')])
-            source_seaL = np.array(['source_seaL_'+name, self.script_element('source_seaL_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1)])
-            sink_seaL = np.array(['sink_seaL_'+name, self.script_element('sink_seaL_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1)])
-            constL = np.array(['constantL_'+name, self.script_element('constantL_'+name, 'Modelica.Blocks.Sources.Constant')])
+            HPL = ('HPL_'+name, self.script_element('HPL_'+name, 'Buildings.Fluid.HeatPumps.Carnot_TCon'))
+            source_seaL = ('source_seaL_'+name, self.script_element('source_seaL_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1))
+            sink_seaL = ('sink_seaL_'+name, self.script_element('sink_seaL_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1))
+            constL = ('constantL_'+name, self.script_element('constantL_'+name, 'Modelica.Blocks.Sources.Constant'))
             L = HPL[1] + source_seaL[1] + sink_seaL[1] + constL[1]
 
             connections += 'connect('+prod[0]+'.ports[2], '+HPL[0]+'.port_a1);\n'
@@ -254,20 +282,20 @@ class PyToMod :
         '''
 
         # heat pump
-        HP = np.array(['HP_'+name, self.script_element('HP_'+name, 'Buildings.Fluid.HeatPumps.Carnot_TCon')])
-        source_sea = np.array(['source_sea_'+name, self.script_element('source_sea_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1)])
-        sink_sea = np.array(['sink_sea_'+name, self.script_element('sink_sea_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1)])
-        const = np.array(['constant_'+name, self.script_element('constant_'+name, 'Modelica.Blocks.Sources.Constant')])
+        HP = ('HP_'+name, self.script_element('HP_'+name, 'Buildings.Fluid.HeatPumps.Carnot_TCon'))
+        source_sea = ('source_sea_'+name, self.script_element('source_sea_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1))
+        sink_sea = ('sink_sea_'+name, self.script_element('sink_sea_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1))
+        const = ('constant_'+name, self.script_element('constant_'+name, 'Modelica.Blocks.Sources.Constant'))
         
         # geothermal
-        hex = np.array(['hex_'+name, self.script_element('hex_'+name, 'Buildings.Fluid.HeatExchangers.PlateHeatExchangerEffectivenessNTU')])
-        source_geo = np.array(['source_geo_'+name, self.script_element('source_geo_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1)])
-        sink_geo = np.array(['sink_geo_'+name, self.script_element('sink_geo_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1)])
+        hex = ('hex_'+name, self.script_element('hex_'+name, 'Buildings.Fluid.HeatExchangers.PlateHeatExchangerEffectivenessNTU'))
+        source_geo = ('source_geo_'+name, self.script_element('source_geo_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1))
+        sink_geo = ('sink_geo_'+name, self.script_element('sink_geo_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1))
 
         # fluid circulation
-        prod = np.array(['prod_'+name, self.script_element('prod_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=max(1,self.n_pipes-1))])
-        sink = np.array(['sink_'+name, self.script_element('sink_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=nports)])
-        term = np.array(['temp_return_'+name, self.script_element('temp_return_'+name, 'Buildings.Fluid.Sensors.Temperature')])
+        prod = ('prod_'+name, self.script_element('prod_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=max(1,self.n_pipes-1)))
+        sink = ('sink_'+name, self.script_element('sink_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=nports))
+        term = ('temp_return_'+name, self.script_element('temp_return_'+name, 'Buildings.Fluid.Sensors.Temperature'))
         
         W = HP[1] + source_sea[1] + sink_sea[1] + const[1] + prod[1] + sink[1] + term[1] + hex[1] + source_geo[1] + sink_geo[1]
 
@@ -284,15 +312,15 @@ class PyToMod :
 
         if self.n_pipes == 3 :
             # heat pump
-            HPL = np.array(['HPL_'+name, self.script_element('HPL_'+name, 'Buildings.Fluid.HeatPumps.Carnot_TCon')])
-            source_seaL = np.array(['source_seaL_'+name, self.script_element('source_seaL_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1)])
-            sink_seaL = np.array(['sink_seaL_'+name, self.script_element('sink_seaL_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1)])
-            constL = np.array(['constantL_'+name, self.script_element('constantL_'+name, 'Modelica.Blocks.Sources.Constant')])
+            HPL = ('HPL_'+name, self.script_element('HPL_'+name, 'Buildings.Fluid.HeatPumps.Carnot_TCon'))
+            source_seaL = ('source_seaL_'+name, self.script_element('source_seaL_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1))
+            sink_seaL = ('sink_seaL_'+name, self.script_element('sink_seaL_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1))
+            constL = ('constantL_'+name, self.script_element('constantL_'+name, 'Modelica.Blocks.Sources.Constant'))
             
             # geothermal
-            hexL = np.array(['hexL_'+name, self.script_element('hexL_'+name, 'Buildings.Fluid.HeatExchangers.PlateHeatExchangerEffectivenessNTU')])
-            source_geoL = np.array(['source_geoL_'+name, self.script_element('source_geoL_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1)])
-            sink_geoL = np.array(['sink_geoL_'+name, self.script_element('sink_geoL_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1)])
+            hexL = ('hexL_'+name, self.script_element('hexL_'+name, 'Buildings.Fluid.HeatExchangers.PlateHeatExchangerEffectivenessNTU'))
+            source_geoL = ('source_geoL_'+name, self.script_element('source_geoL_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1))
+            sink_geoL = ('sink_geoL_'+name, self.script_element('sink_geoL_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1))
             L = HPL[1] + source_seaL[1] + sink_seaL[1] + constL[1] + hexL[1] + source_geoL[1] + sink_geoL[1]
 
             connections += 'connect('+prod[0]+'.ports[2], '+hexL[0]+'.port_a1);\n'
@@ -314,20 +342,20 @@ class PyToMod :
         '''
 
         # heat pump
-        HP = np.array(['HP_'+name, self.script_element('HP_'+name, 'Buildings.Fluid.HeatPumps.Carnot_TCon')])
-        source_sea = np.array(['source_sea_'+name, self.script_element('source_sea_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1)])
-        sink_sea = np.array(['sink_sea_'+name, self.script_element('sink_sea_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1)])
-        const = np.array(['const_'+name, self.script_element('const_'+name, 'Modelica.Blocks.Sources.Constant')])
+        HP = ('HP_'+name, self.script_element('HP_'+name, 'Buildings.Fluid.HeatPumps.Carnot_TCon'))
+        source_sea = ('source_sea_'+name, self.script_element('source_sea_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1))
+        sink_sea = ('sink_sea_'+name, self.script_element('sink_sea_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1))
+        const = ('const_'+name, self.script_element('const_'+name, 'Modelica.Blocks.Sources.Constant'))
 
         # gas boiler
-        boil = np.array(['boiler_'+name, self.script_element('boiler_'+name, 'Buildings.Fluid.Boilers.BoilerPolynomial')])
+        boil = ('boiler_'+name, self.script_element('boiler_'+name, 'Buildings.Fluid.Boilers.BoilerPolynomial'))
         # controller
         cont = self.script_controller(name, input=boil[0]+'.sta_b.T')
 
         # fluid circulation
-        prod = np.array(['prod_'+name, self.script_element('prod_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=max(1,self.n_pipes-1))])
-        sink = np.array(['sink_'+name, self.script_element('sink_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=nports)])
-        term = np.array(['temp_return_'+name, self.script_element('temp_return_'+name, 'Buildings.Fluid.Sensors.Temperature')])
+        prod = ('prod_'+name, self.script_element('prod_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=max(1,self.n_pipes-1)))
+        sink = ('sink_'+name, self.script_element('sink_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=nports))
+        term = ('temp_return_'+name, self.script_element('temp_return_'+name, 'Buildings.Fluid.Sensors.Temperature'))
 
         W = HP[1] + source_sea[1] + sink_sea[1] + const[1] + boil[1] + cont[1] + prod[1] + sink[1] + term[1] 
 
@@ -345,13 +373,13 @@ class PyToMod :
         if self.n_pipes == 3 :
 
             # heat pump
-            HPL = np.array(['HPL_'+name, self.script_element('HPL_'+name, 'Buildings.Fluid.HeatPumps.Carnot_TCon')])
-            source_seaL = np.array(['source_seaL_'+name, self.script_element('source_seaL_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1)])
-            sink_seaL = np.array(['sink_seaL_'+name, self.script_element('sink_seaL_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1)])
-            constL = np.array(['constL_'+name, self.script_element('constL_'+name, 'Modelica.Blocks.Sources.Constant')])
+            HPL = ('HPL_'+name, self.script_element('HPL_'+name, 'Buildings.Fluid.HeatPumps.Carnot_TCon'))
+            source_seaL = ('source_seaL_'+name, self.script_element('source_seaL_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1))
+            sink_seaL = ('sink_seaL_'+name, self.script_element('sink_seaL_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1))
+            constL = ('constL_'+name, self.script_element('constL_'+name, 'Modelica.Blocks.Sources.Constant'))
 
             # gas boiler
-            boilL = np.array(['boilerL_'+name, self.script_element('boilerL_'+name, 'Buildings.Fluid.Boilers.BoilerPolynomial')])
+            boilL = ('boilerL_'+name, self.script_element('boilerL_'+name, 'Buildings.Fluid.Boilers.BoilerPolynomial'))
             # controller
             contL = self.script_controller('L'+name, input=boil[0]+'.sta_b.T')
 
@@ -376,14 +404,14 @@ class PyToMod :
         In the form of a list : first element corresponds to declaration, second element corresponds to connection
         """
         # fluid circulation
-        prod = np.array(['prod_'+name, self.script_element('prod_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=max(1,self.n_pipes-1))])
-        sink = np.array(['sink_'+name, self.script_element('sink_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=nports)])
-        term = np.array(['temp_return_'+name, self.script_element('temp_return_'+name, 'Buildings.Fluid.Sensors.Temperature')])
+        prod = ('prod_'+name, self.script_element('prod_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=max(1,self.n_pipes-1)))
+        sink = ('sink_'+name, self.script_element('sink_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=nports))
+        term = ('temp_return_'+name, self.script_element('temp_return_'+name, 'Buildings.Fluid.Sensors.Temperature'))
        
         # sea exchanger
-        hex = np.array(['hex_'+name, self.script_element('hex_'+name, 'Buildings.Fluid.HeatExchangers.PlateHeatExchangerEffectivenessNTU')])
-        source_sea = np.array(['source_sea_'+name, self.script_element('source_sea_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1)])
-        sink_sea = np.array(['sink_sea_'+name, self.script_element('sink_sea_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1)])
+        hex = ('hex_'+name, self.script_element('hex_'+name, 'Buildings.Fluid.HeatExchangers.PlateHeatExchangerEffectivenessNTU'))
+        source_sea = ('source_sea_'+name, self.script_element('source_sea_'+name, 'Buildings.Fluid.Sources.MassFlowSource_T', nports=1))
+        sink_sea = ('sink_sea_'+name, self.script_element('sink_sea_'+name, 'Buildings.Fluid.Sources.Boundary_pT', nports=1))
 
         connections = ''
         connections += 'connect('+sink[0]+'.ports[1], '+term[0]+'.port);\n'
@@ -408,16 +436,16 @@ class PyToMod :
         def_T = 'k=273.15+'+str(T)+', \n'
 
         # two elements list [name, script]
-        PID = np.array(['PID_'+name, self.script_element('PID_'+name, 'Modelica.Blocks.Continuous.LimPID', x-30,y+10)])
-        inp = np.array(['input_'+name, self.script_element('input_'+name, 'Modelica.Blocks.Sources.RealExpression', x-40,y, input=input)])
-        const = np.array(['constant_'+name, self.script_element('constant_'+name, 'Modelica.Blocks.Sources.Constant', x-50,y+10, param=def_T)])
+        PID = ('PID_'+name, self.script_element('PID_'+name, 'Modelica.Blocks.Continuous.LimPID', x-30,y+10))
+        inp = ('input_'+name, self.script_element('input_'+name, 'Modelica.Blocks.Sources.RealExpression', x-40,y, input=input))
+        const = ('constant_'+name, self.script_element('constant_'+name, 'Modelica.Blocks.Sources.Constant', x-50,y+10, param=def_T))
 
         # connections
         connections = ''
         connections += 'connect('+inp[0]+'.y, '+PID[0]+'.u_m);\n'
         connections += 'connect('+const[0]+'.y, '+PID[0]+'.u_s);\n'
 
-        return np.array([PID[0], PID[1] + inp[1] + const[1], connections])
+        return (PID[0], PID[1] + inp[1] + const[1], connections)
 
 
     # Create commands --------------------------------------
@@ -490,6 +518,66 @@ class PyToMod :
                 return False
             
 
+    # Build commands --------------------------------------
+    # each component is scripted once : declarations and connections are returned together
+
+    # script and create methods of each type of source
+    source_methods = {'simple_source' : ('script_simple_source', 'create_simple_source'),
+        'gas_boiler' : ('script_gas_boiler', 'create_gas_boiler'),
+        'gas_boiler_geo' : ('script_gas_boiler_geo', 'create_gas_boiler'),
+        'heat_pump' : ('script_heat_pump', 'create_heat_pump'),
+        'geo_heat_pump' : ('script_geo_heat_pump', 'create_heat_pump'),
+        'heat_pump_gas_boiler' : ('script_heat_pump_gas_boiler', 'create_gas_boiler'),
+        'sea' : ('script_sea', 'create_sea'),
+        }
+
+    def build_source(self, node, x=0, y=0) :
+        '''
+        Returns declarations and connections of the source node, and initializes its ports
+        '''
+        script, create = self.source_methods[self.source_type]
+        if self.source_type == 'simple_source' : # one port per connection
+            declar, connections = getattr(self, script)('supply_'+str(node), x,y, len(self.graph[node]))
+        else :
+            declar, connections = getattr(self, script)('supply_'+str(node), x,y)
+        getattr(self, create)(node)
+        return declar, connections
+
+    def build_substation(self, node, x=0, y=0, heat_pump=False) :
+        '''
+        Returns declarations and connections of the substation node, and initializes its ports
+        heat_pump : True in the ring model
+        '''
+        T_heating = self.graph.nodes[node]['T_heating']
+        T_DHW = self.graph.nodes[node]['T_DHW']
+        if T_heating and T_DHW :
+        # in that case, two ports are created, the SST works with 2 or 3 pipes
+            H = self.script_substation('H_SST_'+str(node), x,y, T=T_heating, heat_pump=heat_pump)
+            W = self.script_substation('W_SST_'+str(node), x,y, T=T_DHW, heat_pump=heat_pump)
+            declar = H[0] + W[0]
+            connections = H[1] + W[1]
+            if heat_pump :
+                connections += 'connect (HP_W_SST_'+str(node)+'.port_b1, HP_H_SST_'+str(node)+'.port_a1); \n'
+            else :
+                connections += 'connect (hex_H_SST_'+str(node)+'.port_b1, hex_W_SST_'+str(node)+'.port_b1); \n'
+                if self.n_pipes == 2 :
+                    connections += 'connect (valve_H_SST_'+str(node)+'.port_a, valve_W_SST_'+str(node)+'.port_a); \n'
+            self.create_building(node, both=True, heat_pump=heat_pump)
+        elif self.n_pipes == 3 :
+        # we must label the station heating or DHW to attribute the correct ports
+            T = max(T_heating, T_DHW)
+            declar, connections = self.script_substation('SST_'+str(node), x,y, T)
+            if T == T_heating :
+                self.create_building(node, L='L')
+            elif T == T_DHW :
+                self.create_building(node)
+        else :
+        # there is only one demand temperature and one active port
+            declar, connections = self.script_substation('SST_'+str(node), x,y, T=max(T_heating, T_DHW), heat_pump=heat_pump)
+            self.create_building(node, heat_pump=heat_pump)
+        return declar, connections
+
+
     def write_model(self) :
         '''
         Returns modelica script to build the whole model
@@ -499,330 +587,277 @@ class PyToMod :
         Now that I don't do that (I connect all elements after they have been created)
         we could just iterate over all vertices without any particular order
         and avoid reading multiple times the same vertex
+        Sections are lists of pieces of script, joined once at the end
         '''
 
-        begin = 'model ' + self.model_name + '\n \n \n'
-        end = '\n \n end ' + self.model_name + ';'
-
-        declaration = ''
-        equation = '\n equation \n \n'
-
-
-        supply_h = '\n // Supply_heating \n \n'
-        buildings = '\n // Buildings \n \n'
-        pipes = '\n // Pipes \n \n' 
+        supply_h = ['\n // Supply_heating \n \n']
+        buildings = ['\n // Buildings \n \n']
+        pipes = ['\n // Pipes \n \n']
+        equation = ['\n equation \n \n']
 
         for node, neighbors in self.graph.adjacency() :
             x1,y1 = self.graph.nodes[node]['pos']
-            nports_node = 0
-            nports_neighbor = 0
             # node construction if not already built
             # we assume that all nodes are either substations or sources
             if not self.graph.nodes[node]['is_built'] :
-                equation += '\n //' + node + '\n \n'
+                equation.append('\n //' + node + '\n \n')
                 if self.graph.nodes[node]['is_supply_heating'] : # the node is a heat source
-                    nports_node = len(list(self.graph.neighbors(node))) # number of connections from the source
-                    if self.source_type == 'simple_source' :
-                        supply_h += self.script_simple_source('supply_'+str(node), x1,y1, nports_node)[0] 
-                        equation += self.script_simple_source('supply_'+str(node), x1,y1)[1] 
-                        self.create_simple_source(node)
-                    elif self.source_type == 'gas_boiler' :
-                        supply_h += self.script_gas_boiler('supply_'+str(node), x1,y1)[0] 
-                        equation += self.script_gas_boiler('supply_'+str(node), x1,y1)[1] 
-                        self.create_gas_boiler(node)  
-                    elif self.source_type == 'gas_boiler_geo' :
-                        supply_h += self.script_gas_boiler_geo('supply_'+str(node), x1,y1)[0] 
-                        equation += self.script_gas_boiler_geo('supply_'+str(node), x1,y1)[1] 
-                        self.create_gas_boiler(node)
-                    elif self.source_type == 'heat_pump' :
-                        supply_h += self.script_heat_pump('supply_'+str(node), x1,y1)[0] 
-                        equation += self.script_heat_pump('supply_'+str(node), x1,y1)[1] 
-                        self.create_heat_pump(node)  
-                    elif self.source_type == 'geo_heat_pump' :
-                        supply_h += self.script_geo_heat_pump('supply_'+str(node), x1,y1)[0] 
-                        equation += self.script_geo_heat_pump('supply_'+str(node), x1,y1)[1] 
-                        self.create_heat_pump(node)   
-                    elif self.source_type == 'heat_pump_gas_boiler' :
-                        supply_h += self.script_heat_pump_gas_boiler('supply_'+str(node), x1,y1)[0] 
-                        equation += self.script_heat_pump_gas_boiler('supply_'+str(node), x1,y1)[1] 
-                        self.create_gas_boiler(node) 
-                    elif self.source_type == 'sea' :
-                        supply_h += self.script_sea('supply_'+str(node), x1,y1)[0] 
-                        equation += self.script_sea('supply_'+str(node), x1,y1)[1] 
-                        self.create_sea(node)        
+                    declar, connections = self.build_source(node, x1,y1)
+                    supply_h.append(declar)
                 else : # the node is a substation
-                    T_heating = self.graph.nodes[node]['T_heating']
-                    T_DHW = self.graph.nodes[node]['T_DHW']
-                    if T_heating and T_DHW :
-                    # in that case, two ports are created, the SST works with 2 or 3 pipes
-                        buildings += self.script_substation('H_SST_'+str(node), x1,y1, T=T_heating)[0]
-                        equation += self.script_substation('H_SST_'+str(node), x1,y1, T=T_heating)[1]
-                        buildings += self.script_substation('W_SST_'+str(node), x1,y1, T=T_DHW)[0]
-                        equation += self.script_substation('W_SST_'+str(node), x1,y1, T=T_DHW)[1]
-                        equation += 'connect (hex_H_SST_'+str(node)+'.port_b1, hex_W_SST_'+str(node)+'.port_b1); \n'
-                        if self.n_pipes == 2 :
-                            equation += 'connect (valve_H_SST_'+str(node)+'.port_a, valve_W_SST_'+str(node)+'.port_a); \n'                 
-                        self.create_building(node, both=True)
-                    elif self.n_pipes == 3 : 
-                    # we must label the station heating or DHW to attribute the correct ports
-                        T = max(T_heating, T_DHW)
-                        buildings += self.script_substation('SST_'+str(node), x1,y1, T)[0]
-                        equation += self.script_substation('SST_'+str(node), x1,y1, T)[1]
-                        if T == T_heating :
-                            self.create_building(node, L='L')
-                        elif T == T_DHW :
-                            self.create_building(node)
-                    else :
-                    # there is only one demand temperature and one active port
-                        buildings += self.script_substation('SST_'+str(node), x1,y1, T=max(T_heating, T_DHW))[0]
-                        equation += self.script_substation('SST_'+str(node), x1,y1, T=max(T_heating, T_DHW))[1]
-                        self.create_building(node)
+                    declar, connections = self.build_substation(node, x1,y1)
+                    buildings.append(declar)
+                equation.append(connections)
 
             for neighbor,at in neighbors.items() :
                 x2,y2 = self.graph.nodes[neighbor]['pos']
 
                 # neighbor creation if not already built
                 if not self.graph.nodes[neighbor]['is_built'] :
-                    equation += '\n //' + neighbor + '\n \n'
+                    equation.append('\n //' + neighbor + '\n \n')
                     if self.graph.nodes[neighbor]['is_supply_heating'] :
-                        nports_neighbor = len(list(self.graph.neighbors(neighbor)))
-                        if self.source_type == 'simple_source' :
-                            buildings += self.script_simple_source('supply_'+str(neighbor), x2,y2, nports_neighbor)[0]
-                            equation += self.script_simple_source('supply_'+str(neighbor), x2,y2)[1]
-                            self.create_simple_source(neighbor)
-                        elif self.source_type == 'gas_boiler' :
-                            buildings += self.script_gas_boiler('supply_'+str(neighbor), x2,y2)[0]
-                            equation += self.script_gas_boiler('supply_'+str(neighbor), x2,y2)[1]
-                            self.create_gas_boiler(neighbor)
-                        elif self.source_type == 'gas_boiler_geo' :
-                            supply_h += self.script_gas_boiler_geo('supply_'+str(neighbor), x1,y1)[0] 
-                            equation += self.script_gas_boiler_geo('supply_'+str(neighbor), x1,y1)[1] 
-                            self.create_gas_boiler(neighbor) 
-                        elif self.source_type == 'heat_pump' :
-                            supply_h += self.script_heat_pump('supply_'+str(neighbor), x1,y1)[0] 
-                            equation += self.script_heat_pump('supply_'+str(neighbor), x1,y1)[1] 
-                            self.create_heat_pump(neighbor) 
-                        elif self.source_type == 'geo_heat_pump' :
-                            supply_h += self.script_geo_heat_pump('supply_'+str(neighbor), x1,y1)[0] 
-                            equation += self.script_geo_heat_pump('supply_'+str(neighbor), x1,y1)[1] 
-                            self.create_heat_pump(neighbor)
-                        elif self.source_type == 'heat_pump_gas_boiler' :
-                            supply_h += self.script_heat_pump_gas_boiler('supply_'+str(neighbor), x1,y1)[0] 
-                            equation += self.script_heat_pump_gas_boiler('supply_'+str(neighbor), x1,y1)[1] 
-                            self.create_gas_boiler(neighbor)  
-                        elif self.source_type == 'sea' :
-                            supply_h += self.script_sea('supply_'+str(neighbor), x1,y1)[0] 
-                            equation += self.script_sea('supply_'+str(neighbor), x1,y1)[1] 
-                            self.create_sea(neighbor)     
-                    else :
-                        T_heating = self.graph.nodes[neighbor]['T_heating']
-                        T_DHW = self.graph.nodes[neighbor]['T_DHW']
-                        if T_heating and T_DHW :
-                        # in that case, two ports are created, and the SST works with 2 or 3 pipes
-                            buildings += self.script_substation('H_SST_'+str(neighbor), x1,y1, T=T_heating)[0]
-                            equation += self.script_substation('H_SST_'+str(neighbor), x1,y1, T=T_heating)[1]
-                            buildings += self.script_substation('W_SST_'+str(neighbor), x1,y1, T=T_DHW)[0]
-                            equation += self.script_substation('W_SST_'+str(neighbor), x1,y1, T=T_DHW)[1]
-                            equation += 'connect (hex_H_SST_'+str(neighbor)+'.port_b1, hex_W_SST_'+str(neighbor)+'.port_b1); \n'
-                            if self.n_pipes == 2 :
-                                equation += 'connect (valve_H_SST_'+str(neighbor)+'.port_a, valve_W_SST_'+str(neighbor)+'.port_a); \n'
-                            self.create_building(neighbor, both=True)
-                        elif self.n_pipes == 3 :
-                        # we must label the station heating or DHW to attribute the correct ports
-                            T = max(T_heating, T_DHW)
-                            buildings += self.script_substation('SST_'+str(neighbor), x1,y1, T)[0]
-                            equation += self.script_substation('SST_'+str(neighbor), x1,y1, T)[1]
-                            if T == T_heating :
-                                self.create_building(neighbor, L='L')
-                            elif T == T_DHW :
-                                self.create_building(neighbor)
+                        if self.source_type in ['simple_source', 'gas_boiler'] :
+                            declar, connections = self.build_source(neighbor, x2,y2)
+                            buildings.append(declar)
                         else :
-                        # there is only one demand temperature and one active port
-                            buildings += self.script_substation('SST_'+str(neighbor), x1,y1, T=max(T_heating, T_DHW))[0]
-                            equation += self.script_substation('SST_'+str(neighbor), x1,y1, T=max(T_heating, T_DHW))[1]
-                            self.create_building(neighbor)
+                            declar, connections = self.build_source(neighbor, x1,y1)
+                            supply_h.append(declar)
+                    else :
+                        declar, connections = self.build_substation(neighbor, x1,y1)
+                        buildings.append(declar)
+                    equation.append(connections)
 
                 # creation of pipes and connections if not already built
                 if not at['is_built'] :
-                    equation += '\n // ' + node + ', ' + neighbor + '\n \n'
+                    equation.append('\n // ' + node + ', ' + neighbor + '\n \n')
                     X,Y = (x1+x2)/2, (y1+y2)/2
 
                     # pipe length
-                    p = np.array([x1,y1])
-                    q = np.array([x2,y2])
-                    length = int(np.sqrt(np.sum((p-q)**2)))
+                    length = int(math.sqrt((x1-x2)**2 + (y1-y2)**2))
 
                     if self.n_pipes == 1 : # in the case of the ring model
                         
                         pipe_name = 'pipe_' + str(node) + str(neighbor)
-                        pipes += self.script_element(pipe_name, 'Buildings.Fluid.FixedResistances.Pipe', X,Y, nports=0, length=length)
+                        pipes.append(self.script_element(pipe_name, 'Buildings.Fluid.FixedResistances.Pipe', X,Y, nports=0, length=length))
+                        self.monitored.append((pipe_name+'.m_flow', None))
 
                         # we must connect port b to a
                         node_port = self.port(node, 'b')
                         neigh_port = self.port(neighbor, 'a')
-                        equation += 'connect (' + node_port + ', ' + pipe_name + '.port_a) \n    '
-                        equation += 'annotation (Line(points={{' + str((x1+X)//2) + ', ' + str((y1+Y)//2) + '}})) ;\n'
-                        equation += 'connect (' + pipe_name + '.port_b, ' + neigh_port + ') \n    '
-                        equation += 'annotation (Line(points={{' + str((x1+X)//2) + ', ' + str((y1+Y)//2) + '}})) ;\n'
+                        equation.append('connect (' + node_port + ', ' + pipe_name + '.port_a) ')
+                        equation.append(self.annotation('Line(points={{' + str((x1+X)//2) + ', ' + str((y1+Y)//2) + '}})', '\n    ', ' ') + ';\n')
+                        equation.append('connect (' + pipe_name + '.port_b, ' + neigh_port + ') ')
+                        equation.append(self.annotation('Line(points={{' + str((x1+X)//2) + ', ' + str((y1+Y)//2) + '}})', '\n    ', ' ') + ';\n')
 
                     else : # if n_ppes=2 or 3
                         for i in range (self.n_pipes) :
                             dir = self.dir_list[i]
                             pipe_name = 'pipe_' + str(node) + str(neighbor) + '_' + dir
-                            pipes += self.script_element(pipe_name, 'Buildings.Fluid.FixedResistances.Pipe', X,Y, nports=0, length=length)
+                            pipes.append(self.script_element(pipe_name, 'Buildings.Fluid.FixedResistances.Pipe', X,Y, nports=0, length=length))
+                            self.monitored.append((pipe_name+'.m_flow', None))
     
                             # we must connect port a to a, and b to b
                             node_port = self.port(node, dir)
                             neigh_port = self.port(neighbor, dir)
                             if node_port :
-                                equation += 'connect (' + node_port + ', ' + pipe_name + '.port_a) \n    '
-                                equation += 'annotation (Line(points={{' + str((x1+X)//2) + ', ' + str((y1+Y)//2) + '}})) ;\n'
+                                equation.append('connect (' + node_port + ', ' + pipe_name + '.port_a) ')
+                                equation.append(self.annotation('Line(points={{' + str((x1+X)//2) + ', ' + str((y1+Y)//2) + '}})', '\n    ', ' ') + ';\n')
                             self.graph.nodes[node]['port_'+dir] = pipe_name + '.port_a'
                             self.graph.nodes[node]['i_port_'+dir] = False
                             if neigh_port :
-                                equation += 'connect (' + pipe_name + '.port_b' + ', ' + neigh_port + ') \n    '
-                                equation += 'annotation (Line(points={{' + str((x2+X)//2) + ', ' + str((y2+Y)//2) + '}})) ;\n'
+                                equation.append('connect (' + pipe_name + '.port_b' + ', ' + neigh_port + ') ')
+                                equation.append(self.annotation('Line(points={{' + str((x2+X)//2) + ', ' + str((y2+Y)//2) + '}})', '\n    ', ' ') + ';\n')
                             self.graph.nodes[neighbor]['port_'+dir] = pipe_name + '.port_b'
                             self.graph.nodes[neighbor]['i_port_'+dir] = False
 
                         at['is_built'] = True
 
-        declaration += supply_h
-        declaration += buildings
-        declaration += pipes
-        
-        txt = begin + declaration + equation + end
-        return txt
+        monitor = self.script_steady_monitor()
+        return ''.join(['model ' + self.model_name + '\n \n \n'] + supply_h + buildings + pipes + monitor[:1] + equation
+            + monitor[1:] + ['\n \n end ' + self.model_name + ';'])
 
 
-    def write_model_ring (self) :
+    def script_substation_class(self) :
         '''
-        Returns modelica script for the whole ring model (n_pipes=1)
+        Returns the local model Substation of write_model_arrays : the components of script_substation,
+        with a port to the supply pipe, a port to the return pipe and the set point T as a parameter
         '''
+        annotations, monitored = self.annotations, self.monitored
+        self.annotations = False # components of an array are not placed
+        self.monitored = [] # the variables of the array are monitored by write_model_arrays
+        declar, connections = self.script_substation('SST', T='T')
+        self.annotations, self.monitored = annotations, monitored
+        return ('  model Substation "heat exchanger, valve and controller of one demand"\n'
+            + 'parameter Real T = 45 "set point of the secondary temperature (degC)";\n'
+            + 'Modelica.Fluid.Interfaces.FluidPort_a port_a (redeclare package Medium = Buildings.Media.Water);\n'
+            + 'Modelica.Fluid.Interfaces.FluidPort_b port_b (redeclare package Medium = Buildings.Media.Water);\n'
+            + declar + 'equation\n' + connections
+            + 'connect(port_a, valve_SST.port_a);\n'
+            + 'connect(hex_SST.port_b1, port_b);\n'
+            + '  end Substation;\n\n')
+
+    def script_array(self, name, values) :
+        '''
+        Returns the declaration of the index vector name, nothing if it is empty
+        '''
+        if not len(values) :
+            return ''
+        return 'parameter Integer ' + name + '[' + str(len(values)) + '] = {' + ', '.join([str(v) for v in values]) + '};\n'
 
-        begin = 'model ' + self.model_name + '\n \n \n'
-        end = '\n \n end ' + self.model_name + ';'
+    def script_loop(self, n, connection) :
+        '''
+        Returns a for loop of connection over i in 1:n, nothing if n is 0
+        '''
+        if not n :
+            return ''
+        return 'for i in 1:' + str(n) + ' loop\n  ' + connection + ';\nend for;\n'
 
-        declaration = ''
-        equation = '\n equation \n \n'
+    def write_model_arrays(self) :
+        '''
+        Returns modelica script of a tree network (n_pipes=2 or 3) with arrays of components
+        Buildings are numbered from 1 in the order of the graph, pipe k goes from the parent of building k
+        to building k, so that each junction of the network is given by index vectors :
+        pipe_up[i] is the pipe arriving at the building where pipe pipe_down[i] starts,
+        and the port of direction dir of substation substation_dir[i] is at the end of pipe building_dir[i]
+        As in write_model, a building without a port in a direction is a junction of the pipes of this direction
+        '''
+        supplies = [node for node in self.graph.nodes if self.graph.nodes[node]['is_supply_heating']]
+        if len(supplies) != 1 or not nx.is_tree(self.graph) :
+            raise ValueError('arrays of components need a tree network with one heat source')
+        root = supplies[0]
+        x, y = self.graph.nodes[root]['pos']
+        declar, connections = self.build_source(root, x, y)
+
+        buildings = [node for node in self.graph.nodes if node != root]
+        index = {node : k+1 for k, node in enumerate(buildings)}
+        parent = {v : u for u, v in nx.bfs_edges(self.graph.to_undirected(as_view=True), root)}
+        length = []
+        for node in buildings :
+            x1, y1 = self.graph.nodes[parent[node]]['pos']
+            x2, y2 = self.graph.nodes[node]['pos']
+            length.append(int(math.sqrt((x1-x2)**2 + (y1-y2)**2)))
+
+        # substations : one per demand, buildings needing heating and DHW have two (H and W)
+        T_set = []
+        ports = {dir : ([], []) for dir in self.dir_list} # dir -> buildings, substations
+        H, W = [], []
+        for node in buildings :
+            T_heating = self.graph.nodes[node]['T_heating']
+            T_DHW = self.graph.nodes[node]['T_DHW']
+            k = index[node]
+            if T_heating and T_DHW :
+                h, w = len(T_set)+1, len(T_set)+2
+                T_set += [T_heating, T_DHW]
+                for dir, sst in [('a', w), ('aL', h), ('b', h)] :
+                    ports[dir][0].append(k)
+                    ports[dir][1].append(sst)
+                H.append(h)
+                W.append(w)
+            else :
+                T = max(T_heating, T_DHW)
+                T_set.append(T)
+                L = 'L' if self.n_pipes == 3 and T == T_heating else ''
+                for dir in ['a'+L, 'b'] :
+                    ports[dir][0].append(k)
+                    ports[dir][1].append(len(T_set))
+            self.graph.nodes[node]['is_built'] = True
+
+        pipe_arg = self.arg['Buildings.Fluid.FixedResistances.Pipe'].strip().rstrip(',')
+        classes = [self.script_substation_class(), '  model Pipe = Buildings.Fluid.FixedResistances.Pipe (\n' + pipe_arg + ');\n\n']
+        supply_h = ['\n // Supply_heating \n \n', declar]
+        substations = ['\n // Buildings \n \n', 'Substation SST[' + str(len(T_set)) + '] (T={'
+            + ', '.join([str(T) for T in T_set]) + '});\n']
+        self.monitored.append(('SST.hex_SST.sta_b2.T', len(T_set)))
+        pipes = ['\n // Pipes \n \n']
+        vectors = ['\n // Index vectors \n \n']
+        equation = ['\n equation \n \n', '\n //' + str(root) + '\n \n', connections]
+
+        up = [index[parent[node]] for node in buildings if parent[node] != root]
+        down = [index[node] for node in buildings if parent[node] != root]
+        vectors += [self.script_array('pipe_up', up), self.script_array('pipe_down', down)]
+        vectors += [self.script_array('substation_H', H), self.script_array('substation_W', W)]
+        equation.append('\n // Substations \n \n')
+        equation.append(self.script_loop(len(H), 'connect(SST[substation_H[i]].port_b, SST[substation_W[i]].port_b)'))
+        if self.n_pipes == 2 :
+            equation.append(self.script_loop(len(H), 'connect(SST[substation_H[i]].port_a, SST[substation_W[i]].port_a)'))
+
+        for i in range (self.n_pipes) :
+            dir = self.dir_list[i]
+            pipe = 'pipe_' + dir
+            pipes.append('Pipe ' + pipe + '[' + str(len(buildings)) + '] (length={'
+                + ', '.join([str(l) for l in length]) + '});\n')
+            self.monitored.append((pipe + '.m_flow', len(buildings)))
+            equation.append('\n // ' + pipe + ' \n \n')
+
+            # pipes leaving the supply, joined together if the supply has no port in this direction
+            first = [pipe + '[' + str(index[node]) + '].port_a' for node in buildings if parent[node] == root]
+            for k in range (len(first)) :
+                root_port = self.port(root, dir)
+                if root_port :
+                    equation.append('connect (' + root_port + ', ' + first[k] + ');\n')
+                elif k :
+                    equation.append('connect (' + first[0] + ', ' + first[k] + ');\n')
+
+            # pipes between buildings, and substations at the end of the pipes
+            equation.append(self.script_loop(len(up), 'connect(' + pipe + '[pipe_up[i]].port_b, ' + pipe + '[pipe_down[i]].port_a)'))
+            building, sst = ports[dir]
+            vectors += [self.script_array('building_' + dir, building), self.script_array('substation_' + dir, sst)]
+            sst_port = '.port_b' if dir == 'b' else '.port_a'
+            equation.append(self.script_loop(len(building),
+                'connect(' + pipe + '[building_' + dir + '[i]].port_b, SST[substation_' + dir + '[i]]' + sst_port + ')'))
+
+        monitor = self.script_steady_monitor()
+        return ''.join(['model ' + self.model_name + '\n \n \n'] + classes + supply_h + substations + pipes + vectors
+            + monitor[:1] + equation + monitor[1:] + ['\n \n end ' + self.model_name + ';'])
 
 
-        supply_h = '\n // Supply_heating \n \n'
-        buildings = '\n // Buildings \n \n'
-        pipes = '\n // Pipes \n \n' 
+    def write_model_ring (self) :
+        '''
+        Returns modelica script for the whole ring model (n_pipes=1)
+        '''
+
+        supply_h = ['\n // Supply_heating \n \n']
+        buildings = ['\n // Buildings \n \n']
+        pipes = ['\n // Pipes \n \n']
+        equation = ['\n equation \n \n']
 
         for node, neighbors in self.graph.adjacency() :
             x1,y1 = self.graph.nodes[node]['pos']
-            nports_node = 0
-            nports_neighbor = 0
             # node construction if not already built
             if not self.graph.nodes[node]['is_built'] :
-                equation += '\n //' + node + '\n \n'
+                equation.append('\n //' + node + '\n \n')
                 if self.graph.nodes[node]['is_supply_heating'] : # the node is a heat source
-                    nports_node = len(list(self.graph.neighbors(node))) 
-                    if self.source_type == 'simple_source' :
-                        supply_h += self.script_simple_source('supply_'+str(node), x1,y1, nports_node)[0] 
-                        equation += self.script_simple_source('supply_'+str(node), x1,y1)[1] 
-                        self.create_simple_source(node)
-                    elif self.source_type == 'gas_boiler' :
-                        supply_h += self.script_gas_boiler('supply_'+str(node), x1,y1)[0] 
-                        equation += self.script_gas_boiler('supply_'+str(node), x1,y1)[1] 
-                        self.create_gas_boiler(node)  
-                    elif self.source_type == 'gas_boiler_geo' :
-                        supply_h += self.script_gas_boiler_geo('supply_'+str(node), x1,y1)[0] 
-                        equation += self.script_gas_boiler_geo('supply_'+str(node), x1,y1)[1] 
-                        self.create_gas_boiler(node)
-                    elif self.source_type == 'heat_pump' :
-                        supply_h += self.script_heat_pump('supply_'+str(node), x1,y1)[0] 
-                        equation += self.script_heat_pump('supply_'+str(node), x1,y1)[1] 
-                        self.create_heat_pump(node)  
-                    elif self.source_type == 'geo_heat_pump' :
-                        supply_h += self.script_geo_heat_pump('supply_'+str(node), x1,y1)[0] 
-                        equation += self.script_geo_heat_pump('supply_'+str(node), x1,y1)[1] 
-                        self.create_heat_pump(node)   
-                    elif self.source_type == 'heat_pump_gas_boiler' :
-                        supply_h += self.script_heat_pump_gas_boiler('supply_'+str(node), x1,y1)[0] 
-                        equation += self.script_heat_pump_gas_boiler('supply_'+str(node), x1,y1)[1] 
-                        self.create_gas_boiler(node)      
-                    elif self.source_type == 'sea' :
-                        supply_h += self.script_sea('supply_'+str(node), x1,y1)[0] 
-                        equation += self.script_sea('supply_'+str(node), x1,y1)[1] 
-                        self.create_sea(node)     
+                    declar, connections = self.build_source(node, x1,y1)
+                    supply_h.append(declar)
                 else : # the node is a substation
-                    T_heating = self.graph.nodes[node]['T_heating']
-                    T_DHW = self.graph.nodes[node]['T_DHW']
-                    if T_heating and T_DHW :
-                    # in that case, two ports are created, the SST works with 2 or 3 pipes
-                        buildings += self.script_substation('H_SST_'+str(node), x1,y1, T=T_heating, heat_pump=True)[0]
-                        equation += self.script_substation('H_SST_'+str(node), x1,y1, T=T_heating, heat_pump=True)[1]
-                        buildings += self.script_substation('W_SST_'+str(node), x1,y1, T=T_DHW, heat_pump=True)[0]
-                        equation += self.script_substation('W_SST_'+str(node), x1,y1, T=T_DHW, heat_pump=True)[1]
-                        equation += 'connect (HP_W_SST_'+str(node)+'.port_b1, HP_H_SST_'+str(node)+'.port_a1); \n'                 
-                        self.create_building(node, both=True, heat_pump=True)
-                    else :
-                    # there is only one demand temperature and one active port
-                        buildings += self.script_substation('SST_'+str(node), x1,y1, T=max(T_heating, T_DHW), heat_pump=True)[0]
-                        equation += self.script_substation('SST_'+str(node), x1,y1, T=max(T_heating, T_DHW), heat_pump=True)[1]
-                        self.create_building(node, heat_pump=True)
+                    declar, connections = self.build_substation(node, x1,y1, heat_pump=True)
+                    buildings.append(declar)
+                equation.append(connections)
 
             for neighbor,at in neighbors.items() :
                 x2,y2 = self.graph.nodes[neighbor]['pos']
 
                 # neighbor creation if not already built
                 if not self.graph.nodes[neighbor]['is_built'] :
-                    equation += '\n //' + neighbor + '\n \n'
+                    equation.append('\n //' + neighbor + '\n \n')
                     if self.graph.nodes[neighbor]['is_supply_heating'] :
-                        nports_neighbor = len(list(self.graph.neighbors(neighbor)))
-                        if self.source_type == 'simple_source' :
-                            buildings += self.script_simple_source('supply_'+str(neighbor), x2,y2, nports_neighbor)[0]
-                            equation += self.script_simple_source('supply_'+str(neighbor), x2,y2)[1]
-                            self.create_simple_source(neighbor)
-                        elif self.source_type == 'gas_boiler' :
-                            buildings += self.script_gas_boiler('supply_'+str(neighbor), x2,y2)[0]
-                            equation += self.script_gas_boiler('supply_'+str(neighbor), x2,y2)[1]
-                            self.create_gas_boiler(neighbor)
-                        elif self.source_type == 'gas_boiler_geo' :
-                            supply_h += self.script_gas_boiler_geo('supply_'+str(neighbor), x1,y1)[0] 
-                            equation += self.script_gas_boiler_geo('supply_'+str(neighbor), x1,y1)[1] 
-                            self.create_gas_boiler(neighbor) 
-                        elif self.source_type == 'heat_pump' :
-                            supply_h += self.script_heat_pump('supply_'+str(neighbor), x1,y1)[0] 
-                            equation += self.script_heat_pump('supply_'+str(neighbor), x1,y1)[1] 
-                            self.create_heat_pump(neighbor) 
-                        elif self.source_type == 'geo_heat_pump' :
-                            supply_h += self.script_geo_heat_pump('supply_'+str(neighbor), x1,y1)[0] 
-                            equation += self.script_geo_heat_pump('supply_'+str(neighbor), x1,y1)[1] 
-                            self.create_heat_pump(neighbor)
-                        elif self.source_type == 'heat_pump_gas_boiler' :
-                            supply_h += self.script_heat_pump_gas_boiler('supply_'+str(neighbor), x1,y1)[0] 
-                            equation += self.script_heat_pump_gas_boiler('supply_'+str(neighbor), x1,y1)[1] 
-                            self.create_gas_boiler(neighbor)  
-                        elif self.source_type == 'sea' :
-                            supply_h += self.script_sea('supply_'+str(neighbor), x1,y1)[0] 
-                            equation += self.script_sea('supply_'+str(neighbor), x1,y1)[1] 
-                            self.create_sea(neighbor)  
-                    else :
-                        T_heating = self.graph.nodes[neighbor]['T_heating']
-                        T_DHW = self.graph.nodes[neighbor]['T_DHW']
-                        if T_heating and T_DHW :
-                        # in that case, two ports are created, and the SST works with 2 or 3 pipes
-                            buildings += self.script_substation('H_SST_'+str(neighbor), x1,y1, T=T_heating, heat_pump=True)[0]
-                            equation += self.script_substation('H_SST_'+str(neighbor), x1,y1, T=T_heating, heat_pump=True)[1]
-                            buildings += self.script_substation('W_SST_'+str(neighbor), x1,y1, T=T_DHW, heat_pump=True)[0]
-                            equation += self.script_substation('W_SST_'+str(neighbor), x1,y1, T=T_DHW, heat_pump=True)[1]
-                            equation += 'connect (HP_W_SST_'+str(neighbor)+'.port_b1, HP_H_SST_'+str(neighbor)+'.port_a1); \n'  
-                            self.create_building(neighbor, both=True, heat_pump=True)
+                        if self.source_type in ['simple_source', 'gas_boiler'] :
+                            declar, connections = self.build_source(neighbor, x2,y2)
+                            buildings.append(declar)
                         else :
-                        # there is only one demand temperature and one active port
-                            buildings += self.script_substation('SST_'+str(neighbor), x1,y1, T=max(T_heating, T_DHW), heat_pump=True)[0]
-                            equation += self.script_substation('SST_'+str(neighbor), x1,y1, T=max(T_heating, T_DHW), heat_pump=True)[1]
-                            self.create_building(neighbor, heat_pump=True)   
+                            declar, connections = self.build_source(neighbor, x1,y1)
+                            supply_h.append(declar)
+                    else :
+                        declar, connections = self.build_substation(neighbor, x1,y1, heat_pump=True)
+                        buildings.append(declar)
+                    equation.append(connections)
 
         # creation of pipes and connections if not already built
-        for i in range (len(self.graph.nodes)) :
-            node = list(self.graph.nodes)[i]
-            neighbor = (list(self.graph.nodes)+[list(self.graph.nodes)[0]])[i+1]
-            equation += '\n // ' + node + ', ' + neighbor + '\n \n'
+        nodes = list(self.graph.nodes)
+        for i in range (len(nodes)) :
+            node = nodes[i]
+            neighbor = (nodes+[nodes[0]])[i+1]
+            equation.append('\n // ' + node + ', ' + neighbor + '\n \n')
             
             X,Y = (x1+x2)/2, (y1+y2)/2
             # pipe length
@@ -831,7 +866,8 @@ class PyToMod :
             length = int(np.sqrt(np.sum((p-q)**2)))
                         
             pipe_name = 'pipe_' + str(node) + str(neighbor)
-            pipes += self.script_element(pipe_name, 'Buildings.Fluid.FixedResistances.Pipe', X,Y, nports=0, length=length)
+            pipes.append(self.script_element(pipe_name, 'Buildings.Fluid.FixedResistances.Pipe', X,Y, nports=0, length=length))
+            self.monitored.append((pipe_name+'.m_flow', None))
 
             # we must connect port b to a
             node_port = self.port(node, 'b')
@@ -840,18 +876,14 @@ class PyToMod :
             neigh_port = self.port(neighbor, 'a')
             if self.graph.nodes[neighbor]['is_supply_heating'] :
                 neigh_port = self.port(neighbor, 'b')
-            equation += 'connect (' + node_port + ', ' + pipe_name + '.port_a); \n    '
-            equation += 'annotation (Line(points={{' + str((x1+X)//2) + ', ' + str((y1+Y)//2) + '}})) ;\n'
-            equation += 'connect (' + pipe_name + '.port_b, ' + neigh_port + '); \n    '
-            equation += 'annotation (Line(points={{' + str((x1+X)//2) + ', ' + str((y1+Y)//2) + '}})) ;\n'
-        
+            equation.append('connect (' + node_port + ', ' + pipe_name + '.port_a);')
+            equation.append(self.annotation('Line(points={{' + str((x1+X)//2) + ', ' + str((y1+Y)//2) + '}})', ' \n    ', ' ;') + '\n')
+            equation.append('connect (' + pipe_name + '.port_b, ' + neigh_port + ');')
+            equation.append(self.annotation('Line(points={{' + str((x1+X)//2) + ', ' + str((y1+Y)//2) + '}})', ' \n    ', ' ;') + '\n')
 
-        declaration += supply_h
-        declaration += buildings
-        declaration += pipes
-        
-        txt = begin + declaration + equation + end
-        return txt
+        monitor = self.script_steady_monitor()
+        return ''.join(['model ' + self.model_name + '\n \n \n'] + supply_h + buildings + pipes + monitor[:1] + equation
+            + monitor[1:] + ['\n \n end ' + self.model_name + ';'])
 
 
 
@@ -862,68 +894,108 @@ class PyToMod :
     def set_n_pipes(self, n_pipes) :
         self.n_pipes = n_pipes
 
+    def set_arrays(self, arrays) :
+        '''
+        arrays : True to write tree networks with arrays of components (see write_model_arrays)
+        '''
+        self.arrays = arrays
+
+    def set_annotations(self, annotations) :
+        '''
+        annotations : False to leave out the graphical annotations, for models that are only simulated
+        '''
+        self.annotations = annotations
+
+    def set_steady_monitor(self, window=600., rtol=1e-3, atol=1e-6, variables=None) :
+        '''
+        Adds a steady state monitor to the model (see script_steady_monitor), window=None removes it
+        window : length of the windows (s), the key variables are compared every window
+        rtol, atol : a variable has settled if it changed by less than atol + rtol*|value| during a window
+        variables : names of the key variables, None for the controlled temperature of the substations
+                    and the mass flow of the pipes
+        '''
+        self.steady_monitor = None if window is None else (window, rtol, atol, variables)
+
+    def script_steady_monitor(self) :
+        '''
+        Returns the declarations and the equations of the steady state monitor, nothing if there is none
+        The key variables are sampled every window, the simulation is terminated when all of them
+        have settled during two consecutive windows : the last window of the result is in steady state
+        '''
+        if self.steady_monitor is None :
+            return ['', '']
+        window, rtol, atol, variables = self.steady_monitor
+        monitored = self.monitored if variables is None else [(name, None) for name in variables]
+        if not monitored :
+            return ['', '']
+        n = sum([1 if size is None else size for name, size in monitored])
+        scalars = '{' + ', '.join([name for name, size in monitored if size is None]) + '}'
+        vectors = [name for name, size in monitored if size is not None]
+        u = scalars if not vectors else 'cat(1, ' + ', '.join(([scalars] if len(vectors) < len(monitored) else []) + vectors) + ')'
+        declar = ('\n // Steady state monitor \n \n'
+            + 'parameter Real steady_window(unit="s") = ' + str(window) + ' "length of the windows";\n'
+            + 'parameter Real steady_rtol = ' + str(rtol) + ';\n'
+            + 'parameter Real steady_atol = ' + str(atol) + ';\n'
+            + 'Real steady_u[' + str(n) + '] = ' + u + ' "key variables";\n'
+            + 'discrete Real steady_last[' + str(n) + '](each start=0, each fixed=true) "values at the last sample";\n'
+            + 'discrete Integer steady_count(start=0, fixed=true) "number of consecutive windows in steady state";\n')
+        equation = ('\n // Steady state monitor \n \n'
+            + 'when sample(steady_window, steady_window) then\n'
+            + '  steady_last = steady_u;\n'
+            + '  steady_count = if max(abs(steady_u - pre(steady_last)) - steady_rtol*abs(steady_u) .- steady_atol) <= 0\n'
+            + '    then pre(steady_count) + 1 else 0;\n'
+            + 'end when;\n'
+            + 'when steady_count >= 2 then\n'
+            + '  terminate("steady state reached");\n'
+            + 'end when;\n')
+        return [declar, equation]
+
     def pipe_length(self) :
-        L = 0
-        for edge in self.graph.edges :
-            x1,y1 = self.graph.nodes[edge[0]]['pos']
-            x2,y2 = self.graph.nodes[edge[1]]['pos']
-            p = np.array([x1,y1])
-            q = np.array([x2,y2])
-            length = int(np.sqrt(np.sum((p-q)**2)))
-            L += length * self.n_pipes
-        return L
+        '''
+        Returns the total length of pipes, n_pipes pipes per edge
+        each length is truncated to an integer, as in write_model
+        '''
+        if not self.graph.number_of_edges() :
+            return 0
+        nodes = self.graph.nodes
+        p = np.array([nodes[u]['pos'] for u, v in self.graph.edges], dtype=float)
+        q = np.array([nodes[v]['pos'] for u, v in self.graph.edges], dtype=float)
+        length = np.sqrt(np.sum((p-q)**2, axis=1)).astype(int)
+        return int(np.sum(length)) * self.n_pipes
+
 
 
 
 
+    def model_text(self) :
+        '''
+        Returns modelica script of the model, ring model if n_pipes=1
+        The model can be generated several times
+        '''
+        self.reset()
+        if self.n_pipes == 1 :
+            return self.write_model_ring()
+        if self.arrays :
+            return self.write_model_arrays()
+        return self.write_model()
+
 
     def write_in_file(self, file_name) :
         '''
         Includes script from write_model in file 'file_name'
         which is a modelica package that must already exist
         if model named model_name already exists, replaces it with txt
+        The package is indexed once (see package.py), so only the model itself is written
+        file_name can also be a package directory (e.g 'Method'), with one file per model
         '''
 
-        package_name = file_name[:-3]
-        file1 = open(file_name, 'r')
-        file2 = open(self.model_name+'.mo', 'w')
-        if self.n_pipes == 1 :
-            txt = self.write_model_ring()
-        else :
-            txt = self.write_model()
-        go_on = True
-        write = True
-
-        while go_on :
-            line = file1.readline()
-            if line.startswith('model '+self.model_name) :
-                write = False
-            elif line.startswith('end ' + package_name + ';') :
-                go_on = False
-                file2.write(txt+'\n')
-                file2.write('end ' + package_name + ';')
-
-            if write and go_on: 
-                file2.write(line)
-
-            if line.startswith('end '+self.model_name+';') :
-                write = True
-
-        file1.close()
-        file2.close()
-        os.remove(file_name)
-        os.rename(self.model_name+'.mo', file_name)
-
+        open_package(file_name).write(self.model_name, self.model_text())
         return True
 
 
-
-    
-
-        
-                 
-            
-                
-
-
-            
\ No newline at end of file
+def write_models_in_file(models, file_name) :
+    '''
+    Writes several PyToMod models in package 'file_name' (file or directory) in a single pass
+    '''
+    open_package(file_name).write_many({model.model_name : model.model_text() for model in models})
+    return True
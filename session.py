@@ -0,0 +1,242 @@
+# Simulator sessions kept alive between simulations
+# Starting Dymola and loading the Buildings library takes much longer than
+# simulating one of our models, so each worker is started once
+# and then reused for every job it receives
+
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from backend import get_backend
+from tracing import span
+
+working_dir = os.getcwd()
+
+BUILDINGS_PATH = os.path.join(working_dir, 'Dymola', 'Buildings-v9.0.0', 'Buildings 9.0.0', 'package.mo')
+
+
+class SessionError(Exception) :
+    '''
+    Raised when a session cannot be started or has crashed too many times
+    '''
+    pass
+
+
+class Session :
+    '''
+    One running simulator with its libraries already loaded
+    '''
+
+    def __init__(self, libraries=(BUILDINGS_PATH,), backend='dymola', **kwargs) :
+        '''
+        libraries : modelica files loaded once, when the session starts
+        backend : name of the simulator backend, see backend.py
+        kwargs : passed to the backend
+        '''
+        self.libraries = list(libraries)
+        self.backend = backend
+        self.kwargs = kwargs
+        self.sim = None
+        self.loaded = {} # path -> (mtime, size) of the loaded version
+        self.n_jobs = 0
+        self.n_starts = 0
+
+    def start(self) :
+        '''
+        Starts the simulator and loads the libraries
+        '''
+        self.sim = get_backend(self.backend, **self.kwargs)
+        with span('start simulator', 'simulator', backend=self.backend) :
+            self.sim.open()
+        self.loaded = {}
+        self.n_starts += 1
+        for path in self.libraries :
+            if not self.open_model(path) :
+                self.close()
+                raise SessionError('could not load ' + path)
+        return self
+
+    def close(self) :
+        if self.sim is not None :
+            try :
+                self.sim.close()
+            except Exception :
+                pass # the process may already be dead
+        self.sim = None
+        self.loaded = {}
+
+    def restart(self) :
+        self.close()
+        return self.start()
+
+    def is_alive(self) :
+        '''
+        Cheap round trip to the simulator
+        Any failure means the process has crashed or hangs
+        '''
+        if self.sim is None :
+            return False
+        try :
+            self.sim.ping()
+            return True
+        except Exception :
+            return False
+
+    def open_model(self, path) :
+        '''
+        Loads a modelica file, only if it has changed since it was last loaded
+        '''
+        st = os.stat(path)
+        version = (st.st_mtime_ns, st.st_size)
+        if self.loaded.get(path) == version :
+            return True
+        # libraries are loaded when the session starts, packages when they are modified
+        with span('load ' + ('library' if path in self.libraries else 'package'), 'simulator', path=path) :
+            ok = self.sim.open_model(path)
+        if ok :
+            self.loaded[path] = version
+        return ok
+
+    def simulate(self, problem, packages=(), workdir=None, **kwargs) :
+        '''
+        Loads the packages if needed and simulates problem
+        kwargs are passed to the simulate method of the backend
+        Returns ok, values, log (log is empty if the simulation succeeded)
+        '''
+        for path in packages :
+            if not self.open_model(path) :
+                return False, [], self.sim.error_log()
+        if workdir is not None :
+            self.sim.cd(workdir)
+        with span('translate and simulate', 'simulator', problem=problem) :
+            ok, values = self.sim.simulate(problem, **kwargs)
+        self.n_jobs += 1
+        log = '' if ok else self.sim.error_log()
+        return ok, values, log
+
+    def translate(self, problem, packages=(), workdir=None) :
+        '''
+        Loads the packages if needed and translates problem in workdir
+        Returns ok, the names of the files written by the translation, log
+        '''
+        for path in packages :
+            if not self.open_model(path) :
+                return False, [], self.sim.error_log()
+        if workdir is not None :
+            self.sim.cd(workdir)
+        with span('translate', 'simulator', problem=problem) :
+            ok, files = self.sim.translate(problem)
+        log = '' if ok else self.sim.error_log()
+        return ok, files, log
+
+    def run_translated(self, directory, dsin, workdir=None, resultFile='res') :
+        '''
+        Runs the model translated in directory with the input file dsin, see Backend.run_translated
+        Returns ok, log
+        '''
+        if workdir is not None :
+            self.sim.cd(workdir)
+        with span('simulate', 'simulator', directory=os.path.basename(directory)) :
+            ok = self.sim.run_translated(directory, dsin, resultFile)
+        self.n_jobs += 1
+        log = '' if ok else self.sim.error_log()
+        return ok, log
+
+    def simulate_multi(self, problem, packages=(), workdir=None, **kwargs) :
+        '''
+        Loads the packages if needed and simulates problem for each row of initialValues,
+        translating it once (see Backend.simulate_multi)
+        Returns ok, the list of the ok of each run, log
+        '''
+        for path in packages :
+            if not self.open_model(path) :
+                return False, [], self.sim.error_log()
+        if workdir is not None :
+            self.sim.cd(workdir)
+        with span('translate and simulate multi', 'simulator', problem=problem) :
+            ok, oks = self.sim.simulate_multi(problem, **kwargs)
+        self.n_jobs += len(oks)
+        log = '' if ok else self.sim.error_log()
+        return ok, oks, log
+
+
+class SessionPool :
+    '''
+    N warm simulator sessions handed out to simulation jobs
+    Crashed sessions are restarted before being given out again
+    '''
+
+    def __init__(self, n_workers=1, max_restarts=3, **kwargs) :
+        '''
+        n_workers : number of simulator processes
+        max_restarts : number of restarts allowed per job before giving up
+        kwargs : passed to Session
+        '''
+        self.n_workers = n_workers
+        self.max_restarts = max_restarts
+        self.kwargs = kwargs
+        self.sessions = []
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+
+    def start(self) :
+        '''
+        Starts all workers, the libraries are loaded once per worker
+        '''
+        for i in range (self.n_workers) :
+            session = Session(**self.kwargs).start()
+            self.sessions.append(session)
+            self.idle.put(session)
+        return self
+
+    def close(self) :
+        with self.lock :
+            for session in self.sessions :
+                session.close()
+            self.sessions = []
+
+    def __enter__(self) :
+        return self.start()
+
+    def __exit__(self, *exc) :
+        self.close()
+
+    def acquire(self, timeout=None) :
+        '''
+        Returns an idle session, restarted first if it has crashed
+        '''
+        session = self.idle.get(timeout=timeout)
+        if not session.is_alive() :
+            try :
+                session.restart()
+            except Exception :
+                self.idle.put(session)
+                raise
+        return session
+
+    def release(self, session) :
+        self.idle.put(session)
+
+    @contextmanager
+    def session(self, timeout=None) :
+        session = self.acquire(timeout)
+        try :
+            yield session
+        finally :
+            self.release(session)
+
+    def simulate(self, problem, packages=(), **kwargs) :
+        '''
+        Runs one simulation on a warm session
+        If the session crashes during the job, it is restarted and the job is retried
+        Returns ok, values, log
+        '''
+        for attempt in range (self.max_restarts+1) :
+            with self.session() as session :
+                try :
+                    return session.simulate(problem, packages, **kwargs)
+                except Exception :
+                    if session.is_alive() :
+                        raise # error unrelated to the session itself
+                    session.close()
+        raise SessionError(problem + ' : session crashed ' + str(self.max_restarts+1) + ' times')
@@ -1,19 +1,30 @@
 import networkx as nx
 import itertools as it
-import pandas as pd
-import sdf
 import os
-from tree import Tree
+import re
+from tree import Tree, iter_sequences, sample_sequences, canonical_hash, rank, unrank
+from surrogate import Surrogate, graph_features, select, targets
+from hydraulics import graph_arrays, solve, pareto_front
 from pyToMod import PyToMod
 import numpy as np
+import pandas as pd
 
 # Prüfer code generation
 n = 4 # number of stations (supply or building) in district
-sequences = []
-for comb in it.combinations_with_replacement(range(n), n-2) :
-    for perm in it.permutations(comb) :
-        sequences.append(perm)
-P_list = list(set(sequences))
+# the n^(n-2) trees are enumerated lazily in lexicographic order (see tree.py)
+# model j of a block is the tree of the sequence of rank j, given by unrank(j, n)
+shard = None # part of the sequences simulated by this process, None for all of them
+n_shards = 1
+n_samples = None # number of random trees simulated instead of all of them, when n is large
+seed = 0
+
+def prufer_sequences() :
+    '''
+    Returns an iterator of (rank, sequence) over the trees to simulate
+    '''
+    if n_samples is not None :
+        return iter(sample_sequences(n, n_samples, seed))
+    return iter_sequences(n, shard=shard, n_shards=n_shards)
 
 def create_G(supply_name) :
     '''
@@ -97,290 +108,590 @@ source_param_3 = {'gas_boiler': {'names' : ['constant_supply_gas_boiler.k', 'con
     'simple_source' : {'names' : [], 'val' : []}
     }
 
-# specific variables to read at the end of the simulation
+# KPIs of the results table, see kpi.Extractor
+# gas_boiler, heat_pump, geothermal flags of each source
+source_flags = {'gas_boiler' : (True, False, False),
+    'heat_pump' : (False, True, False),
+    'heat_pump_gas_boiler' : (True, True, False),
+    'geo_heat_pump' : (False, True, True),
+    'gas_boiler_geo' : (True, False, True),
+    'simple_source' : (False, False, False),
+    'sea' : (False, False, False)
+    }
+
+# variables whose steady state average gives gas_P and HP_P
 # n_pipes=1
-source_results_1 = {'gas_boiler' : {'component' : ['boiler_supply_gas_boiler'], 'var' : ['QFue_flow']},
-    'heat_pump' : {'component' : ['HP_supply_heat_pump'], 'var' : ['P']},
-    'gas_boiler_geo' : {'component' : ['boiler_supply_gas_boiler'], 'var' :['QFue_flow']},
-    'geo_heat_pump' : {'component' : ['HP_supply_geo_heat_pump'], 'var' : ['P']},
-    'heat_pump_gas_boiler' : {'component' : ['boiler_supply_heat_pump_gas_boiler', 'HP_supply_heat_pump_gas_boiler'], 'var' : ['QFue_flow', 'P']}  
+source_powers_1 = {'gas_boiler' : {'gas_P' : ['boiler_supply_gas_boiler.QFue_flow']},
+    'heat_pump' : {'HP_P' : ['HP_supply_heat_pump.P']},
+    'gas_boiler_geo' : {'gas_P' : ['boiler_supply_gas_boiler.QFue_flow']},
+    'geo_heat_pump' : {'HP_P' : ['HP_supply_geo_heat_pump.P']},
+    'heat_pump_gas_boiler' : {'gas_P' : ['boiler_supply_heat_pump_gas_boiler.QFue_flow'], 'HP_P' : ['HP_supply_heat_pump_gas_boiler.P']}
     }
 
 # n_pipes=2
-source_results_2 = {'gas_boiler' : {'component' : ['boiler_supply_gas_boiler'], 'var' : ['QFue_flow']},
-    'heat_pump' : {'component' : ['HP_supply_heat_pump'], 'var' : ['P']},
-    'gas_boiler_geo' : {'component' : ['boiler_supply_gas_boiler_geo'], 'var' :['QFue_flow']},
-    'geo_heat_pump' : {'component' : ['HP_supply_geo_heat_pump'], 'var' : ['P']},
-    'heat_pump_gas_boiler' : {'component' : ['boiler_supply_heat_pump_gas_boiler', 'HP_supply_heat_pump_gas_boiler'], 'var' : ['QFue_flow', 'P']}  
+source_powers_2 = {'gas_boiler' : {'gas_P' : ['boiler_supply_gas_boiler.QFue_flow']},
+    'heat_pump' : {'HP_P' : ['HP_supply_heat_pump.P']},
+    'gas_boiler_geo' : {'gas_P' : ['boiler_supply_gas_boiler_geo.QFue_flow']},
+    'geo_heat_pump' : {'HP_P' : ['HP_supply_geo_heat_pump.P']},
+    'heat_pump_gas_boiler' : {'gas_P' : ['boiler_supply_heat_pump_gas_boiler.QFue_flow'], 'HP_P' : ['HP_supply_heat_pump_gas_boiler.P']}
     }
 
 # n_pipes=3
-source_results_3 = {'gas_boiler' : {'component' : ['boiler_supply_gas_boiler', 'boilerL_supply_gas_boiler'], 'var' : ['QFue_flow', 'QFue_flow']},
-    'heat_pump' : {'component' : ['HP_supply_heat_pump', 'HPL_supply_heat_pump'], 'var' : ['P', 'P']},
-    'gas_boiler_geo' : {'component' : ['boiler_supply_gas_boiler_geo', 'boilerL_supply_gas_boiler_geo'], 'var' :['QFue_flow', 'QFue_flow']},
-    'geo_heat_pump' : {'component' : ['HP_supply_geo_heat_pump', 'HPL_supply_geo_heat_pump'], 'var' : ['P', 'P']},
-    'heat_pump_gas_boiler' : {'component' : ['boiler_supply_heat_pump_gas_boiler', 'HP_supply_heat_pump_gas_boiler', 'boilerL_supply_heat_pump_gas_boiler', 'HPL_supply_heat_pump_gas_boiler'], 'var' : ['QFue_flow', 'P', 'QFue_flow', 'P']}  
-    } 
+# the results tables have always kept the power of the low temperature units (L) only
+source_powers_3 = {'gas_boiler' : {'gas_P' : ['boilerL_supply_gas_boiler.QFue_flow']},
+    'heat_pump' : {'HP_P' : ['HPL_supply_heat_pump.P']},
+    'gas_boiler_geo' : {'gas_P' : ['boilerL_supply_gas_boiler_geo.QFue_flow']},
+    'geo_heat_pump' : {'HP_P' : ['HPL_supply_geo_heat_pump.P']},
+    'heat_pump_gas_boiler' : {'gas_P' : ['boilerL_supply_heat_pump_gas_boiler.QFue_flow'], 'HP_P' : ['HPL_supply_heat_pump_gas_boiler.P']}
+    }
 
 source_param = [source_param_1, source_param_2, source_param_3]
-source_results = [source_results_1, source_results_2, source_results_3]
+source_powers = [source_powers_1, source_powers_2, source_powers_3]
 sources = ['gas_boiler', 'heat_pump', 'heat_pump_gas_boiler', 'geo_heat_pump', 'gas_boiler_geo']
 
 
+
+def kpi_spec(source, n_pipes) :
+    """
+    returns the spec of the KPI columns of a model of the sweep
+    """
+    gas_boiler, heat_pump, geothermal = source_flags[source]
+    spec = {'gas_boiler' : {'value' : gas_boiler},
+        'heat_pump' : {'value' : heat_pump},
+        'geothermal' : {'value' : geothermal},
+        'geo_P' : {'value' : 5e2 if geothermal else np.nan},
+        'pump_P' : {'vars' : ['hex_SST_Building_1.m1_flow'], 'scale' : 4e5*0.001} # m_flow*dP*0.001
+        }
+    for column, names in source_powers[n_pipes-1].get(source, {}).items() :
+        spec[column] = {'vars' : names}
+    return spec
+
+
+def named_buildings(G, source, n_pipes) :
+    """
+    returns the buildings of G whose components are read by the KPIs or set by init_parameters,
+    e.g Building_1 for hex_SST_Building_1.m1_flow : the results depend on their names,
+    so they are fixed points of the classes of equivalent networks (see canonical_hash)
+    """
+    names = init_parameters(source, n_pipes)[0] + [name for s in kpi_spec(source, n_pipes).values() for name in s.get('vars', [])]
+    return [node for node in G.nodes if node != source
+        and any([re.search(re.escape(str(node)) + r'(?!\d)', name) for name in names])]
+
+
+def init_parameters(source, n_pipes) :
+    """
+    returns init_names, init_val for a model of the sweep
+    """
+    init_names =[]
+    init_val = []
+
+    # Building_1 (water for heating)
+    init_names += ['source_SST_Building_1.m_flow', 'source_SST_Building_1.T', 'sink_SST_Building_1.p', 'constant_SST_Building_1.k']
+    init_val += [1, 273.15+40, 2e5, 273.15+45]
+
+    # Building_2 (hot domestic water)
+    init_names += ['source_SST_Building_2.m_flow', 'source_SST_Building_2.T', 'sink_SST_Building_2.p', 'constant_SST_Building_2.k']
+    init_val += [1, 273.15+12, 2e5, 273.15+60]
+
+    # Building_3 (both)
+    init_names += ['source_W_SST_Building_3.m_flow', 'source_W_SST_Building_3.T', 'sink_W_SST_Building_3.p', 'constant_W_SST_Building_3.k']
+    init_val += [1, 273.15+12, 2e5, 273.15+60]
+    init_names += ['source_H_SST_Building_3.m_flow', 'source_H_SST_Building_3.T', 'sink_H_SST_Building_3.p', 'constant_H_SST_Building_3.k']
+    init_val += [1, 273.15+40, 2e5, 273.15+45]
+
+    # Fluid circulation
+    init_names += ['prod_supply_'+source+'.p', 'sink_supply_'+source+'.p']
+    init_val += [5e5, 1e5]
+
+    # Heat source
+    init_names += source_param[n_pipes-1][source]['names'] 
+    init_val += source_param[n_pipes-1][source]['val']
+
+    return init_names, init_val
+
+
+# surrogate screening of the trees (see surrogate.py), None to simulate all of them
+# top : fraction of the trees with the lowest predicted power, explore : fraction of random other trees
+# min_train : number of results of the source already in the store needed to train the surrogate
+screening = None # e.g {'top' : 0.2, 'explore' : 0.05, 'min_train' : 20, 'alpha' : 1.}
+
+
+def screen(trees, source, n_pipes, store) :
+    """
+    returns the trees predicted best by a surrogate trained on the results of the store, and a few random ones
+    trees : list of (rank, graph), all of them are kept while the store has too few results
+    """
+    prefix = 'model_'+source+'_'+str(n_pipes)
+    done = store.read(columns=['model_id'] + targets, source=source, n_pipes=n_pipes)
+    known = set(done['model_id'])
+    new = [(j, G) for j, G in trees if prefix+str(j) not in known]
+    if len(done) < screening['min_train'] or not new :
+        return trees
+
+    # the trees already simulated are decoded again from the rank in their model_id
+    X = []
+    for model_id in done['model_id'] :
+        G = create_G(source)
+        Tree(G).construct_tree(list(unrank(int(model_id[len(prefix):]), n)))
+        X.append(graph_features(G, source, n_pipes))
+    model = Surrogate(screening['alpha']).fit(X, done[targets].values)
+
+    # objective : total power, gas_P, HP_P or pump_P are nan when the source has no such unit
+    predicted = model.predict([graph_features(G, source, n_pipes) for j, G in new])
+    keep = select(np.nansum(predicted, axis=1), screening['top'], screening['explore'], seed)
+    print(source, n_pipes, ' : ', len(keep), ' trees out of ', len(new), ' sent to the simulator')
+    chosen = set([new[k][0] for k in keep])
+    return [(j, G) for j, G in trees if prefix+str(j) in known or j in chosen]
+
+
+# trees whose analytic pump power and heat loss are both worse than those of another tree
+# are not simulated (see hydraulics.py)
+reject_dominated = False
+
+
+def prescreen(trees, source, n_pipes) :
+    """
+    returns the trees that are not dominated, according to the analytic steady state of hydraulics.py
+    trees : list of (rank, graph)
+    """
+    if not trees :
+        return trees
+    arrays = [graph_arrays(G, source, list(trees[0][1].nodes)) for j, G in trees]
+    parent, length, heating, dhw = [np.concatenate([a[k] for a in arrays]) for k in range (4)]
+    res = solve(parent, length, heating, dhw, n_pipes)
+    keep = pareto_front(np.stack([res['pump_P'], res['heat_loss']], axis=1))
+    print(source, n_pipes, ' : ', int(keep.sum()), ' trees out of ', len(trees), ' not dominated')
+    return [tree for tree, k in zip(trees, keep) if k]
+
+
 from pathlib import Path
 working_dir = Path(os.getcwd())
 
-import sys
-sys.path.insert(0, os.path.join(working_dir, 'Dymola', 'interface', 'dymola.egg'))
-from dymola.dymola_interface import DymolaInterface
-from dymola.dymola_exception import DymolaException
-dymola = None
-path = os.path.join(working_dir, 'Method.mo')
-
-
-# initialization of data, that will contain all usefull variables from simulation
-data = []
-
-
-# we first create and simulate model_ring alone
-# values initialization 
-model_id = 'model_sea_ring'
-n_pipes = 1
-gas_boiler = False
-heat_pump = False
-geothermal = False
-gas_P = np.nan
-HP_P = np.nan
-geo_P = np.nan
-indiv_HP_P = np.nan
-pump_P = np.nan
+from session import SessionPool, BUILDINGS_PATH
+from sweep import SweepRunner, columns
+from package import open_package
+from cache import ResultCache
+from store import ResultStore
+from archive import TrajectoryArchive, default_vars
+from dsres import DsresFile
+from kpi import result_stats, Extractor
+from optimize import GeneticSearch
+from translation import structure_key
+from tracing import tracer, span
+
+# generated models are written in the package directory Method/, one file per model (see package.py)
+# so that each simulation only parses the model it needs
+# path can also be set to the single-file package Method.mo
+path = os.path.join(working_dir, 'Method')
+
+# number of simultaneous simulations : each worker runs its own Dymola and checks out one licence,
+# so n_workers must not exceed the number of licences available, whatever the number of cores
+n_workers = 4
+
+# variables whose trajectories are archived (see archive.py) : temperatures, mass flows and pipe heat losses
+archive_vars = default_vars
+
+# graphical annotations in the models of the sweep, only needed to open them in Dymola
+# the ring model keeps its annotations
+annotations = False
+
+# steady state monitor of the models of the sweep (see PyToMod.set_steady_monitor) : the simulation stops
+# once the key temperatures and flows have settled during two windows, stopTime is only an upper bound,
+# and the KPIs are the averages over the last window of the result. None to always simulate until stopTime
+steady_monitor = {'window' : 600, 'rtol' : 1e-3, 'atol' : 1e-6}
+window = None if steady_monitor is None else steady_monitor['window']
+
+# Chrome trace of the stages of the run and of every job (see tracing.py), None to record nothing
+# a summary table of the stages is printed at the end
+trace = 'trace.json'
+
+# simulator backend, 'dymola' or 'mock' to run the whole pipeline without licence (see backend.py)
+backend = 'dymola'
+libraries = [BUILDINGS_PATH] if backend == 'dymola' else []
+
+
+# 'sweep' simulates every tree (or the trees of prufer_sequences), 'optimize' searches the best
+# tree, source and number of pipes with a genetic algorithm over Prüfer codes (see optimize.py)
+mode = 'sweep'
+# objective : total power gas_P + HP_P + pump_P of the configuration, the lowest is the best
+optimization = {'population' : 20, 'generations' : 10, 'patience' : 3, 'elite' : 2, 'tournament' : 3,
+    'crossover' : 0.9, 'mutation' : None}
+
+
+# parameter study of one model : the model is translated once and simulated for every combination
+# of the values of parameters (see SweepRunner.run_multi), None for no study
+# parameters not given keep their value of init_parameters, KPIs are written in sensitivity.csv
+sensitivity = None # e.g {'source' : 'heat_pump', 'n_pipes' : 2, 'rank' : 0, 'parameters' :
+    # {'source_sea_supply_heat_pump.T' : [273.15+10, 273.15+15, 273.15+20], 'source_sea_supply_heat_pump.m_flow' : [3, 5, 7]}}
+
+
+# simulation settings, part of the cache keys
+settings = {'backend' : backend, 'startTime' : 0.0, 'stopTime' : 6000, 'numberOfIntervals' : 100}
+
+
+def simulate_trees(trees, n_pipes, runner, cache, store, archive) :
+    """
+    simulates the trees of every source that are not already in the store, and returns their rows
+    trees : dict source -> list of (rank, graph), model j of source is 'model_'+source+'_'+str(n_pipes)+str(j)
+    models are all written in the package first, then simulated in parallel
+    each job has its own scratch directory and result file
+    """
+    jobs = []
+    texts = {} # model_id -> modelica script
+    keys = {} # model_id -> cache key
+    model_sources = {} # model_id -> source, of the models waiting for a simulation
+    pending = {} # cache key -> model_ids of identical models waiting for the same simulation
+    classes = {} # (source, canonical hash) -> model_ids of equivalent networks, the first one is simulated
+    # buildings named in the KPIs or the parameters are not relabelled
+    fixed = {source : named_buildings(trees[source][0][1], source, n_pipes) for source in trees if trees[source]}
+    # the KPIs of each source are compiled once for the block
+    extractors = {source : Extractor(kpi_spec(source, n_pipes), columns[2:]) for source in trees}
+    # rows already in the store
+    model_ids = ['model_'+source+'_'+str(n_pipes)+str(j) for source in trees for j, G in trees[source]]
+    with span('read store', 'store') :
+        rows = {row[0] : row for row in store.read(columns=columns, model_id=model_ids).values.tolist()} if model_ids else {}
+
+    def add(model_id, row, source) :
+        # each row is written once in the store
+        if model_id not in rows :
+            rows[model_id] = [model_id] + list(row[1:])
+            store.append(rows[model_id] + [source])
+
+    def on_row(row) :
+        # the result is stored and cached as soon as it is known, and copied to identical models
+        key = keys[row[0]]
+        cache.put(key, row)
+        for model_id in pending[key] :
+            add(model_id, row, model_sources[model_id])
+            archive.link(model_id, row[0])
+
+    for source in trees :
+        for j, G in trees[source] :
+            model_id = 'model_'+source+'_'+str(n_pipes)+str(j)
+
+            # networks equal up to the names of the buildings that the KPIs and parameters do not refer to are simulated once
+            with span('canonical hash', 'cache') :
+                cls = (source, canonical_hash(G, source, fixed=fixed[source]))
+            if cls in classes :
+                classes[cls].append(model_id)
+                continue
+            classes[cls] = [model_id]
+            if model_id in rows :
+                continue
+
+            init_names, init_val = init_parameters(source, n_pipes)
+            # cached rows are only valid for the same KPI spec
+            spec = dict(settings, kpis=kpi_spec(source, n_pipes), t_steady=5400, steady_monitor=steady_monitor)
+            with span('cache lookup', 'cache') :
+                config_key = cache.config_key(G, source, n_pipes, init_names, init_val, spec)
+                row = cache.lookup(config_key)
+            if row is not None : # no generation and no simulation
+                add(model_id, row, source)
+                continue
+
+            model = PyToMod(G, model_id)
+            model.set_source(source)
+            model.set_n_pipes(n_pipes)
+            model.set_annotations(annotations)
+            if steady_monitor is not None :
+                model.set_steady_monitor(**steady_monitor)
+            with span('generate', 'generation', model_id=model_id) :
+                txt = model.model_text()
+            with span('cache lookup', 'cache') :
+                key = cache.key(txt, init_names, init_val, spec)
+                cache.link(config_key, key)
+                row = cache.get(key)
+            if row is not None : # identical model already simulated under another name
+                add(model_id, row, source)
+                continue
+            model_sources[model_id] = source
+            if key in pending :
+                pending[key].append(model_id)
+                continue
+            pending[key] = [model_id]
+            texts[model_id] = txt
+            keys[model_id] = key
+
+            # models of the same structure share their translation (see translation.py)
+            jobs.append(runner.job(model_id, 'Method.'+model_id, open_package(path).files(model_id), source, n_pipes,
+                extractors[source], init_names, init_val, structure=structure_key(txt, libraries, backend), window=window))
+
+    # all models are written in the package in a single pass
+    with span('write package', 'generation', models=len(texts)) :
+        open_package(path).write_many(texts)
+
+    print('n_pipes : ', n_pipes, ', ', len(jobs), ' jobs on ', runner.n_workers, ' workers, ', cache.hits, ' results from cache, ',
+        sum([len(members)-1 for members in classes.values()]), ' equivalent networks')
+    with span('run jobs', 'simulation', jobs=len(jobs)) :
+        failed = runner.run(jobs, on_row=on_row)[1]
+
+    # equivalent networks get the result of the first network of their class
+    # their trajectories are not linked : the components of the relabelled buildings have other names
+    for (source, h), members in classes.items() :
+        if members[0] in rows :
+            for model_id in members[1:] :
+                add(model_id, rows[members[0]], source)
+    # the rows of the block are written in a few parts, rows lost by a crash before the flush are in the cache
+    store.flush()
+
+    # identical models waiting for the same simulation, and the equivalent networks of all of them, fail with it
+    equivalents = {members[0] : members[1:] for members in classes.values()}
+    for model_id, log in failed :
+        identical = [m for m in pending[keys[model_id]] if m != model_id]
+        dependents = identical + [m for first in [model_id] + identical for m in equivalents.get(first, [])]
+        print(model_id, " : simulation failed. Below is the translation log.")
+        if dependents :
+            print('failed with ' + model_id + ' (same simulation or equivalent network) : ' + ', '.join(dependents))
+        print(log)
+    return rows
+
+
+def export_results(store, file_name, max_pipes=3) :
+    """
+    writes the rows of the models with at most max_pipes pipes in file_name, as the original script did :
+    results1.csv has the ring model, results2.csv adds the models with 2 pipes, results3.csv all of them
+    rows are in the order of the sweep (number of pipes, source, rank of the tree), not in the order the jobs finished
+    """
+    df = store.read(columns=columns + ['source'], n_pipes=list(range(1, max_pipes+1)))
+    n_pipes = df['n_pipes'].astype(int)
+    source = df['source'].map({s : k for k, s in enumerate(sources)}).fillna(-1)
+    prefix = 'model_' + df['source'].astype(str) + '_' + n_pipes.astype(str)
+    j = pd.to_numeric([m[len(p):] if m.startswith(p) else '' for m, p in zip(df['model_id'], prefix)], errors='coerce')
+    order = pd.DataFrame({'n_pipes' : n_pipes, 'source' : source, 'j' : j}).sort_values(['n_pipes', 'source', 'j'], kind='stable').index
+    df.loc[order, columns].reset_index(drop=True).to_csv(file_name)
+
+
+def sensitivity_study(runner, source, n_pipes, rank, parameters) :
+    """
+    simulates the tree of the given rank for every combination of the values of parameters
+    parameters : dict name -> list of values
+    returns the table of the parameter values and the KPIs of each combination
+    """
+    model_id = 'model_'+source+'_'+str(n_pipes)+str(rank)
+    G = create_G(source)
+    Tree(G).construct_tree(list(unrank(rank, n)))
+    model = PyToMod(G, model_id)
+    model.set_source(source)
+    model.set_n_pipes(n_pipes)
+    model.set_annotations(annotations)
+    if steady_monitor is not None :
+        model.set_steady_monitor(**steady_monitor)
+    open_package(path).write_many({model_id : model.model_text()})
+
+    init_names, init_val = init_parameters(source, n_pipes)
+    names = list(parameters)
+    grid = list(it.product(*[parameters[name] for name in names]))
+    values = np.tile(np.array(init_val, dtype=float), (len(grid), 1))
+    for i, name in enumerate(names) :
+        if name in init_names :
+            values[:, init_names.index(name)] = [point[i] for point in grid]
+    # parameters which are not set by init_parameters are added
+    extra = [i for i, name in enumerate(names) if name not in init_names]
+    init_names = init_names + [names[i] for i in extra]
+    values = np.hstack([values, np.array([[point[i] for i in extra] for point in grid], dtype=float).reshape(len(grid), len(extra))])
+
+    extractor = Extractor(kpi_spec(source, n_pipes), columns[2:])
+    kpis, trajectories, failed = runner.run_multi(model_id, 'Method.'+model_id, open_package(path).files(model_id), n_pipes,
+        extractor, init_names, values, window=window)
+    for k, log in failed :
+        print(model_id, ' parameter set ', k, " : simulation failed. Below is the translation log.")
+        print(log)
+    return pd.concat([pd.DataFrame(grid, columns=names), pd.DataFrame(kpis, columns=extractor.columns)], axis=1)
+
+
+if __name__ == '__main__' :
+
+    tracer.enabled = trace is not None
+
+    # the simulator is started and the Buildings library is loaded once for the ring model
+    # model files are reloaded by the session only when they have been modified
+    pool = SessionPool(1, libraries=libraries, backend=backend)
+    pool.start()
+
+
+    # all usefull variables from simulation are appended to the results store as soon as they are known
+    # after a crash, models already in the store are not simulated again (see store.py)
+    store = ResultStore(os.path.join(working_dir, 'results'), columns + ['source'])
+
+
+    # we first create and simulate model_ring alone
+    # values initialization 
+    model_id = 'model_sea_ring'
+    n_pipes = 1
+    gas_boiler = False
+    heat_pump = False
+    geothermal = False
+    gas_P = np.nan
+    HP_P = np.nan
+    geo_P = np.nan
+    indiv_HP_P = np.nan
+    pump_P = np.nan
                 
-G = ring('sea')
-pos = nx.get_node_attributes(G, 'pos')
+    G = ring('sea')
+    pos = nx.get_node_attributes(G, 'pos')
 
-model_name = 'Method.model_sea_ring'
-model = PyToMod(G, 'model_sea_ring')
-model.set_source('sea')
-model.set_n_pipes(1)
-print(model.write_in_file('Method.mo'))
-L = model.pipe_length()
-
-# Instantiate the Dymola interface and start Dymola and load models, update this line according to the installation folder of Dymola
-dymola = DymolaInterface(os.path.join('C:\Program Files\Dymola 2021x', 'bin64', 'Dymola.exe'))
-
-# Load the library, it may take time, depending on the size of the loaded file
-ok = dymola.openModel(path=os.path.join(working_dir, 'Dymola', 'Buildings-v9.0.0', 'Buildings 9.0.0', 'package.mo'), changeDirectory=False)
-print('Loading OK? : ', ok)
-
-ok = dymola.openModel(path=os.path.join(working_dir, 'Method.mo'), changeDirectory=False)
-print('Loading OK? : ', ok)
-
-# Set up the parameters and simulate the model
-resultFile = 'res'
-
-init_names =[]
-init_val = []
-
-# Building_1 (water for heating)
-init_names += ['source_SST_Building_1.m_flow', 'source_SST_Building_1.T', 'sink_SST_Building_1.p', 'constant_SST_Building_1.k']
-init_val += [1, 273.15+40, 2e5, 273.15+45]
-
-# Building_2 (hot domestic water)
-init_names += ['source_SST_Building_2.m_flow', 'source_SST_Building_2.T', 'sink_SST_Building_2.p', 'constant_SST_Building_2.k']
-init_val += [1, 273.15+12, 2e5, 273.15+60]
-
-# Building_3 (both)
-init_names += ['source_W_SST_Building_3.m_flow', 'source_W_SST_Building_3.T', 'sink_W_SST_Building_3.p', 'constant_W_SST_Building_3.k']
-init_val += [1, 273.15+12, 2e5, 273.15+60]
-init_names += ['source_H_SST_Building_3.m_flow', 'source_H_SST_Building_3.T', 'sink_H_SST_Building_3.p', 'constant_H_SST_Building_3.k']
-init_val += [1, 273.15+40, 2e5, 273.15+45]
-
-# Fluid circulation
-init_names += ['prod_supply_sea.p', 'sink_supply_sea.p']
-init_val += [5e5, 1e5]
-
-# Heat source
-init_names += ['source_sea_supply_sea.m_flow', 'source_sea_supply_sea.T', 'sink_sea_supply_sea.p'] 
-init_val += [5, 273.15+15, 2e5]
-
-
-ok, values = dymola.simulateExtendedModel(problem=model_name, resultFile=resultFile,\
-            startTime=0.0, stopTime=6000, numberOfIntervals=100, \
-            initialNames=init_names, initialValues=init_val)   
-print(ok)
-
-if not ok :
-    print("Simulation failed. Below is the translation log.")
-    log = dymola.getLastErrorLog()
-    print(log)
-            
-if dymola is not None:
-    dymola.close()
-    dymola = None
-
-# Extract the results
-res = sdf.load(os.path.join(working_dir, resultFile+'.mat'))
-t = res['Time'].data
-
-components = ['HP_SST_Building_1', 'HP_SST_Building_2', 'HP_W_SST_Building_3', 'HP_H_SST_Building_3',]
-
-# individual HP power
-for comp in components :
-    l = 0
-    # the value is the average of steady state values
-    while t[l] < 5400 :
-        l += 1
-    indiv_HP_P += np.average(res[comp]['P'].data[l:])
-
-# sea pump power
-geo_P = 5e2
-
-# pump power
-m_flow = res['pipe_Building_1Building_2']['m_flow'].data
-dP = 4e5 
-pump_P = m_flow*0.001*dP
-
-data.append([model_id, n_pipes, gas_boiler, heat_pump, geothermal, gas_P, HP_P, geo_P, indiv_HP_P, pump_P]) 
-
-df1 = pd.DataFrame(data, columns=['model_id', 'n_pipes', 'gas_boiler', 'heat_pump', 'geothermal', 'gas_P', 'HP_P', 'geo_P', 'indiv_HP_P', 'pump_P'])
-df1.to_csv('results1.csv') # save in case the simulation stops
-
-
-# we then create and simulate all 160 other models
-
-i_range = len(sources)
-j_range = len(P_list)
-n_range = [2,3]
-
-for n_pipes in n_range :
-    for i in range(i_range) :
-        for j in range (j_range) :
-                print('n_pipes : ', n_pipes)
-                print('source : ',sources[i])
-                print('configuration ', j)
-
-                # values initialization 
-                model_id = 'model_'+sources[i]+'_'+str(n_pipes)+str(j)
-                n_pipes = n_pipes
-                gas_boiler = False
-                heat_pump = False
-                geothermal = False
-                gas_P = np.nan
-                HP_P = np.nan
-                geo_P = np.nan
-                indiv_HP_P = np.nan
-                pump_P = np.nan
-                
-                G = create_G(sources[i])
-                pos = nx.get_node_attributes(G, 'pos')
-                T = Tree(G)
-                T.construct_tree(list(P_list[j]))
-
-                model_name = 'Method.model_'+sources[i]+'_'+str(n_pipes)+str(j)
-                model = PyToMod(G, 'model_'+sources[i]+'_'+str(n_pipes)+str(j))
-                model.set_source(sources[i])
-                model.set_n_pipes(n_pipes)
-                model.write_in_file('Method.mo')
-                L = model.pipe_length()
-
-                # Instantiate the Dymola interface and start Dymola and load models, update this line according to the installation folder of Dymola
-                dymola = DymolaInterface(os.path.join('C:\Program Files\Dymola 2021x', 'bin64', 'Dymola.exe'))
-
-                # Load the library, it may take time, depending on the size of the loaded file
-                ok = dymola.openModel(path=os.path.join(working_dir, 'Dymola', 'Buildings-v9.0.0', 'Buildings 9.0.0', 'package.mo'), changeDirectory=False)
-                print('Loading OK? : ', ok)
-
-                ok = dymola.openModel(path=os.path.join(working_dir, 'Method.mo'), changeDirectory=False)
-                print('Loading OK? : ', ok)
-
-                # Set up the parameters and simulate the model
-                resultFile = 'res'
-
-                init_names =[]
-                init_val = []
-
-                # Building_1 (water for heating)
-                init_names += ['source_SST_Building_1.m_flow', 'source_SST_Building_1.T', 'sink_SST_Building_1.p', 'constant_SST_Building_1.k']
-                init_val += [1, 273.15+40, 2e5, 273.15+45]
-
-                # Building_2 (hot domestic water)
-                init_names += ['source_SST_Building_2.m_flow', 'source_SST_Building_2.T', 'sink_SST_Building_2.p', 'constant_SST_Building_2.k']
-                init_val += [1, 273.15+12, 2e5, 273.15+60]
-
-                # Building_3 (both)
-                init_names += ['source_W_SST_Building_3.m_flow', 'source_W_SST_Building_3.T', 'sink_W_SST_Building_3.p', 'constant_W_SST_Building_3.k']
-                init_val += [1, 273.15+12, 2e5, 273.15+60]
-                init_names += ['source_H_SST_Building_3.m_flow', 'source_H_SST_Building_3.T', 'sink_H_SST_Building_3.p', 'constant_H_SST_Building_3.k']
-                init_val += [1, 273.15+40, 2e5, 273.15+45]
-
-                # Fluid circulation
-                init_names += ['prod_supply_'+sources[i]+'.p', 'sink_supply_'+sources[i]+'.p']
-                init_val += [5e5, 1e5]
-
-                # Heat source
-                init_names += source_param[n_pipes-1][sources[i]]['names'] 
-                init_val += source_param[n_pipes-1][sources[i]]['val']
-
-
-                ok, values = dymola.simulateExtendedModel(problem=model_name, resultFile=resultFile,\
-                            startTime=0.0, stopTime=6000, numberOfIntervals=100, \
-                            initialNames=init_names, initialValues=init_val)   
-                print(ok)
-
-                if not ok :
-                    print("Simulation failed. Below is the translation log.")
-                    log = dymola.getLastErrorLog()
-                    print(log)
-
-                # Extract the results
-                res = sdf.load(os.path.join(working_dir, resultFile+'.mat'))
-                t = res['Time'].data 
-
-                # Values update
-                # source
-                if 'gas_boiler' in sources[i] :
-                    gas_boiler = True
-                if 'heat_pump' in sources[i] :
-                    heat_pump = True
-                if 'geo' in sources[i] :
-                    geothermal = True
-
-                # HP or gas boiler power
-                for k in range (len(source_results[n_pipes-1][sources[i]]['component'])) :
-                    l = 0
-                    while t[l] < 5400 :
-                        l += 1
-                    P = np.average(res[source_results[n_pipes-1][sources[i]]['component'][k]][source_results[n_pipes-1][sources[i]]['var'][k]].data[l:])
-                    if 'HP' in source_results[n_pipes-1][sources[i]]['component'][k] :
-                        HP_P = P
-                    elif 'boiler' in source_results[n_pipes-1][sources[i]]['component'][k]:
-                        gas_P = P
-
-                # geothermal power
-                if 'geo' in sources[i] :
-                    geo_P = 5e2
-
-                # pump power
-                l = 0
-                while t[l] < 5400 :
-                    l += 1
-                m_flow = np.average(res['hex_SST_Building_1']['m1_flow'].data[l:])
-                dP = 4e5 
-                pump_P = m_flow*dP*0.001
-                
-                data.append([model_id, n_pipes, gas_boiler, heat_pump, geothermal, gas_P, HP_P, geo_P, indiv_HP_P, pump_P]) 
-            
-                if dymola is not None:
-                    dymola.close()
-                    dymola = None
-    if n_pipes == 2 :
-        df2 = pd.DataFrame(data, columns=['model_id', 'n_pipes', 'gas_boiler', 'heat_pump', 'geothermal', 'gas_P', 'HP_P', 'geo_P', 'indiv_HP_P', 'pump_P'])
-        df2.to_csv('results2.csv') # save in case the simulation stops
-
-    if n_pipes == 3 :
-        df3 = pd.DataFrame(data, columns=['model_id', 'n_pipes', 'gas_boiler', 'heat_pump', 'geothermal', 'gas_P', 'HP_P', 'geo_P', 'indiv_HP_P', 'pump_P'])
-        df3.to_csv('results3.csv') # save in case the simulation stops
-
-df = df1.append(df2.append(df3, ignore_index=True), ignore_index=True)
-df.to_csv('results.csv')
+    model_name = 'Method.model_sea_ring'
+    model = PyToMod(G, 'model_sea_ring')
+    model.set_source('sea')
+    model.set_n_pipes(1)
+    with span('write package', 'generation', models=1) :
+        print(model.write_in_file(path))
+    L = model.pipe_length()
 
+    # Set up the parameters and simulate the model
+    resultFile = 'res'
+
+    init_names =[]
+    init_val = []
+
+    # Building_1 (water for heating)
+    init_names += ['source_SST_Building_1.m_flow', 'source_SST_Building_1.T', 'sink_SST_Building_1.p', 'constant_SST_Building_1.k']
+    init_val += [1, 273.15+40, 2e5, 273.15+45]
+
+    # Building_2 (hot domestic water)
+    init_names += ['source_SST_Building_2.m_flow', 'source_SST_Building_2.T', 'sink_SST_Building_2.p', 'constant_SST_Building_2.k']
+    init_val += [1, 273.15+12, 2e5, 273.15+60]
+
+    # Building_3 (both)
+    init_names += ['source_W_SST_Building_3.m_flow', 'source_W_SST_Building_3.T', 'sink_W_SST_Building_3.p', 'constant_W_SST_Building_3.k']
+    init_val += [1, 273.15+12, 2e5, 273.15+60]
+    init_names += ['source_H_SST_Building_3.m_flow', 'source_H_SST_Building_3.T', 'sink_H_SST_Building_3.p', 'constant_H_SST_Building_3.k']
+    init_val += [1, 273.15+40, 2e5, 273.15+45]
+
+    # Fluid circulation
+    init_names += ['prod_supply_sea.p', 'sink_supply_sea.p']
+    init_val += [5e5, 1e5]
+
+    # Heat source
+    init_names += ['source_sea_supply_sea.m_flow', 'source_sea_supply_sea.T', 'sink_sea_supply_sea.p'] 
+    init_val += [5, 273.15+15, 2e5]
+
+
+    ok, values, log = pool.simulate(model_name, packages=open_package(path).files(model_id), resultFile=resultFile,\
+                startTime=0.0, stopTime=6000, numberOfIntervals=100, \
+                initialNames=init_names, initialValues=init_val)   
+    print(ok)
+
+    if not ok :
+        print("Simulation failed. Below is the translation log.")
+        print(log)
+
+    # the licence is given back before starting the workers of the sweep
+    pool.close()
+
+    # Extract the results
+    # only the variables used below are read from the result file
+    res = DsresFile(os.path.join(working_dir, resultFile+'.mat'))
+
+    components = ['HP_SST_Building_1', 'HP_SST_Building_2', 'HP_W_SST_Building_3', 'HP_H_SST_Building_3',]
+
+    # the values are the average of steady state values
+    with span('extract KPIs', 'job') :
+        stats = result_stats(res, [comp+'.P' for comp in components] + ['pipe_Building_1Building_2.m_flow'], 5400)[0]
+
+    # individual HP power
+    for comp in components :
+        indiv_HP_P += stats[comp+'.P']['mean']
+
+    # sea pump power
+    geo_P = 5e2
+
+    # pump power
+    m_flow = stats['pipe_Building_1Building_2.m_flow']['mean']
+    dP = 4e5 
+    pump_P = m_flow*0.001*dP
+
+    if model_id not in store :
+        store.append([model_id, n_pipes, gas_boiler, heat_pump, geothermal, gas_P, HP_P, geo_P, indiv_HP_P, pump_P, 'sea'])
+
+    export_results(store, 'results1.csv', 1)
+
+
+    # we then create and simulate all 160 other models
+    # models are all written in the package first, then simulated in parallel
+    # each job has its own scratch directory and result file
+
+    n_range = [2,3]
+
+    # the trajectories of archive_vars are kept for every model, to compute new KPIs without simulating again
+    archive = TrajectoryArchive(os.path.join(working_dir, 'archive'))
+    # translated models are kept, models of the same structure are translated once
+    runner = SweepRunner(n_workers, scratch_root=os.path.join(working_dir, 'scratch'), libraries=libraries, backend=backend,
+        archive=archive.root, archive_vars=archive_vars, translations=os.path.join(working_dir, 'translations'),
+        trace=trace is not None)
+
+    # results already computed are read from the cache, after a crash the sweep resumes for free
+    cache = ResultCache(os.path.join(working_dir, 'cache'))
+
+    if mode == 'optimize' :
+
+        def evaluate(candidates) :
+            '''
+            Returns the total power of each candidate ((source, n_pipes), sequence)
+            the candidates of a generation are simulated together, one block per number of pipes,
+            through the cache, the store and the equivalent networks as in the sweep
+            '''
+            costs = {}
+            for n_pipes in n_range :
+                trees = {}
+                for (source, m), seq in candidates :
+                    if m == n_pipes :
+                        with span('graph', 'generation') :
+                            G = create_G(source)
+                            Tree(G).construct_tree(list(seq))
+                        trees.setdefault(source, []).append((rank(seq, n), G))
+                if not trees :
+                    continue
+                rows = simulate_trees(trees, n_pipes, runner, cache, store, archive)
+                for source in trees :
+                    for j, G in trees[source] :
+                        row = rows.get('model_'+source+'_'+str(n_pipes)+str(j))
+                        # gas_P or HP_P are nan when the source has no such unit, a failed simulation is never chosen
+                        powers = np.array([np.nan if row is None else row[columns.index(name)] for name in targets], dtype=float)
+                        costs[(source, n_pipes, j)] = np.inf if np.isnan(powers).all() else np.nansum(powers)
+            return [costs[(source, m, rank(seq, n))] for (source, m), seq in candidates]
+
+        search = GeneticSearch(n, [(source, n_pipes) for source in sources for n_pipes in n_range], evaluate,
+            population=optimization['population'], elite=optimization['elite'], tournament=optimization['tournament'],
+            crossover=optimization['crossover'], mutation=optimization['mutation'], seed=seed)
+        ((source, n_pipes), seq), cost = search.run(optimization['generations'], optimization['patience'])
+        print('best configuration : ', source, ', ', n_pipes, ' pipes, Prüfer sequence ', list(seq),
+            ', model_'+source+'_'+str(n_pipes)+str(rank(seq, n)), ', total power ', cost)
+        for n_pipes in n_range :
+            export_results(store, 'results'+str(n_pipes)+'.csv', n_pipes)
+
+    else :
+        for n_pipes in n_range :
+            trees = {} # source -> (rank, graph) of the trees to simulate
+            for source in sources :
+                trees[source] = []
+                for j, seq in prufer_sequences() :
+                    with span('graph', 'generation') :
+                        G = create_G(source)
+                        T = Tree(G)
+                        T.construct_tree(list(seq))
+                    trees[source].append((j, G))
+                if reject_dominated :
+                    with span('prescreen', 'screening') :
+                        trees[source] = prescreen(trees[source], source, n_pipes)
+                if screening is not None :
+                    with span('screen', 'screening') :
+                        trees[source] = screen(trees[source], source, n_pipes, store)
+
+            simulate_trees(trees, n_pipes, runner, cache, store, archive)
+            export_results(store, 'results'+str(n_pipes)+'.csv', n_pipes)
+
+    if sensitivity is not None :
+        sensitivity_study(runner, sensitivity['source'], sensitivity['n_pipes'], sensitivity['rank'],
+            sensitivity['parameters']).to_csv('sensitivity.csv')
+
+    runner.close()
+
+    # the parts written during the sweep are merged, so that the next reads open a single file
+    with span('compact store', 'store') :
+        store.compact()
+    export_results(store, 'results.csv')
+
+    if trace is not None :
+        tracer.write_chrome_trace(trace)
+        print(tracer.summary().to_string(float_format=lambda x : '%.4g' % x))
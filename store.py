@@ -0,0 +1,191 @@
+# Append-only store of the results table
+# Rows are written in small immutable part files, so that adding rows never rewrites
+# the previous ones, and a crash loses at most the rows not flushed yet
+# Parts are parquet files if pyarrow is installed, csv files otherwise
+# index.jsonl records the part files with the values of their key columns,
+# so that filtered reads only open the parts that can match
+
+import os
+import json
+import pandas as pd
+
+try :
+    import pyarrow
+    import pyarrow.parquet
+except ImportError :
+    pyarrow = None
+
+
+def part_number(name) :
+    return int(name.split('-')[1])
+
+
+class ResultStore :
+    '''
+    Results table stored in a directory of part files
+    '''
+
+    def __init__(self, root, columns, keys=('n_pipes', 'source'), flush_rows=100, format=None) :
+        '''
+        root : directory of the store, created if it does not exist
+        columns : columns of the table, the first one identifies a row (model_id)
+        keys : columns indexed for each part, used to skip parts in read
+        flush_rows : number of rows kept in memory before being written in a new part,
+                     flush writes them earlier, e.g at the end of a block of jobs
+        format : 'parquet' or 'csv', by default parquet if pyarrow is installed
+        '''
+        self.root = root
+        self.columns = list(columns)
+        self.keys = [k for k in keys if k in self.columns]
+        self.flush_rows = flush_rows
+        self.format = format or ('parquet' if pyarrow is not None else 'csv')
+        if self.format == 'parquet' and pyarrow is None :
+            raise ImportError('pyarrow is needed for the parquet format')
+        os.makedirs(root, exist_ok=True)
+        self.buffer = []
+        self.load_index()
+
+    def index_path(self) :
+        return os.path.join(self.root, 'index.jsonl')
+
+    def load_index(self) :
+        '''
+        Reads the index, and indexes the parts written just before a crash
+        '''
+        self.parts = {} # part file -> {'ids' : ids, key : values}
+        broken = False
+        if os.path.isfile(self.index_path()) :
+            with open(self.index_path(), 'r') as f :
+                for line in f :
+                    try :
+                        entry = json.loads(line)
+                    except ValueError : # line cut by a crash
+                        broken = True
+                        continue
+                    if os.path.isfile(os.path.join(self.root, entry['part'])) :
+                        self.parts[entry['part']] = entry
+        if broken : # the index is rewritten, so that new entries are not appended to the cut line
+            self.write_index()
+        # parts missing from the index : written just before a crash, or left by a compaction
+        last = max([part_number(name) for name in self.parts] + [-1])
+        for name in sorted(os.listdir(self.root)) :
+            if name.startswith('part-') and not name.endswith('.tmp') and name not in self.parts :
+                if part_number(name) > last :
+                    self.add_to_index(name, self.read_part(name))
+                else : # its rows are already in the compacted part
+                    os.remove(os.path.join(self.root, name))
+        self.ids = set()
+        for entry in self.parts.values() :
+            self.ids.update(entry['ids'])
+        self.n_parts = max([part_number(name) for name in self.parts] + [-1]) + 1
+
+    def entry(self, name, df) :
+        entry = {'part' : name, 'ids' : [str(x) for x in df[self.columns[0]]]}
+        for k in self.keys :
+            entry[k] = sorted(set([str(x) for x in df[k]]))
+        return entry
+
+    def write_index(self) :
+        tmp = self.index_path() + '.tmp'
+        with open(tmp, 'w') as f :
+            f.write(''.join([json.dumps(entry) + '\n' for entry in self.parts.values()]))
+        os.replace(tmp, self.index_path())
+
+    def add_to_index(self, name, df) :
+        entry = self.entry(name, df)
+        with open(self.index_path(), 'a') as f :
+            f.write(json.dumps(entry) + '\n')
+        self.parts[name] = entry
+
+    def __contains__(self, row_id) :
+        return str(row_id) in self.ids or str(row_id) in [str(row[0]) for row in self.buffer]
+
+    def __len__(self) :
+        return len(self.ids) + len(self.buffer)
+
+    def append(self, row) :
+        '''
+        Adds a row, written with the next flush
+        row : list of values in the order of columns
+        '''
+        if len(row) != len(self.columns) :
+            raise ValueError('row has ' + str(len(row)) + ' values for ' + str(len(self.columns)) + ' columns')
+        self.buffer.append(list(row))
+        if len(self.buffer) >= self.flush_rows :
+            self.flush()
+
+    def flush(self) :
+        '''
+        Writes the buffered rows in a new part file, the cost does not depend on the size of the table
+        '''
+        if not self.buffer :
+            return
+        df = pd.DataFrame(self.buffer, columns=self.columns)
+        name = 'part-' + str(self.n_parts).zfill(8) + '-' + str(os.getpid()) + '.' + self.format
+        self.write_part(name, df)
+        self.add_to_index(name, df)
+        self.ids.update([str(x) for x in df[self.columns[0]]])
+        self.n_parts += 1
+        self.buffer = []
+
+    def write_part(self, name, df) :
+        # the part is written aside and renamed, so that a part file is always complete
+        tmp = os.path.join(self.root, name + '.tmp')
+        if self.format == 'parquet' :
+            pyarrow.parquet.write_table(pyarrow.Table.from_pandas(df, preserve_index=False), tmp)
+        else :
+            df.to_csv(tmp, index=False)
+        os.replace(tmp, os.path.join(self.root, name))
+
+    def read_part(self, name, columns=None) :
+        path = os.path.join(self.root, name)
+        if name.endswith('.parquet') :
+            return pyarrow.parquet.read_table(path, columns=columns).to_pandas()
+        return pd.read_csv(path, usecols=columns)
+
+    def read(self, columns=None, **filters) :
+        '''
+        Returns the rows matching filters as a DataFrame
+        filters : column=value or column=list of values, e.g model_id='model_gas_boiler_20', n_pipes=[2,3]
+        only the parts whose index matches are read
+        '''
+        self.flush()
+        filters = {k : [str(x) for x in (v if isinstance(v, (list, tuple, set)) else [v])] for k, v in filters.items()}
+        names = []
+        for name, entry in sorted(self.parts.items()) :
+            match = True
+            for k, values in filters.items() :
+                indexed = entry['ids'] if k == self.columns[0] else entry.get(k)
+                if indexed is not None and not set(indexed) & set(values) :
+                    match = False
+            if match :
+                names.append(name)
+
+        read_columns = None if columns is None else list(dict.fromkeys(list(columns) + list(filters)))
+        dfs = [self.read_part(name, read_columns) for name in names]
+        if not dfs :
+            return pd.DataFrame(columns=self.columns if columns is None else list(columns))
+        df = pd.concat(dfs, ignore_index=True)
+        for k, values in filters.items() :
+            df = df[df[k].astype(str).isin(values)]
+        if columns is not None :
+            df = df[list(columns)]
+        return df.reset_index(drop=True)
+
+    def compact(self) :
+        '''
+        Merges all parts in a single one, to read the whole table faster
+        '''
+        self.flush()
+        if len(self.parts) <= 1 :
+            return
+        df = self.read()
+        old = list(self.parts)
+        name = 'part-' + str(self.n_parts).zfill(8) + '-' + str(os.getpid()) + '.' + self.format
+        self.write_part(name, df)
+        # the new index is complete before the old parts are removed
+        self.parts = {name : self.entry(name, df)}
+        self.write_index()
+        for part in old :
+            os.remove(os.path.join(self.root, part))
+        self.n_parts += 1
@@ -0,0 +1,100 @@
+# Surrogate model of the sweep results
+# gas_P, HP_P and pump_P are regressed on features of the network graph (ridge regression),
+# trained on the results already simulated, so that only the most promising trees
+# and a few random ones are sent to the simulator
+
+import math
+import numpy as np
+
+targets = ['gas_P', 'HP_P', 'pump_P']
+
+feature_names = ['n_pipes', 'length', 'pipe_length', 'max_distance', 'mean_distance', 'demand_distance',
+    'max_depth', 'mean_depth', 'leaves', 'max_degree', 'supply_degree']
+
+
+def graph_features(G, root, n_pipes) :
+    '''
+    Returns the feature vector of tree G, rooted at the supply root
+    distances are along the pipes, from the supply to each building
+    demand_distance weights the distance of a building by its number of demands (heating, DHW)
+    '''
+    depth = {root : 0}
+    distance = {root : 0.}
+    order = [root]
+    length = 0
+    for node in order : # breadth first
+        for neighbor in G.neighbors(node) :
+            if neighbor not in depth :
+                x1, y1 = G.nodes[node]['pos']
+                x2, y2 = G.nodes[neighbor]['pos']
+                l = int(math.sqrt((x1-x2)**2 + (y1-y2)**2)) # as in PyToMod
+                length += l
+                depth[neighbor] = depth[node] + 1
+                distance[neighbor] = distance[node] + l
+                order.append(neighbor)
+
+    buildings = order[1:]
+    d = np.array([distance[b] for b in buildings], dtype=float)
+    h = np.array([depth[b] for b in buildings], dtype=float)
+    demand = np.array([(G.nodes[b].get('T_heating', 0) > 0) + (G.nodes[b].get('T_DHW', 0) > 0) for b in buildings], dtype=float)
+    degree = np.array([G.degree(b) for b in buildings])
+    return np.array([n_pipes, length, length*n_pipes, d.max(), d.mean(), np.sum(demand*d) / max(np.sum(demand), 1),
+        h.max(), h.mean(), np.sum(degree == 1), max(degree.max(), G.degree(root)), G.degree(root)], dtype=float)
+
+
+class Surrogate :
+    '''
+    Ridge regression of each target on standardized features
+    '''
+
+    def __init__(self, alpha=1.) :
+        '''
+        alpha : weight of the penalty on the coefficients
+        '''
+        self.alpha = alpha
+
+    def fit(self, X, Y) :
+        '''
+        X : (samples, features) array
+        Y : (samples, targets) array, nan values are ignored for their target
+        '''
+        X = np.asarray(X, dtype=float)
+        Y = np.asarray(Y, dtype=float).reshape(len(X), -1)
+        self.mean = X.mean(axis=0)
+        self.scale = X.std(axis=0)
+        self.scale[self.scale == 0] = 1.
+        Z = (X - self.mean) / self.scale
+
+        self.coef = np.zeros((Z.shape[1], Y.shape[1]))
+        self.intercept = np.full(Y.shape[1], np.nan)
+        for k in range (Y.shape[1]) :
+            known = ~np.isnan(Y[:, k])
+            if not known.any() : # this target is not defined for this source, its prediction is nan
+                continue
+            z, y = Z[known], Y[known, k]
+            self.intercept[k] = y.mean()
+            self.coef[:, k] = np.linalg.solve(z.T @ z + self.alpha*np.eye(z.shape[1]), z.T @ (y - y.mean()))
+        return self
+
+    def predict(self, X) :
+        Z = (np.asarray(X, dtype=float).reshape(-1, len(self.mean)) - self.mean) / self.scale
+        return Z @ self.coef + self.intercept
+
+
+def select(scores, top=0.2, explore=0.05, seed=None) :
+    '''
+    Returns the sorted indexes of the candidates to simulate
+    scores : predicted objective of each candidate, the lowest is the best
+    top : fraction of the candidates with the best scores
+    explore : fraction of the other candidates drawn at random, so that the surrogate learns
+              from the trees it does not favour
+    '''
+    scores = np.asarray(scores, dtype=float)
+    n = len(scores)
+    order = np.argsort(scores, kind='stable')
+    n_top = int(math.ceil(top*n))
+    rest = order[n_top:]
+    n_explore = min(len(rest), int(math.ceil(explore*n)))
+    rng = np.random.default_rng(seed)
+    explored = rng.choice(rest, n_explore, replace=False) if n_explore else np.empty(0, dtype=int)
+    return np.sort(np.concatenate([order[:n_top], explored]).astype(int))
@@ -0,0 +1,319 @@
+# Parallel execution of the sweep
+# Each process of the pool owns one warm simulator session (see session.py)
+# Each job is simulated in its own scratch directory, so that result files
+# of simultaneous runs do not overwrite each other
+
+import os
+import shutil
+import time
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from session import Session, SessionError, BUILDINGS_PATH
+from dsres import DsresFile
+from archive import TrajectoryArchive, default_vars
+from translation import TranslationCache, DsinFile
+from tracing import tracer, span
+
+columns = ['model_id', 'n_pipes', 'gas_boiler', 'heat_pump', 'geothermal', 'gas_P', 'HP_P', 'geo_P', 'indiv_HP_P', 'pump_P']
+
+# session of the current worker process, and number of restarts allowed per call
+_session = None
+_max_restarts = 3
+
+
+def _init_worker(libraries, backend, kwargs, trace=True, max_restarts=3) :
+    global _session, _max_restarts
+    # the spans of the start of the session are sent back with the first job
+    tracer.clear() # spans inherited from the main process when it is forked
+    tracer.enabled = trace
+    _max_restarts = max_restarts
+    _session = Session(libraries, backend, **kwargs).start()
+
+
+def session_call(method, *args, **kwargs) :
+    '''
+    Calls method of the session of the worker, as SessionPool.simulate :
+    if the simulator crashes during the call, it is restarted and the call is retried
+    a session found dead by an earlier job is restarted first, so that one crash does not fail every later job
+    '''
+    for attempt in range (_max_restarts+1) :
+        if not _session.is_alive() :
+            _session.restart()
+        try :
+            return getattr(_session, method)(*args, **kwargs)
+        except Exception :
+            if _session.is_alive() :
+                raise # error unrelated to the session itself
+            _session.close()
+    raise SessionError(method + ' : session crashed ' + str(_max_restarts+1) + ' times')
+
+
+def extract_row(res, job) :
+    '''
+    res : result file opened with DsresFile
+    job : job dictionary (see run_job)
+    Returns the row of the results table for this job
+    '''
+    # all variables are read in a single pass, and reduced as compiled in the extractor
+    return [job['model_id'], job['n_pipes']] + job['kpis'](res, job['t_steady'], job['window'])
+
+
+def simulate_translated(job) :
+    '''
+    Runs the executable of the structure of the job, translated first if it is not in the translation cache
+    Returns ok, log, or None if the parameters of the job cannot be set after translation
+    '''
+    scratch = job['scratch']
+    translations = TranslationCache(job['translations'])
+    directory = translations.get(job['structure'])
+    if directory is None :
+        ok, files, log = session_call('translate', job['problem'], job['packages'], workdir=scratch)
+        if not ok :
+            return ok, log
+        directory = translations.put(job['structure'], scratch, files)
+
+    # only the start values and the experiment are changed
+    with span('write dsin', 'job') :
+        dsin = DsinFile(os.path.join(directory, 'dsin.txt'))
+        try :
+            dsin.set_values(job['init_names'], job['init_val'])
+        except KeyError :
+            return None
+        dsin.set_experiment(0.0, job['stopTime'], 100)
+        dsin.write(os.path.join(scratch, 'dsin.txt'))
+    return session_call('run_translated', directory, os.path.join(scratch, 'dsin.txt'), workdir=scratch, resultFile='res')
+
+
+def run_job(job) :
+    '''
+    Simulates one job in the session of the current process
+    job : dictionary with keys
+        model_id, problem, packages, source, n_pipes, kpis,
+        init_names, init_val, scratch, stopTime, t_steady, window, keep, archive, archive_vars,
+        translations, structure
+    Returns model_id, ok, row (None if the simulation failed), log, spans recorded by the process (see tracing.py)
+    '''
+    with span('job', 'job', model_id=job['model_id']) :
+        model_id, ok, row, log = simulate_job(job)
+    return model_id, ok, row, log, tracer.drain()
+
+
+def simulate_job(job) :
+    scratch = job['scratch']
+    os.makedirs(scratch, exist_ok=True)
+    translated = None
+    if job['translations'] is not None and job['structure'] is not None :
+        translated = simulate_translated(job)
+    if translated is not None :
+        ok, log = translated
+    else : # parameter evaluated during the translation, the model is translated with its parameters
+        ok, values, log = session_call('simulate', job['problem'], job['packages'], workdir=scratch,
+                resultFile='res', startTime=0.0, stopTime=job['stopTime'], numberOfIntervals=100,
+                initialNames=job['init_names'], initialValues=job['init_val'])
+
+    row = None
+    if ok :
+        with DsresFile(os.path.join(scratch, 'res.mat')) as res :
+            with span('extract KPIs', 'job') :
+                row = extract_row(res, job)
+            if job['archive'] is not None :
+                # the variables of the KPIs are archived too, so that the row can be computed again
+                with span('archive', 'job') :
+                    TrajectoryArchive(job['archive']).write_result(job['model_id'], res, job['archive_vars'], job['kpis'].names)
+    if not job['keep'] :
+        shutil.rmtree(scratch, ignore_errors=True)
+    return job['model_id'], ok, row, log
+
+
+def run_batch(batch) :
+    '''
+    Simulates one model for several parameter sets in the session of the current process,
+    the model is translated once for all sets
+    batch : dictionary with keys
+        model_id, problem, packages, n_pipes, kpis, init_names, values, first,
+        scratch, stopTime, numberOfIntervals, t_steady, window, variables, keep
+    values : list of parameter sets, first : index of the first set in the whole study
+    Returns first, KPIs (sets, kpis), trajectories (sets, variables, numberOfIntervals+1) on the output grid,
+    ok of each set, log, spans recorded by the process
+    '''
+    with span('batch', 'job', model_id=batch['model_id'], first=batch['first']) :
+        results = simulate_batch(batch)
+    return results + (tracer.drain(),)
+
+
+def simulate_batch(batch) :
+    scratch = batch['scratch']
+    os.makedirs(scratch, exist_ok=True)
+    ok, oks, log = session_call('simulate_multi', batch['problem'], batch['packages'], workdir=scratch,
+            resultFile='res', startTime=0.0, stopTime=batch['stopTime'], numberOfIntervals=batch['numberOfIntervals'],
+            initialNames=batch['init_names'], initialValues=batch['values'])
+
+    n = len(batch['values'])
+    oks = list(oks) + [False]*(n-len(oks))
+    kpis = np.full((n, len(batch['kpis'].columns)), np.nan)
+    # Dymola adds the event times to the output grid, trajectories are resampled on the grid
+    # a simulation terminated in steady state keeps its last values until stopTime
+    t = np.linspace(0.0, batch['stopTime'], batch['numberOfIntervals']+1)
+    trajectories = np.full((n, len(batch['variables']), len(t)), np.nan)
+    for k in range (n) :
+        if oks[k] :
+            with DsresFile(os.path.join(scratch, 'res' + str(k+1) + '.mat')) as res, span('extract KPIs', 'job') :
+                kpis[k] = batch['kpis'](res, batch['t_steady'], batch['window'])
+                if batch['variables'] :
+                    t_res, values = res.read(batch['variables'])
+                    for i, name in enumerate(batch['variables']) :
+                        trajectories[k, i] = np.interp(t, t_res, values[name])
+    if not batch['keep'] :
+        shutil.rmtree(scratch, ignore_errors=True)
+    return batch['first'], kpis, trajectories, oks, log
+
+
+class SweepRunner :
+    '''
+    Pool of processes simulating jobs in parallel
+    Rows are merged into the results table as soon as jobs finish
+    '''
+
+    def __init__(self, n_workers=1, scratch_root='scratch', libraries=(BUILDINGS_PATH,), keep=False,
+            backend='dymola', archive=None, archive_vars=default_vars, translations=None, trace=True, max_restarts=3, **kwargs) :
+        '''
+        n_workers : number of processes, each one runs a simulator and holds one licence of it,
+                    at most the number of licences available
+        scratch_root : directory in which each job gets its own directory
+        libraries : loaded once in each worker
+        keep : if True, scratch directories are kept after the extraction of results
+        backend : name of the simulator backend, see backend.py
+        archive : directory of the trajectory archive (see archive.py), None to keep no trajectories
+        archive_vars : patterns of the names of the variables archived
+        translations : directory of the translation cache (see translation.py), None to translate every job
+        trace : if True, the spans of the workers are merged in the tracer of this process (see tracing.py)
+        max_restarts : number of restarts of a crashed simulator allowed per call in a worker (see session_call)
+        kwargs : passed to the backend
+        '''
+        self.n_workers = n_workers
+        self.scratch_root = os.path.abspath(scratch_root)
+        self.keep = keep
+        self.archive = None if archive is None else os.path.abspath(archive)
+        self.archive_vars = list(archive_vars)
+        self.translations = None if translations is None else os.path.abspath(translations)
+        self.initargs = (list(libraries), backend, kwargs, trace, max_restarts)
+        self.executor = self.new_executor()
+
+    def new_executor(self) :
+        return ProcessPoolExecutor(self.n_workers, initializer=_init_worker, initargs=self.initargs)
+
+    def restart_broken(self, broken) :
+        '''
+        Replaces the pool if a worker process died abruptly, so that the next calls of run can still be submitted
+        '''
+        if broken :
+            print('a worker process died, the pool of workers is restarted')
+            self.executor.shutdown(wait=False)
+            self.executor = self.new_executor()
+
+    def close(self) :
+        self.executor.shutdown()
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *exc) :
+        self.close()
+
+    def job(self, model_id, problem, packages, source, n_pipes, kpis, init_names, init_val, stopTime=6000, t_steady=5400,
+            structure=None, window=None) :
+        '''
+        Returns the job dictionary expected by run_job
+        kpis : kpi.Extractor giving the columns of the row after model_id and n_pipes
+        t_steady : start of the steady state window (s), None to detect it (see kpi.py)
+        window : length of the steady state window at the end of the result, used instead of t_steady
+                 for models with a steady state monitor (see PyToMod.set_steady_monitor)
+        structure : structure key of the model (see translation.structure_key), None to translate it
+        '''
+        return {'model_id' : model_id, 'problem' : problem, 'packages' : list(packages),
+            'source' : source, 'n_pipes' : n_pipes, 'kpis' : kpis,
+            'init_names' : list(init_names), 'init_val' : list(init_val),
+            'scratch' : os.path.join(self.scratch_root, model_id),
+            'stopTime' : stopTime, 't_steady' : t_steady, 'window' : window, 'keep' : self.keep,
+            'archive' : self.archive, 'archive_vars' : self.archive_vars,
+            'translations' : self.translations, 'structure' : structure}
+
+    def run(self, jobs, data=None, on_row=None) :
+        '''
+        Simulates all jobs, printing progress as they finish
+        data : list of rows, completed in place
+        on_row : function called with each new row, as soon as its job is finished
+        Returns data and the list of failed jobs as (model_id, log)
+        '''
+        if data is None :
+            data = []
+        failed = []
+        broken = False
+        start = time.time()
+        futures = {self.executor.submit(run_job, job) : job['model_id'] for job in jobs}
+        for k, future in enumerate(as_completed(futures)) :
+            # an exception of a job, or the death of its worker, only fails this job
+            try :
+                model_id, ok, row, log, spans = future.result()
+            except Exception as e :
+                broken = broken or isinstance(e, BrokenProcessPool)
+                model_id, ok, row, log, spans = futures[future], False, None, traceback.format_exc(), []
+            tracer.extend(spans)
+            if ok :
+                data.append(row)
+                if on_row is not None :
+                    on_row(row)
+            else :
+                failed.append((model_id, log))
+            print('[' + str(k+1) + '/' + str(len(jobs)) + '] ' + model_id + (' ok' if ok else ' FAILED')
+                + ' (' + str(round(time.time()-start, 1)) + ' s)')
+        self.restart_broken(broken)
+        return data, failed
+
+    def run_multi(self, model_id, problem, packages, n_pipes, kpis, init_names, values, variables=(),
+            stopTime=6000, numberOfIntervals=100, t_steady=5400, window=None) :
+        '''
+        Simulates one model for every parameter set of values, as simulateMultiExtendedModel
+        the sets are split in one batch per worker, each worker translates the model once
+        init_names : names of the parameters, values : (sets, parameters) array
+        variables : names of the variables whose trajectories are returned
+        window : length of the steady state window at the end of the results, see job
+        Returns the KPIs (sets, len(kpis.columns)), the trajectories (sets, len(variables), numberOfIntervals+1)
+        and the list of the failed sets as (index, log), the values of a failed set are nan
+        '''
+        values = np.asarray(values, dtype=float).reshape(-1, len(init_names))
+        n_sets = len(values)
+        if not n_sets : # empty grid
+            return np.full((0, len(kpis.columns)), np.nan), np.full((0, len(variables), numberOfIntervals+1), np.nan), []
+        size = -(-n_sets // self.n_workers)
+        batches = [{'model_id' : model_id, 'problem' : problem, 'packages' : list(packages), 'n_pipes' : n_pipes,
+            'kpis' : kpis, 'init_names' : list(init_names), 'values' : values[first:first+size].tolist(), 'first' : first,
+            'scratch' : os.path.join(self.scratch_root, model_id + '_' + str(first)),
+            'stopTime' : stopTime, 'numberOfIntervals' : numberOfIntervals, 't_steady' : t_steady, 'window' : window,
+            'variables' : list(variables), 'keep' : self.keep} for first in range (0, n_sets, size)]
+
+        results = np.full((n_sets, len(kpis.columns)), np.nan)
+        trajectories = np.full((n_sets, len(variables), numberOfIntervals+1), np.nan)
+        failed = []
+        broken = False
+        start = time.time()
+        futures = {self.executor.submit(run_batch, batch) : batch for batch in batches}
+        for k, future in enumerate(as_completed(futures)) :
+            try :
+                first, batch_results, batch_trajectories, oks, log, spans = future.result()
+            except Exception as e :
+                broken = broken or isinstance(e, BrokenProcessPool)
+                batch = futures[future]
+                first, oks, log, spans = batch['first'], [False]*len(batch['values']), traceback.format_exc(), []
+                batch_results = np.full((len(oks), len(kpis.columns)), np.nan)
+                batch_trajectories = np.full((len(oks), len(variables), numberOfIntervals+1), np.nan)
+            tracer.extend(spans)
+            results[first:first+len(oks)] = batch_results
+            trajectories[first:first+len(oks)] = batch_trajectories
+            failed += [(first+i, log) for i, ok in enumerate(oks) if not ok]
+            print('[' + str(k+1) + '/' + str(len(batches)) + '] ' + model_id + ' : ' + str(sum(oks)) + '/' + str(len(oks))
+                + ' parameter sets ok (' + str(round(time.time()-start, 1)) + ' s)')
+        self.restart_broken(broken)
+        return results, trajectories, sorted(failed)
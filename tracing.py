@@ -0,0 +1,142 @@
+# Timed spans of the stages of the pipeline
+# Each process records its own spans : graph construction, model generation, package writes,
+# library loads, translation, simulation, extraction of the results ...
+# The spans of the workers are sent back with the results of their jobs and merged in the main process
+# Spans are exported as a Chrome trace (open it in chrome://tracing or https://ui.perfetto.dev)
+# and summarized per stage, with the peak resident memory of the processes
+
+import os
+import sys
+import time
+import json
+import threading
+from contextlib import contextmanager
+import pandas as pd
+
+try :
+    import resource
+except ImportError : # Windows
+    resource = None
+
+
+def peak_rss() :
+    '''
+    Returns the peak resident memory of the current process (MB), None if it is unknown
+    '''
+    if resource is not None :
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10 # bytes on macOS, kB on Linux
+    try :
+        import psutil
+        memory = psutil.Process().memory_info()
+        return getattr(memory, 'peak_wset', memory.rss) / 2**20
+    except ImportError :
+        return None
+
+
+class Tracer :
+    '''
+    Spans recorded by the current process
+    '''
+
+    def __init__(self, enabled=True) :
+        self.enabled = enabled
+        self.spans = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, category='', **args) :
+        '''
+        Records the wall time of the block, e.g with tracer.span('generate', model_id=model_id) : ...
+        args are shown with the span in the trace
+        '''
+        if not self.enabled :
+            yield
+            return
+        start = time.time()
+        t0 = time.perf_counter()
+        try :
+            yield
+        finally :
+            self.add(name, category, start, time.perf_counter() - t0, args)
+
+    def add(self, name, category, start, duration, args={}) :
+        '''
+        start : epoch time (s), so that the spans of several processes can be merged
+        duration : (s)
+        '''
+        span = {'name' : name, 'cat' : category, 'start' : start, 'duration' : duration,
+            'pid' : os.getpid(), 'tid' : threading.get_ident(), 'args' : dict(args), 'rss' : peak_rss()}
+        with self.lock :
+            self.spans.append(span)
+
+    def drain(self) :
+        '''
+        Returns the spans recorded since the last call and forgets them, used by the workers
+        '''
+        with self.lock :
+            spans, self.spans = self.spans, []
+        return spans
+
+    def extend(self, spans) :
+        '''
+        Adds spans recorded by another process
+        '''
+        with self.lock :
+            self.spans += list(spans)
+
+    def clear(self) :
+        self.drain()
+
+    def chrome_trace(self) :
+        '''
+        Returns the spans in the Chrome trace event format : one complete event per span,
+        and the peak resident memory of each process as a counter
+        '''
+        events = []
+        main = os.getpid()
+        for pid in sorted(set([span['pid'] for span in self.spans])) :
+            events.append({'name' : 'process_name', 'ph' : 'M', 'pid' : pid, 'tid' : 0,
+                'args' : {'name' : 'main' if pid == main else 'worker ' + str(pid)}})
+        for span in sorted(self.spans, key=lambda span : span['start']) :
+            ts = span['start'] * 1e6
+            events.append({'name' : span['name'], 'cat' : span['cat'], 'ph' : 'X', 'ts' : ts, 'dur' : span['duration'] * 1e6,
+                'pid' : span['pid'], 'tid' : span['tid'], 'args' : {k : str(v) for k, v in span['args'].items()}})
+            if span['rss'] is not None :
+                events.append({'name' : 'peak RSS (MB)', 'ph' : 'C', 'ts' : ts + span['duration'] * 1e6,
+                    'pid' : span['pid'], 'args' : {'MB' : round(span['rss'], 1)}})
+        return {'traceEvents' : events, 'displayTimeUnit' : 'ms'}
+
+    def write_chrome_trace(self, path) :
+        with open(path, 'w') as f :
+            json.dump(self.chrome_trace(), f)
+
+    def summary(self) :
+        '''
+        Returns a table of the stages : number of spans, total, mean and max time, share of the wall time
+        of the trace (above 100% for stages running in parallel), peak resident memory of the processes
+        '''
+        columns = ['stage', 'category', 'count', 'total (s)', 'mean (ms)', 'max (ms)', 'share (%)', 'peak RSS (MB)']
+        if not self.spans :
+            return pd.DataFrame(columns=columns).set_index('stage')
+        df = pd.DataFrame(self.spans)
+        wall = (df['start'] + df['duration']).max() - df['start'].min()
+        table = df.groupby('name', sort=False).agg(category=('cat', 'first'), count=('duration', 'size'),
+            total=('duration', 'sum'), mean=('duration', 'mean'), max=('duration', 'max'), rss=('rss', 'max'))
+        table['mean'] *= 1e3
+        table['max'] *= 1e3
+        table.insert(5, 'share', 100 * table['total'] / wall if wall > 0 else float('nan'))
+        table = table.sort_values('total', ascending=False).reset_index()
+        table.columns = columns
+        return table.set_index('stage')
+
+
+# tracer of the current process
+tracer = Tracer()
+
+
+def span(name, category='', **args) :
+    '''
+    Span of the tracer of the current process, see Tracer.span
+    '''
+    return tracer.span(name, category, **args)
@@ -0,0 +1,181 @@
+# Cache of translated models
+# Translating and compiling a model takes much longer than running it : the simulation executable
+# (dymosim) and its input file dsin.txt are kept under a hash of the structure of the model,
+# i.e its script without its name, so that models with the same structure are translated once
+# Later runs only rewrite the start values and the experiment of dsin.txt, and launch the executable
+
+import os
+import re
+import shutil
+from cache import _hash, model_body
+
+# header of a matrix of dsin.txt, e.g 'double initialValue(38,6)'
+matrix_header = re.compile(r'^(char|double|int)\s+(\w+)\((\d+),(\d+)\)\s*$')
+
+# rows of the experiment matrix
+experiment_names = ['StartTime', 'StopTime', 'Increment', 'nInterval', 'Tolerance', 'MaxFixedStep', 'Algorithm']
+
+
+def structure_key(txt, libraries=(), backend='dymola') :
+    '''
+    Key of a translated model : hash of the model script without its name, of the libraries and of the backend
+    parameters set with initialNames are not part of the key, they are rewritten in dsin.txt
+    '''
+    return _hash([model_body(txt), [os.path.abspath(path) for path in libraries], backend])
+
+
+def format_value(x) :
+    return repr(float(x))
+
+
+class DsinFile :
+    '''
+    Input file of a simulation executable (dsin.txt)
+    Only the experiment and the initial values are parsed, the rest of the file is kept as is
+    '''
+
+    def __init__(self, path) :
+        with open(path, 'r') as f :
+            self.lines = f.read().split('\n')
+        self.blocks = {} # matrix name -> (first line, last line + 1, rows, columns)
+        i = 0
+        while i < len(self.lines) :
+            match = matrix_header.match(self.lines[i])
+            if match is None :
+                i += 1
+                continue
+            type, name, rows, cols = match.group(1), match.group(2), int(match.group(3)), int(match.group(4))
+            j = i + 1
+            if type == 'char' : # one string per line
+                j += rows
+            else : # rows*cols numbers, a row may be written on several lines
+                count = 0
+                while count < rows*cols and j < len(self.lines) :
+                    count += len(self.lines[j].split('#')[0].split())
+                    j += 1
+            self.blocks[name] = (i, j, rows, cols)
+            i = j
+
+        start, end, rows, cols = self.blocks['initialName']
+        self.names = [line.rstrip() for line in self.lines[start+1:end]]
+        self.index = {name : k for k, name in enumerate(self.names)}
+        self.values = self.matrix('initialValue')
+        self.experiment = [row[0] for row in self.matrix('experiment')]
+
+    def matrix(self, name) :
+        start, end, rows, cols = self.blocks[name]
+        numbers = [float(x.replace('D', 'E')) for line in self.lines[start+1:end] for x in line.split('#')[0].split()]
+        return [numbers[k*cols:(k+1)*cols] for k in range (rows)]
+
+    def set_values(self, names, values) :
+        '''
+        Sets the start values of variables names, as initialNames / initialValues of simulateExtendedModel
+        Raises KeyError if a variable is not in the file, e.g a parameter evaluated during the translation
+        '''
+        for name, value in zip(names, values) :
+            if name not in self.index :
+                raise KeyError(name + ' cannot be set after translation')
+            self.values[self.index[name]][1] = float(value)
+
+    def set_experiment(self, startTime=0.0, stopTime=1.0, numberOfIntervals=500) :
+        self.experiment[0] = float(startTime)
+        self.experiment[1] = float(stopTime)
+        self.experiment[2] = 0.
+        self.experiment[3] = int(numberOfIntervals)
+
+    def write(self, path) :
+        '''
+        Writes the file with the new experiment and initial values
+        '''
+        replaced = {}
+        start, end, rows, cols = self.blocks['experiment']
+        replaced[start] = (end, [self.lines[start]] + [format_value(x).rjust(24) + '   # ' + name
+            for x, name in zip(self.experiment, experiment_names)])
+        start, end, rows, cols = self.blocks['initialValue']
+        replaced[start] = (end, [self.lines[start]] + [' ' + ' '.join([format_value(x).rjust(24) for x in row]) + '   # ' + name
+            for row, name in zip(self.values, self.names)])
+
+        lines = []
+        i = 0
+        while i < len(self.lines) :
+            if i in replaced :
+                i, block = replaced[i]
+                lines += block
+            else :
+                lines.append(self.lines[i])
+                i += 1
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f :
+            f.write('\n'.join(lines))
+        os.replace(tmp, path)
+
+
+def write_dsin(path, names, values, startTime=0.0, stopTime=1.0, numberOfIntervals=500) :
+    '''
+    Writes a minimal dsin.txt with the experiment and the start values of parameters names
+    '''
+    width = max([len(name) for name in names] + [1])
+    lines = ['#1', 'char Aclass(3,24)', 'Adymosim', '1.4', 'Modelica experiment file', '', '',
+        'double experiment(7,1)']
+    lines += [format_value(x).rjust(24) + '   # ' + name for x, name in
+        zip([startTime, stopTime, 0, numberOfIntervals, 1e-4, 0, 8], experiment_names)]
+    lines += ['', 'char initialName(' + str(len(names)) + ',' + str(width) + ')'] + list(names)
+    # kind -1 : start value that can be changed, value, min, max, category 1 : parameter, type 280
+    lines += ['', 'double initialValue(' + str(len(names)) + ',6)']
+    lines += [' ' + ' '.join([format_value(x).rjust(24) for x in [-1, value, 0, 0, 1, 280]]) + '   # ' + name
+        for name, value in zip(names, values)]
+    with open(path, 'w') as f :
+        f.write('\n'.join(lines) + '\n')
+
+
+class TranslationCache :
+    '''
+    Directory of translated models, one directory per structure key with the executable and dsin.txt
+    '''
+
+    def __init__(self, root='translations', max_entries=1000) :
+        '''
+        root : directory of the cache
+        max_entries : maximum number of translated models kept, the least recently used are removed
+        '''
+        self.root = root
+        self.max_entries = max_entries
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key) :
+        return os.path.join(self.root, key)
+
+    def get(self, key) :
+        '''
+        Returns the directory of the translated model, or None
+        '''
+        path = self.path(key)
+        if not os.path.isfile(os.path.join(path, 'dsin.txt')) :
+            return None
+        os.utime(path)
+        return path
+
+    def put(self, key, workdir, files) :
+        '''
+        Copies files of workdir, written by the translation, in the cache and returns their directory
+        the entry is written aside and renamed, so that a directory of the cache is always complete
+        '''
+        tmp = os.path.join(self.root, '.' + key + '.' + str(os.getpid()))
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in files :
+            shutil.copy2(os.path.join(workdir, name), os.path.join(tmp, name))
+        try :
+            os.replace(tmp, self.path(key))
+        except OSError : # translated at the same time by another worker
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+        return self.path(key)
+
+    def evict(self) :
+        entries = [entry for entry in os.scandir(self.root) if not entry.name.startswith('.')]
+        if len(entries) <= self.max_entries :
+            return
+        entries.sort(key=lambda entry : entry.stat().st_mtime)
+        for entry in entries[:len(entries) - int(0.9*self.max_entries)] :
+            shutil.rmtree(entry.path, ignore_errors=True)
@@ -1,5 +1,150 @@
+import math
+import heapq
+import hashlib
+import random
+import numpy as np
 import networkx as nx
 
+
+def prufer_edges(seq, n) :
+    '''
+    Returns the edges of the tree of Prüfer sequence seq, as a (n-1, 2) array of node indices
+    seq : sequence of length n-2, values in range(n)
+    the smallest leaf is found with a heap, so decoding is O(n log n)
+    edges are (seq[i], leaf), in the order of the Prüfer algorithm
+    '''
+    degree = [1] * n
+    for p in seq :
+        degree[p] += 1
+    leaves = [i for i in range (n) if degree[i] == 1]
+    heapq.heapify(leaves)
+
+    edges = np.empty((n-1, 2), dtype=int)
+    for i, p in enumerate(seq) :
+        leaf = heapq.heappop(leaves)
+        edges[i] = p, leaf
+        degree[p] -= 1
+        if degree[p] == 1 :
+            heapq.heappush(leaves, p)
+    edges[n-2] = heapq.heappop(leaves), heapq.heappop(leaves)
+    return edges
+
+
+def decode_batch(seqs, n) :
+    '''
+    Decodes many Prüfer sequences at once, without building graphs
+    seqs : (m, n-2) array of sequences
+    Returns a (m, n-1, 2) array of edges, same order as prufer_edges
+    Each step is vectorized over the m sequences, so cost is O(n²) numpy operations on m rows
+    '''
+    seqs = np.asarray(seqs, dtype=int)
+    seqs = seqs.reshape(len(seqs), n-2)
+    m = len(seqs)
+    rows = np.arange(m)
+    degree = np.ones((m, n), dtype=int)
+    for j in range (n-2) :
+        np.add.at(degree, (rows, seqs[:, j]), 1)
+
+    edges = np.empty((m, n-1, 2), dtype=int)
+    for i in range (n-2) :
+        leaf = np.argmax(degree == 1, axis=1) # smallest leaf of each tree
+        p = seqs[:, i]
+        edges[:, i, 0] = p
+        edges[:, i, 1] = leaf
+        degree[rows, leaf] = 0
+        degree[rows, p] -= 1
+    edges[:, n-2] = np.nonzero(degree == 1)[1].reshape(m, 2)
+    return edges
+
+
+# Enumeration of the n^(n-2) labelled trees on n nodes, one per Prüfer sequence
+# sequences are ranked in lexicographic order : the rank is the sequence read as a number in base n
+# so that a configuration index can be decoded directly, without enumerating the previous ones
+
+def n_sequences(n) :
+    '''
+    Returns the number of Prüfer sequences (labelled trees) on n nodes
+    '''
+    return n**(n-2) if n >= 2 else 1
+
+
+def rank(seq, n) :
+    '''
+    Returns the index of seq in the lexicographic order of sequences on n nodes
+    '''
+    r = 0
+    for p in seq :
+        r = r*n + int(p)
+    return r
+
+
+def unrank(r, n) :
+    '''
+    Returns the Prüfer sequence of index r, inverse of rank
+    '''
+    if not 0 <= r < n_sequences(n) :
+        raise IndexError('rank ' + str(r) + ' out of range for n = ' + str(n))
+    seq = [0] * max(n-2, 0)
+    for i in range (len(seq)-1, -1, -1) :
+        r, seq[i] = divmod(r, n)
+    return tuple(seq)
+
+
+def shard_range(n, shard, n_shards) :
+    '''
+    Returns the ranks (start, stop) of part shard of the sequences on n nodes, split in n_shards contiguous parts
+    '''
+    if not 0 <= shard < n_shards :
+        raise IndexError('shard ' + str(shard) + ' out of range for ' + str(n_shards) + ' shards')
+    total = n_sequences(n)
+    return total*shard // n_shards, total*(shard+1) // n_shards
+
+
+def iter_sequences(n, start=0, stop=None, shard=None, n_shards=1) :
+    '''
+    Yields (rank, sequence) for the sequences of ranks start to stop, in lexicographic order
+    nothing is stored, each sequence is obtained from the previous one like an odometer
+    shard : if given, only part shard of n_shards is yielded (see shard_range)
+    '''
+    if shard is not None :
+        start, stop = shard_range(n, shard, n_shards)
+    if stop is None :
+        stop = n_sequences(n)
+    if start >= stop :
+        return
+    seq = list(unrank(start, n))
+    for r in range (start, stop) :
+        yield r, tuple(seq)
+        i = len(seq) - 1
+        while i >= 0 and seq[i] == n-1 :
+            seq[i] = 0
+            i -= 1
+        if i >= 0 :
+            seq[i] += 1
+
+
+def sample_sequences(n, size, seed=None, replace=False) :
+    '''
+    Returns a list of (rank, sequence) of random trees on n nodes, sorted by rank
+    every labelled tree has the same probability
+    replace : if False, the trees are distinct and size is at most n_sequences(n)
+    used when the exhaustive enumeration is too long
+    '''
+    total = n_sequences(n)
+    if not replace and size > total :
+        raise ValueError('cannot sample ' + str(size) + ' distinct trees among ' + str(total))
+    rng = random.Random(seed)
+    if replace :
+        ranks = [rng.randrange(total) for i in range (size)]
+    elif total < 2**62 :
+        ranks = rng.sample(range(total), size)
+    else : # len(range) would overflow, but size is negligible compared to total
+        ranks = set()
+        while len(ranks) < size :
+            ranks.add(rng.randrange(total))
+    return [(r, unrank(r, n)) for r in sorted(ranks)]
+
+
 class Tree :
 
     def __init__(self, graph, inplace=True) :
@@ -15,24 +160,48 @@ class Tree :
         adds edges to the graph
         according to Prüfer algorithm
         seq : list of length n-2
+        the Tree object is not modified, it can decode several sequences
         '''
 
         nodes = list(self.G.nodes)
-        P = seq.copy()
-        V = self.V
-
-        for i in range (len(V)-2) :
-            k = 0
-            while V[k] in P :
-                k += 1
-            self.G.add_edge(nodes[P[0]], nodes[V[k]])
-            V.remove(V[k])
-            P.remove(P[0])
-        
-        self.G.add_edge(nodes[V[0]], nodes[V[1]])
+        for u, v in prufer_edges(seq, len(self.V)) :
+            self.G.add_edge(nodes[u], nodes[v])
 
         nx.set_edge_attributes(self.G, 'a', 'direction')
 
         return self.G
 
 
+def canonical_hash(graph, root, node_attrs=('is_supply_heating', 'T_heating', 'T_DHW'), lengths=True, fixed=()) :
+    '''
+    Returns a hash of the tree graph rooted at root, invariant under relabelling of the other nodes
+    two trees have the same hash when they are the same network up to the names of the buildings
+    node_attrs : node attributes that distinguish the buildings (demand)
+    lengths : if True, the pipe lengths (truncated as in PyToMod) are part of the network,
+              otherwise only the topology and the demand are compared
+    fixed : nodes which keep their names, e.g buildings whose components are read by the KPIs
+            or set by the parameters : only the other buildings may be relabelled
+    Each subtree is hashed from its root attributes and the sorted hashes of its children (AHU),
+    the tree is walked without recursion so that deep trees are supported
+    '''
+    parent = {root : None}
+    order = [root]
+    for node in order : # breadth first, order grows while walking it
+        for neighbor in graph.neighbors(node) :
+            if neighbor not in parent :
+                parent[neighbor] = node
+                order.append(neighbor)
+    if len(order) != len(graph) or graph.number_of_edges() != len(graph) - 1 :
+        raise ValueError('graph is not a tree')
+
+    children = {node : [] for node in order}
+    for node in reversed(order) : # children are hashed before their parent
+        attrs = [graph.nodes[node].get(a) for a in node_attrs] + [str(node) if node in fixed else None]
+        h = hashlib.sha1(repr((attrs, sorted(children[node]))).encode()).hexdigest()
+        if parent[node] is not None :
+            if lengths :
+                x1, y1 = graph.nodes[node]['pos']
+                x2, y2 = graph.nodes[parent[node]]['pos']
+                h = str(int(math.sqrt((x1-x2)**2 + (y1-y2)**2))) + ':' + h
+            children[parent[node]].append(h)
+    return h